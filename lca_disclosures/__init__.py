@@ -1 +1,9 @@
-from .base import BaseDisclosure, from_file
+from .base import BaseDisclosure, from_file, merge_disclosures
+from .utils import lazy_import
+
+# builders that need brightway2 or lcopt are only imported when first used
+Bw2Disclosure = lazy_import('lca_disclosures.brightway2.disclosure', 'Bw2Disclosure')
+DisclosureImporter = lazy_import('lca_disclosures.brightway2.importer', 'DisclosureImporter')
+import_disclosures = lazy_import('lca_disclosures.brightway2.batch', 'import_disclosures')
+write_disclosure = lazy_import('lca_disclosures.brightway2.writer', 'write_disclosure')
+LcoptDisclosure = lazy_import('lca_disclosures.lcopt.disclosure', 'LcoptDisclosure')
@@ -1,2 +1,4 @@
-from .disclosure import BaseDisclosure
+from .disclosure import BaseDisclosure, StaticDisclosure
 from .from_file import from_file
+from .merge import merge_disclosures
+from .registry import FlowRegistry
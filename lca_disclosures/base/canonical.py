@@ -0,0 +1,122 @@
+"""
+Canonical ordering and content hashing of disclosures.
+
+The order of background flows and emissions produced by a builder depends on the order in which it meets them (e.g.
+brightway exchange iteration order), so two builds of the same model may differ only by a permutation.  In canonical
+order the flows of each section are sorted by their identity keys (see flows.py), with foreground flow 0, the
+functional unit, kept first.  As for diff() and delta(), identity keys must be unique within a section.  The matrix
+entries are renumbered with the same permutations and put in row-major order with a single numpy lexsort; the
+uncertainty arrays follow their entries.
+
+fingerprint() is a sha256 hash of a disclosure's content: its flow records and the rows, columns and values of each
+matrix (and of any uncertainty), fed to the hash one chunk at a time, so out-of-core matrices are never loaded whole.
+Two disclosures in canonical order have the same fingerprint exactly when they have the same content.
+"""
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from ..utils import arrays_to_coo
+from .flows import FLOW_SECTIONS, MATRIX_ROWS, flow_keys, flow_to_dict, key_index, reindex_flows
+from .ooc import ChunkedMatrix
+
+FINGERPRINT_VERSION = b'lca-disclosure-fingerprint-1'
+
+
+def _encode(value):
+    return json.dumps(value, sort_keys=True, separators=(',', ':'))
+
+
+def canonical_order(flows, section):
+    """
+    The positions of a section's flows in canonical order: sorted by identity key, with foreground flow 0 kept first.
+    Raises ValueError if two flows share an identity key, since their order could then only come from the input.
+    :param flows: the flow list
+    :param section: one of FLOW_SECTIONS
+    :return: array of positions
+    """
+    keys = flow_keys(flows, section)
+    key_index(keys, section)
+    start = 1 if section == 'foreground flows' and len(flows) else 0
+    sort_keys = [_encode(list(k)) for k in keys[start:]]
+    order = sorted(range(len(sort_keys)), key=sort_keys.__getitem__)
+    return np.array(list(range(start)) + [i + start for i in order], dtype=np.int64)
+
+
+def _inverse(order):
+    inverse = np.empty(len(order), dtype=np.int64)
+    inverse[order] = np.arange(len(order))
+    return inverse
+
+
+def canonical_disclosure(disclosure):
+    """
+    A disclosure's content in canonical order.  Out-of-core matrices are written to chunked storage next to the
+    originals.
+    :param disclosure: a BaseDisclosure
+    :return: (6-tuple, uncertainty dict or None)
+    """
+    orders = {section: canonical_order(disclosure.flows(section), section) for section in FLOW_SECTIONS}
+    flows = tuple(reindex_flows(disclosure.flows(section)[i] for i in orders[section].tolist())
+                  for section in FLOW_SECTIONS)
+    columns = _inverse(orders['foreground flows'])
+
+    folder = None
+    matrices = []
+    entry_orders = {}
+    for name in ('Af', 'Ad', 'Bf'):
+        rows, cols, vals = disclosure.matrix_arrays(name)
+        rows = _inverse(orders[MATRIX_ROWS[name]])[rows]
+        cols = columns[cols]
+        entry_orders[name] = order = np.lexsort((cols, rows))
+        rows, cols, vals = rows[order], cols[order], np.asarray(vals)[order]
+
+        matrix = getattr(disclosure, name)
+        if isinstance(matrix, ChunkedMatrix):
+            if folder is None:
+                folder = tempfile.mkdtemp(prefix='canonical-', dir=os.path.dirname(matrix.folder))
+            matrices.append(ChunkedMatrix.write(os.path.join(folder, name), [(rows, cols, vals)]))
+        else:
+            matrices.append(arrays_to_coo(rows, cols, vals))
+
+    uncertainty = None
+    if disclosure.uncertainty is not None:
+        uncertainty = {name: u[entry_orders[name]] for name, u in disclosure.uncertainty.items()}
+
+    return flows + tuple(matrices), uncertainty
+
+
+def fingerprint(disclosure):
+    """
+    sha256 hash of a disclosure's flows, matrices and uncertainty.  Matrices are hashed chunk by chunk, as
+    little-endian int64 rows and columns and float64 values.
+    :param disclosure: a BaseDisclosure
+    :return: hex digest
+    """
+    h = hashlib.sha256(FINGERPRINT_VERSION)
+    for section in FLOW_SECTIONS:
+        flows = disclosure.flows(section)
+        h.update('\n{}:{}\n'.format(section, len(flows)).encode('utf-8'))
+        for f in flows:
+            h.update(_encode(flow_to_dict(f)).encode('utf-8'))
+            h.update(b'\n')
+
+    uncertainty = disclosure.uncertainty or {}
+    for name in ('Af', 'Ad', 'Bf'):
+        h.update('\n{}:{}x{}\n'.format(name, *disclosure.matrix_shape(name)).encode('utf-8'))
+        # one hash per array, so that the result does not depend on the chunk size
+        parts = [hashlib.sha256() for _ in range(3)]
+        for chunk in disclosure.matrix_chunks(name):
+            for part, values, dtype in zip(parts, chunk, ('<i8', '<i8', '<f8')):
+                part.update(np.ascontiguousarray(values, dtype=dtype).tobytes())
+        for part in parts:
+            h.update(part.digest())
+        u = uncertainty.get(name)
+        if u is not None:
+            h.update('\nuncertainty:{}\n'.format(len(u)).encode('utf-8'))
+            for field in u.dtype.names:
+                h.update(np.ascontiguousarray(u[field], dtype=u.dtype[field].newbyteorder('<')).tobytes())
+    return h.hexdigest()
@@ -0,0 +1,80 @@
+"""
+Contributions of foreground flows to the aggregated results.
+
+With x the foreground activity levels ((I - Af) x = e_0), foreground flow j contributes Ad[i, j] x[j] to background
+flow i and Bf[i, j] x[j] to emission i: the entries of Ad diag(x) and Bf diag(x), whose row sums are the aggregated
+results.  Contributions are computed entry by entry from the COO arrays (chunk by chunk out of core), so no dense
+matrix is built, and only the top_k largest contributors (by magnitude) of each background flow and emission are kept.
+"""
+from collections import namedtuple
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+
+class ContributionResult(namedtuple('ContributionResult', ('activity', 'totals', 'top', 'other'))):
+    """
+    activity is the foreground activity levels x.  totals maps 'Ad' and 'Bf' to the aggregated results (Ad x and
+    Bf x); top maps them to sparse (n, p) csr matrices holding the top_k contributions of each row, and other to the
+    part of each total not covered by them.
+    """
+    __slots__ = ()
+
+    def contributors(self, name, row):
+        """
+        The kept contributors of one background flow or emission, largest first
+        :param name: 'Ad' or 'Bf'
+        :param row: index of the background flow or emission
+        :return: list of (foreground flow index, contribution)
+        """
+        matrix = self.top[name]
+        start, stop = matrix.indptr[row], matrix.indptr[row + 1]
+        cols, vals = matrix.indices[start:stop], matrix.data[start:stop]
+        order = np.lexsort((cols, -np.abs(vals)))
+        return list(zip(cols[order].tolist(), vals[order].tolist()))
+
+
+def _top_per_row(rows, cols, vals, top_k):
+    """
+    Keep the top_k entries of largest magnitude in each row; ties go to the lower column
+    """
+    if top_k is None or not len(vals):
+        return rows, cols, vals
+    order = np.lexsort((cols, -np.abs(vals), rows))
+    rows, cols, vals = rows[order], cols[order], vals[order]
+    starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+    rank = np.arange(len(rows)) - np.repeat(starts, np.diff(np.r_[starts, len(rows)]))
+    keep = rank < top_k
+    return rows[keep], cols[keep], vals[keep]
+
+
+def contributions(disclosure, top_k=10):
+    """
+    Top contributors among the foreground flows to each background flow and emission
+    :param disclosure: a BaseDisclosure
+    :param top_k: contributors kept per background flow or emission; None keeps them all
+    :return: ContributionResult
+    """
+    if top_k is not None and top_k < 1:
+        raise ValueError('top_k must be at least 1, or None')
+    p = len(disclosure.foreground_flows)
+    demand = np.zeros(p)
+    if p:
+        demand[0] = 1.0
+    x = disclosure.factorisation().solve(demand) if p else demand
+
+    totals, top, other = {}, {}, {}
+    for name in ('Ad', 'Bf'):
+        shape = disclosure.matrix_shape(name)
+        total = np.zeros(shape[0])
+        kept = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0))
+        for rows, cols, vals in disclosure.matrix_chunks(name):
+            contribution = vals * x[cols]
+            total += np.bincount(rows, weights=contribution, minlength=shape[0])
+            # candidates from this chunk compete with those kept so far
+            kept = _top_per_row(*[np.concatenate(pair) for pair in zip(kept, (rows, cols, contribution))],
+                                top_k=top_k)
+        top[name] = csr_matrix((kept[2], (kept[0], kept[1])), shape=shape)
+        totals[name] = total
+        other[name] = total - np.bincount(kept[0], weights=kept[2], minlength=shape[0])
+    return ContributionResult(x, totals, top, other)
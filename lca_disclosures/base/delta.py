@@ -0,0 +1,257 @@
+"""
+Delta-encoded disclosure versions.
+
+A delta file describes a disclosure as changes to a base disclosure file, for series of versions in which only a few
+flows and coefficients change.  It is written by BaseDisclosure.write_delta() and read by from_file(), which loads
+the base (itself possibly a delta) and applies the patch.
+
+    {"delta": {"version": 1, "base": <path of the base file, relative to the delta>,
+               "base fingerprint": <fingerprint of the base>, "fingerprint": <fingerprint of the result>},
+     <flow section>: {"length": n, "kept": [[base position, position, count], ...], "removed": [base positions],
+                      "changed": [[base position, flow], ...], "added": [flow, ...]},
+     <matrix name>: {"shape": [rows, cols], "removed": [[row, col], ...], "changed": [[[row, col], value], ...],
+                     "added": [[[row, col], value], ...]}}
+
+Flows are matched by identity key.  Runs of flows that are unchanged (apart from their index) are stored as "kept"
+ranges of the base list; flows whose key is in the base but whose record differs are "changed", and the rest are
+"added".  Matrix coordinates in the patch are positions in the new flow lists.  Base entries whose row or column flow
+was removed are dropped implicitly.
+
+The reconstructed matrices have their entries in row-major order; "fingerprint" is that of the new disclosure with
+its entries in this order, so a delta can be checked end to end.  Uncertainty is not carried by deltas.  The "delta"
+member must come first in the file, so that from_file can recognise a delta without parsing it.
+"""
+import json
+import os
+import re
+
+import numpy as np
+
+from ..utils import arrays_to_coo, coo_to_arrays
+from .flows import FLOW_SECTIONS, MATRIX_ROWS, flow_keys, flow_to_dict, key_index, reindex_flows
+
+DELTA_VERSION = 1
+
+_DELTA_HEAD = re.compile(r'\s*\{\s*"delta"\s*:')
+
+MATRICES = ('Af', 'Ad', 'Bf')
+
+
+def is_delta(path):
+    """
+    True if the JSON file at path is a delta
+    """
+    with open(path) as fp:
+        return _DELTA_HEAD.match(fp.read(64)) is not None
+
+
+def _record(flow):
+    record = dict(flow_to_dict(flow))
+    record.pop('index', None)
+    return record
+
+
+def _runs(base_positions):
+    """
+    [base start, start, count] for each run of consecutive positions mapped to consecutive base positions (-1 for
+    positions that are not mapped)
+    """
+    mapped = np.flatnonzero(base_positions >= 0)
+    if not len(mapped):
+        return []
+    breaks = np.flatnonzero((np.diff(mapped) != 1) | (np.diff(base_positions[mapped]) != 1)) + 1
+    starts = np.r_[0, breaks]
+    counts = np.diff(np.r_[starts, len(mapped)])
+    return [[int(base_positions[mapped[s]]), int(mapped[s]), int(n)] for s, n in zip(starts, counts)]
+
+
+def _flow_patch(base_flows, new_flows, section):
+    """
+    :return: (patch, array mapping base positions to new positions, -1 for removed flows)
+    """
+    base_index = key_index(flow_keys(base_flows, section), section)
+    new_keys = flow_keys(new_flows, section)
+    key_index(new_keys, section)
+
+    kept = np.full(len(new_flows), -1, dtype=np.int64)
+    base_to_new = np.full(len(base_flows), -1, dtype=np.int64)
+    changed, added = [], []
+    for i, (key, flow) in enumerate(zip(new_keys, new_flows)):
+        j = base_index.get(key)
+        if j is None:
+            added.append(dict(_record(flow), index=i))
+            continue
+        base_to_new[j] = i
+        if _record(base_flows[j]) == _record(flow):
+            kept[i] = j
+        else:
+            changed.append([j, dict(_record(flow), index=i)])
+
+    patch = {
+        'length': len(new_flows),
+        'kept': _runs(kept),
+        'removed': np.flatnonzero(base_to_new < 0).tolist(),
+        'changed': changed,
+        'added': added,
+    }
+    return patch, base_to_new
+
+
+def _mapped_entries(base, name, maps):
+    """
+    The base entries of a matrix in the new coordinates, dropping those whose flows were removed
+    """
+    rows, cols, vals = base.matrix_arrays(name)
+    rows, cols = maps[MATRIX_ROWS[name]][rows], maps['foreground flows'][cols]
+    present = (rows >= 0) & (cols >= 0)
+    return rows[present], cols[present], np.asarray(vals)[present]
+
+
+def _sorted_linear(rows, cols, vals, n_cols):
+    linear = rows * n_cols + cols
+    order = np.argsort(linear, kind='stable')
+    linear = linear[order]
+    if len(linear) > 1 and np.any(linear[1:] == linear[:-1]):
+        raise ValueError('Duplicate matrix entries cannot be delta-encoded')
+    return linear, vals[order]
+
+
+def _row_major(disclosure):
+    """
+    The disclosure's content with each matrix's entries in row-major order
+    """
+    matrices = []
+    for name in MATRICES:
+        rows, cols, vals = disclosure.matrix_arrays(name)
+        order = np.lexsort((cols, rows))
+        matrices.append(arrays_to_coo(rows[order], cols[order], np.asarray(vals)[order]))
+    return tuple(disclosure.disclosure[:3]) + tuple(matrices)
+
+
+def _fingerprint(disclosure_tuple):
+    from .disclosure import StaticDisclosure
+    return StaticDisclosure(disclosure_tuple).fingerprint
+
+
+def make_delta(base, new, base_path):
+    """
+    The delta from one disclosure to another
+    :param base: the base BaseDisclosure
+    :param new: the new BaseDisclosure
+    :param base_path: the base's file, as it should be referenced from the delta (see write_delta)
+    :return: the delta document (a dict)
+    """
+    delta = {'delta': {
+        'version': DELTA_VERSION,
+        'base': base_path,
+        'base fingerprint': base.fingerprint,
+        'fingerprint': _fingerprint(_row_major(new)),
+    }}
+
+    maps = {}
+    for section in FLOW_SECTIONS:
+        delta[section], maps[section] = _flow_patch(base.flows(section), new.flows(section), section)
+
+    n_cols = len(new.foreground_flows)
+    for name in MATRICES:
+        base_linear, base_vals = _sorted_linear(*_mapped_entries(base, name, maps), n_cols=n_cols)
+        new_linear, new_vals = _sorted_linear(*new.matrix_arrays(name), n_cols=n_cols)
+
+        pos = np.searchsorted(new_linear, base_linear)
+        valid = pos < len(new_linear)
+        in_new = np.zeros(len(base_linear), dtype=bool)
+        in_new[valid] = new_linear[pos[valid]] == base_linear[valid]
+        in_base = np.zeros(len(new_linear), dtype=bool)
+        in_base[pos[in_new]] = True
+        changed = pos[in_new][new_vals[pos[in_new]] != base_vals[in_new]]
+
+        removed = base_linear[~in_new]
+        delta[name] = {
+            'shape': list(new.matrix_shape(name)),
+            'removed': np.stack([removed // n_cols, removed % n_cols], axis=1).tolist() if n_cols else [],
+            'changed': arrays_to_coo(new_linear[changed] // max(n_cols, 1), new_linear[changed] % max(n_cols, 1),
+                                     new_vals[changed]),
+            'added': arrays_to_coo(new_linear[~in_base] // max(n_cols, 1), new_linear[~in_base] % max(n_cols, 1),
+                                   new_vals[~in_base]),
+        }
+    return delta
+
+
+def _apply_flows(base_flows, patch, section):
+    length = patch['length']
+    flows = [None] * length
+    base_to_new = np.full(len(base_flows), -1, dtype=np.int64)
+    for base_start, start, count in patch['kept']:
+        flows[start:start + count] = base_flows[base_start:base_start + count]
+        base_to_new[base_start:base_start + count] = np.arange(start, start + count)
+    for base_position, flow in patch['changed']:
+        flows[flow['index']] = flow
+        base_to_new[base_position] = flow['index']
+    for flow in patch['added']:
+        flows[flow['index']] = flow
+    if any(f is None for f in flows):
+        raise ValueError('Malformed delta: {} does not give every flow'.format(section))
+    return reindex_flows(flows), base_to_new
+
+
+def apply_delta(base, delta, verify=True):
+    """
+    Reconstruct a disclosure from its base and a delta
+    :param base: the base BaseDisclosure
+    :param delta: the delta document
+    :param verify: check the base's and the result's fingerprints against those recorded in the delta
+    :return: the disclosure 6-tuple
+    """
+    header = delta['delta']
+    if header.get('version') != DELTA_VERSION:
+        raise ValueError('Unsupported delta version {}'.format(header.get('version')))
+    if verify and base.fingerprint != header['base fingerprint']:
+        raise ValueError('The base disclosure {} does not match the delta'.format(header['base']))
+
+    flows, maps = [], {}
+    for section in FLOW_SECTIONS:
+        section_flows, maps[section] = _apply_flows(base.flows(section), delta[section], section)
+        flows.append(section_flows)
+
+    n_cols = len(flows[0])
+    matrices = []
+    for name in MATRICES:
+        patch = delta[name]
+        linear, vals = _sorted_linear(*_mapped_entries(base, name, maps), n_cols=n_cols)
+
+        removed = np.array(patch['removed'], dtype=np.int64).reshape(-1, 2)
+        keep = ~np.isin(linear, removed[:, 0] * n_cols + removed[:, 1])
+        linear, vals = linear[keep], vals[keep]
+
+        rows, cols, changed = coo_to_arrays(patch['changed'])
+        pos = np.searchsorted(linear, rows * n_cols + cols)
+        if np.any(pos >= len(linear)) or np.any(linear[np.minimum(pos, len(linear) - 1)] != rows * n_cols + cols):
+            raise ValueError('Malformed delta: changed {} entries are not in the base'.format(name))
+        vals = vals.copy()
+        vals[pos] = changed
+
+        rows, cols, added = coo_to_arrays(patch['added'])
+        linear = np.concatenate([linear, rows * n_cols + cols])
+        vals = np.concatenate([vals, added])
+        order = np.argsort(linear, kind='stable')
+        linear, vals = linear[order], vals[order]
+        matrices.append(arrays_to_coo(linear // max(n_cols, 1), linear % max(n_cols, 1), vals))
+
+    result = tuple(flows) + tuple(matrices)
+    if verify and _fingerprint(result) != header['fingerprint']:
+        raise ValueError('The disclosure reconstructed from the delta does not match its fingerprint')
+    return result
+
+
+def read_delta(path, load, verify=True):
+    """
+    Read a delta file and apply it to its base
+    :param path: the delta file
+    :param load: function loading the base disclosure from its path (e.g. from_file)
+    :param verify: check fingerprints (see apply_delta)
+    :return: (disclosure 6-tuple, the delta document)
+    """
+    with open(path) as fp:
+        delta = json.load(fp)
+    base_path = os.path.join(os.path.dirname(os.path.abspath(path)), delta['delta']['base'])
+    return apply_delta(load(base_path), delta, verify=verify), delta
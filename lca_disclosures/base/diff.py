@@ -0,0 +1,169 @@
+"""
+Comparison of two disclosures.
+
+Flows are aligned by identity key (see flows.py), so two disclosures can be compared even if their flows are listed in
+different orders.  Matrix entries are compared by translating both sets of COO coordinates into a shared key space,
+sorting the resulting linear indices and merging them, which takes O(nnz log nnz).
+"""
+from collections import namedtuple
+
+import numpy as np
+
+from .flows import FLOW_SECTIONS, MATRIX_ROWS, flow_keys, key_index
+
+DiffRecord = namedtuple('DiffRecord', ('change', 'section', 'row', 'col', 'old', 'new'))
+DiffRecord.__doc__ = """
+One difference between two disclosures.
+
+change is 'added', 'removed' or 'changed'.  For flow records, section is a flow list name, row is the flow's identity
+key, col is None and old/new are the flow entries.  For matrix records, section is 'Af', 'Ad' or 'Bf', row and col are
+the identity keys of the row and column flows, and old/new are the coefficients (None where absent).
+"""
+
+MATRICES = ('Af', 'Ad', 'Bf')
+
+
+class KeyAlignment(object):
+    """
+    Alignment of one flow list of two disclosures in a shared key space.
+
+    keys lists every key found in either disclosure (those of the first, in order, followed by those only in the
+    second); a_ids and b_ids map positions in each disclosure's flow list to positions in keys.
+    """
+    def __init__(self, a_flows, b_flows, section):
+        a_keys = flow_keys(a_flows, section)
+        b_keys = flow_keys(b_flows, section)
+        a_index = key_index(a_keys, section)
+        key_index(b_keys, section)
+
+        self.keys = list(a_keys)
+        index = dict(a_index)
+        b_ids = np.empty(len(b_keys), dtype=np.int64)
+        for i, k in enumerate(b_keys):
+            j = index.get(k)
+            if j is None:
+                j = index[k] = len(self.keys)
+                self.keys.append(k)
+            b_ids[i] = j
+
+        self.a_ids = np.arange(len(a_keys), dtype=np.int64)
+        self.b_ids = b_ids
+        self.size = len(self.keys)
+
+    def removed(self):
+        """positions in the first flow list whose key is absent from the second"""
+        present = np.zeros(self.size, dtype=bool)
+        present[self.b_ids] = True
+        return np.flatnonzero(~present[self.a_ids])
+
+    def added(self):
+        """positions in the second flow list whose key is absent from the first"""
+        return np.flatnonzero(self.b_ids >= len(self.a_ids))
+
+
+def align_flows(a, b):
+    """
+    Align the three flow lists of two disclosures
+    :param a: BaseDisclosure
+    :param b: BaseDisclosure
+    :return: dict of section name to KeyAlignment
+    """
+    return {section: KeyAlignment(a.flows(section), b.flows(section), section) for section in FLOW_SECTIONS}
+
+
+def _linear(disclosure, name, alignment, n_cols):
+    rows, cols, vals = disclosure.matrix_arrays(name)
+    row_ids = alignment[0][rows]
+    col_ids = alignment[1][cols]
+    lin = row_ids * n_cols + col_ids
+    order = np.argsort(lin, kind='stable')
+    return lin[order], vals[order]
+
+
+def compare_matrix(a, b, name, alignments, rel_tol=1e-9, abs_tol=0.0):
+    """
+    Sort-merge comparison of one matrix of two aligned disclosures.
+
+    :return: dict with keys 'removed', 'added' and 'changed'.  Each holds the linear indices (row_id * n_cols +
+    col_id, in the shared key space) of the affected entries, sorted, together with old and new values.
+    """
+    row_align = alignments[MATRIX_ROWS[name]]
+    col_align = alignments['foreground flows']
+    n_cols = col_align.size
+
+    a_lin, a_vals = _linear(a, name, (row_align.a_ids, col_align.a_ids), n_cols)
+    b_lin, b_vals = _linear(b, name, (row_align.b_ids, col_align.b_ids), n_cols)
+
+    for lin, label in ((a_lin, a), (b_lin, b)):
+        if len(lin) > 1 and np.any(lin[1:] == lin[:-1]):
+            raise ValueError('Duplicate entries in {} of {!r}'.format(name, label))
+
+    in_b = np.zeros(len(a_lin), dtype=bool)
+    in_a = np.zeros(len(b_lin), dtype=bool)
+    pos = np.searchsorted(b_lin, a_lin)
+    valid = pos < len(b_lin)
+    in_b[valid] = b_lin[pos[valid]] == a_lin[valid]
+    in_a[pos[in_b]] = True
+
+    old = a_vals[in_b]
+    new = b_vals[pos[in_b]]
+    tol = rel_tol * np.maximum(np.abs(old), np.abs(new)) + abs_tol
+    changed = np.abs(old - new) > tol
+
+    return {
+        'n_cols': n_cols,
+        'removed': (a_lin[~in_b], a_vals[~in_b]),
+        'added': (b_lin[~in_a], b_vals[~in_a]),
+        'changed': (a_lin[in_b][changed], old[changed], new[changed]),
+    }
+
+
+def diff(a, b, rel_tol=1e-9, abs_tol=0.0, chunk_size=65536):
+    """
+    Generator.  Yields DiffRecords describing how disclosure b differs from disclosure a: first the added and removed
+    flows of each flow list, then the added, removed and changed entries of Af, Ad and Bf.
+
+    Coefficients present in both disclosures are reported as changed if they differ by more than
+    rel_tol * max(|old|, |new|) + abs_tol.
+
+    :param a: the old BaseDisclosure
+    :param b: the new BaseDisclosure
+    :param rel_tol: relative tolerance for changed coefficients
+    :param abs_tol: absolute tolerance for changed coefficients
+    :param chunk_size: matrix records are materialised this many at a time
+    :return:
+    """
+    alignments = align_flows(a, b)
+
+    for section in FLOW_SECTIONS:
+        alignment = alignments[section]
+        a_flows = a.flows(section)
+        b_flows = b.flows(section)
+        for i in alignment.removed().tolist():
+            yield DiffRecord('removed', section, alignment.keys[i], None, a_flows[i], None)
+        for i in alignment.added().tolist():
+            yield DiffRecord('added', section, alignment.keys[alignment.b_ids[i]], None, None, b_flows[i])
+
+    col_keys = alignments['foreground flows'].keys
+    for name in MATRICES:
+        row_keys = alignments[MATRIX_ROWS[name]].keys
+        result = compare_matrix(a, b, name, alignments, rel_tol=rel_tol, abs_tol=abs_tol)
+        n_cols = result['n_cols']
+        for change in ('added', 'removed', 'changed'):
+            arrays = result[change]
+            lin = arrays[0]
+            for start in range(0, len(lin), chunk_size):
+                stop = start + chunk_size
+                r = (lin[start:stop] // n_cols).tolist()
+                c = (lin[start:stop] % n_cols).tolist()
+                if change == 'added':
+                    old = [None] * len(r)
+                    new = arrays[1][start:stop].tolist()
+                elif change == 'removed':
+                    old = arrays[1][start:stop].tolist()
+                    new = [None] * len(r)
+                else:
+                    old = arrays[1][start:stop].tolist()
+                    new = arrays[2][start:stop].tolist()
+                for i in range(len(r)):
+                    yield DiffRecord(change, name, row_keys[r[i]], col_keys[c[i]], old[i], new[i])
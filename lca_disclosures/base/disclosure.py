@@ -1,16 +1,76 @@
 import json
 import os
 
+import numpy as np
+from scipy.sparse import coo_matrix
+
+from ..utils import coo_to_arrays
+from .canonical import canonical_disclosure, fingerprint
+from .contributions import contributions
+from .delta import make_delta
+from .diff import diff
+from .flows import FLOW_SECTIONS, MATRIX_ROWS, as_flows, flow_to_dict
+from .graph import subset_disclosure
+from .linalg import aggregate, factorise, foreground_structure
+from .montecarlo import MonteCarlo
+from .ooc import CHUNK_SIZE, ArrayMatrix, ChunkedMatrix, iter_json, matrix_chunks, storage_folder, to_chunked
+from .profiling import DisclosureStats, NULL_STAGE
+from .sensitivity import sensitivity
+from .sparsify import sparsify_disclosure, sparsify_report
+from .uncertainty import uncertainty_to_json
+from .validation import validate_disclosure
+
 
 class BaseDisclosure(object):
 
     _folder_path = None
     _disclosure = None
+    _stats = None
+    _cache = None
+    _uncertainty = None
+    sparsify_report = None
+    out_of_core = None
+    chunk_size = CHUNK_SIZE
+
+    def __init__(self, folder_path=None, filename=None, profile=False, profile_hook=None, sparsification=None,
+                 out_of_core=None, chunk_size=None, canonical=False):
+        """
 
-    def __init__(self, folder_path=None, filename=None):
+        :param folder_path: default folder for serializations
+        :param filename: extensionless filename for serializations
+        :param profile: if True, record per-stage timings, call counts, object counts and peak memory in self.stats
+        :param profile_hook: optional callable, called as hook(stats, stage_record) as each stage completes.  Giving
+        a hook implies profile=True
+        :param sparsification: optional dict of sparsify() arguments (atol, rtol, tolerances, precision).  If given,
+        the prepared matrices are sparsified and the effect is recorded in self.sparsify_report
+        :param out_of_core: a folder, or True for a temporary folder.  If given, the matrices are kept in chunked
+        on-disk arrays in (a new sub-folder of) this folder, and are streamed chunk by chunk where possible
+        :param chunk_size: number of matrix entries processed at a time out of core
+        :param canonical: if True, put the prepared flows and matrix entries in canonical order (see canonical()), so
+        that builds of the same content give identical output and fingerprints
+        """
         self.folder_path = folder_path
         self.filename = filename
-        self._disclosure = self._prepare_disclosure()
+        if chunk_size is not None:
+            self.chunk_size = chunk_size
+        if out_of_core:
+            self.out_of_core = storage_folder(out_of_core, self)
+        if profile or profile_hook is not None:
+            self._stats = DisclosureStats(hook=profile_hook)
+        with self._stage('prepare_disclosure'):
+            self._disclosure = self._as_records(self._prepare_disclosure())
+        if canonical:
+            with self._stage('canonical'):
+                self._disclosure, self._uncertainty = canonical_disclosure(self)
+                self._cache = None
+        if self.out_of_core:
+            with self._stage('out_of_core'):
+                self._disclosure = self._disclosure[:3] + self._chunked(self._disclosure[3:])
+        if sparsification:
+            with self._stage('sparsify'):
+                self._sparsify(sparsification)
+        if self._stats is not None:
+            self._stats.record_disclosure(self)
 
     @property
     def folder_path(self):
@@ -34,7 +94,8 @@ class BaseDisclosure(object):
         """
         Compute the disclosure and return it as three lists and three sets of sparse matrix tuples.
 
-        The lists should be instances of the appropriate types: ForegroundFlow, BackgroundFlow, EmissionFlow
+        The lists should be instances of the appropriate types: ForegroundFlow, BackgroundFlow, EmissionFlow (lists of
+        flow dicts are accepted, and converted)
         The matrices should be given as a nested 2-tuple: ((row, col), data)
 
         returns a 6-tuple
@@ -42,6 +103,54 @@ class BaseDisclosure(object):
         """
         return NotImplemented
 
+    @staticmethod
+    def _as_records(disclosure):
+        flows = tuple(as_flows(f, section) for f, section in zip(disclosure[:3], FLOW_SECTIONS))
+        return flows + tuple(disclosure[3:])
+
+    def _chunked(self, matrices):
+        """
+        Move matrices to chunked storage in self.out_of_core
+        :param matrices: (Af, Ad, Bf)
+        :return: tuple of ChunkedMatrix
+        """
+        chunked = to_chunked(dict(zip(('Af', 'Ad', 'Bf'), matrices)), self.out_of_core, self.chunk_size)
+        return chunked['Af'], chunked['Ad'], chunked['Bf']
+
+    def _sparsify(self, options):
+        disclosure, uncertainty, _ = sparsify_disclosure(self, **options)
+        before = StaticDisclosure(self._disclosure, uncertainty=self._uncertainty, chunk_size=self.chunk_size)
+        self._disclosure = disclosure
+        self._uncertainty = uncertainty
+        self._cache = None
+        self.sparsify_report = sparsify_report(before, self)
+
+    def _stage(self, name):
+        """
+        Context manager wrapping one stage of disclosure construction.  Subclasses should wrap the expensive parts of
+        _prepare_disclosure() in named stages; when profiling is disabled this returns a shared no-op context.
+        :param name: stage name
+        :return:
+        """
+        if self._stats is None:
+            return NULL_STAGE
+        return self._stats.stage(name)
+
+    def _count(self, name, n=1):
+        """
+        Add n to the profiling object counter `name`.  Does nothing when profiling is disabled.
+        """
+        if self._stats is not None:
+            self._stats.count(name, n)
+
+    @property
+    def stats(self):
+        """
+        Profiling information (a DisclosureStats), or None if the disclosure was created without profiling
+        :return:
+        """
+        return self._stats
+
     '''
     Accessing contents of the prepared disclosure
     '''
@@ -73,30 +182,261 @@ class BaseDisclosure(object):
     def Bf(self):
         return self.disclosure[5]
 
+    def flows(self, section):
+        """
+        Return the flow list named by section: 'foreground flows', 'background flows' or 'foreground emissions'
+        """
+        return {
+            'foreground flows': self.foreground_flows,
+            'background flows': self.background_flows,
+            'foreground emissions': self.emission_flows,
+        }[section]
+
+    def matrix_shape(self, name):
+        """
+        :param name: 'Af', 'Ad' or 'Bf'
+        :return: (rows, cols)
+        """
+        return len(self.flows(MATRIX_ROWS[name])), len(self.foreground_flows)
+
+    def _cached(self, key, compute):
+        """
+        Return the cached value for key, calling compute() to produce it on first use.  A prepared disclosure is never
+        modified, so cached values never need invalidating.
+        """
+        if self._cache is None:
+            self._cache = {}
+        try:
+            return self._cache[key]
+        except KeyError:
+            value = self._cache[key] = compute()
+            return value
+
+    def matrix_arrays(self, name):
+        """
+        The named matrix as three numpy arrays (rows, cols, vals), aligned with its COO entries.  The arrays are
+        computed once and cached, so they must not be modified in place.
+        :param name: 'Af', 'Ad' or 'Bf'
+        :return:
+        """
+        matrix = getattr(self, name)
+        if isinstance(matrix, ArrayMatrix):
+            return matrix.rows, matrix.cols, matrix.vals
+        return self._cached(name, lambda: coo_to_arrays(matrix))
+
+    def matrix_chunks(self, name):
+        """
+        Generator.  Yields the entries of the named matrix as (rows, cols, vals) arrays: chunk_size entries at a time
+        out of core, otherwise all at once
+        :param name: 'Af', 'Ad' or 'Bf'
+        """
+        matrix = getattr(self, name)
+        if isinstance(matrix, ChunkedMatrix):
+            for chunk in matrix.chunks(self.chunk_size):
+                yield chunk
+        else:
+            yield self.matrix_arrays(name)
+
+    def matrix_product(self, name, x):
+        """
+        The product of the named matrix with a vector of foreground activities, computed chunk by chunk out of core
+        :param name: 'Af', 'Ad' or 'Bf'
+        :param x: vector of length p
+        :return: vector
+        """
+        if not isinstance(getattr(self, name), ChunkedMatrix):
+            return self.sparse_matrix(name, 'csr').dot(x)
+        result = np.zeros(self.matrix_shape(name)[0])
+        for rows, cols, vals in self.matrix_chunks(name):
+            result += np.bincount(rows, weights=vals * x[cols], minlength=len(result))
+        return result
+
+    def sparse_matrix(self, name, fmt='csc'):
+        """
+        The named matrix as a scipy sparse matrix.  The result is cached, so it must not be modified in place.
+        :param name: 'Af', 'Ad' or 'Bf'
+        :param fmt: any scipy sparse format name, e.g. 'csc', 'csr', 'coo'
+        :return:
+        """
+        def compute():
+            rows, cols, vals = self.matrix_arrays(name)
+            return coo_matrix((vals, (rows, cols)), shape=self.matrix_shape(name)).asformat(fmt)
+
+        return self._cached((name, fmt), compute)
+
+    def foreground_structure(self):
+        """
+        Strongly connected components of the foreground graph, their sizes and a topological ordering of the
+        condensed graph.  Components of more than one flow are loops; their sizes identify pathological models.
+        :return: ForegroundStructure (cached)
+        """
+        return self._cached('structure', lambda: foreground_structure(self))
+
+    def factorisation(self):
+        """
+        Sparse LU factorisation of (I - Af), shared by the analyses that solve the foreground system repeatedly
+        :return: scipy.sparse.linalg.SuperLU (cached)
+        """
+        return self._cached('lu', lambda: factorise(self))
+
+    def sensitivity(self, background=None, emissions=None):
+        """
+        First-order sensitivity of a weighted score of the aggregated results, w_b . (Ad x) + w_e . (Bf x), to every
+        nonzero coefficient, from one forward and one adjoint solve.  Pass characterisation factors as `emissions` for
+        the sensitivity of an LCIA score, or a unit vector for a single emission.
+        :param background: weights of the background flows, or None
+        :param emissions: weights of the emissions, or None
+        :return: SensitivityResult; its ranked() method orders all entries by the magnitude of their elasticity
+        """
+        return sensitivity(self, background=background, emissions=emissions)
+
+    def contributions(self, top_k=10):
+        """
+        Contributions of the foreground flows to each background flow and emission (the entries of Ad diag(x) and
+        Bf diag(x)), keeping the top_k largest of each.  The activity levels x come from the cached factorisation.
+        :param top_k: contributors kept per background flow or emission; None keeps them all
+        :return: ContributionResult; its top['Ad'] and top['Bf'] are sparse matrices, and contributors(name, row)
+        lists one row's contributors
+        """
+        return contributions(self, top_k=top_k)
+
+    def aggregate(self, method='scc'):
+        """
+        Aggregate the disclosure into a unit process delivering one unit of the functional unit.
+        :param method: 'scc' solves acyclic parts of the foreground by back-substitution and only the loops by linear
+        solves; 'lu' solves the whole foreground with a general sparse solver
+        :return: Aggregation(activity, background, emissions)
+        """
+        return aggregate(self, method=method)
+
+    def subset(self, root=0, depth=None, threshold=None, **kwargs):
+        """
+        Returns a smaller disclosure containing only the part of the foreground upstream of `root`.
+
+        The foreground is searched breadth first from root.  A flow's inputs are followed if it lies fewer than
+        `depth` tiers from root and its cumulative contribution (the product of absolute Af coefficients along the
+        path that first reached it) is at least `threshold`.  Flows that are reached but not followed remain as
+        cutoffs.
+
+        :param root: index of the foreground flow to start from; it becomes foreground flow 0 of the result
+        :param depth: maximum number of tiers, or None
+        :param threshold: minimum cumulative contribution, or None
+        :param kwargs: passed to the StaticDisclosure constructor (e.g. filename, folder_path)
+        :return: StaticDisclosure
+        """
+        return StaticDisclosure(subset_disclosure(self, root=root, depth=depth, threshold=threshold), **kwargs)
+
+    def sparsify(self, atol=0.0, rtol=0.0, tolerances=None, precision=None, **kwargs):
+        """
+        Returns a copy of the disclosure with negligible coefficients removed and, optionally, the remaining
+        coefficients rounded, together with a report of the reduction in size and the resulting error in the
+        aggregated results.
+        :param atol: drop entries whose absolute value is below atol
+        :param rtol: drop entries whose absolute value is below rtol times the largest absolute value in their column
+        :param tolerances: per-matrix overrides of atol and rtol, e.g. {'Bf': {'atol': 1e-12}}
+        :param precision: None, 'float32', or a number of significant digits to keep
+        :param kwargs: passed to the StaticDisclosure constructor (e.g. filename, folder_path)
+        :return: (StaticDisclosure, SparsifyReport)
+        """
+        disclosure, uncertainty, _ = sparsify_disclosure(self, atol=atol, rtol=rtol, tolerances=tolerances,
+                                                         precision=precision)
+        kwargs.setdefault('chunk_size', self.chunk_size)
+        result = StaticDisclosure(disclosure, uncertainty=uncertainty, **kwargs)
+        return result, sparsify_report(self, result)
+
+    def canonical(self, **kwargs):
+        """
+        Returns a copy of the disclosure in canonical order: the flows of each section sorted by identity key, with
+        the functional unit kept as foreground flow 0, and the matrix entries renumbered to match, in row-major order
+        :param kwargs: passed to the StaticDisclosure constructor (e.g. filename, folder_path)
+        :return: StaticDisclosure
+        """
+        disclosure, uncertainty = canonical_disclosure(self)
+        kwargs.setdefault('chunk_size', self.chunk_size)
+        return StaticDisclosure(disclosure, uncertainty=uncertainty, **kwargs)
+
+    @property
+    def fingerprint(self):
+        """
+        sha256 hex digest of the disclosure's content, computed in a streaming pass over the flows and matrix arrays.
+        It depends on the order of flows and entries; use canonical order for an order-independent hash.
+        """
+        return self._cached('fingerprint', lambda: fingerprint(self))
+
+    def diff(self, other, rel_tol=1e-9, abs_tol=0.0):
+        """
+        Generator.  Yields DiffRecords describing how `other` differs from this disclosure: added and removed flows,
+        then added, removed and changed matrix entries.  Flows are matched by identity key rather than position.
+        :param other: a BaseDisclosure
+        :param rel_tol: relative tolerance for reporting a coefficient as changed
+        :param abs_tol: absolute tolerance for reporting a coefficient as changed
+        :return:
+        """
+        return diff(self, other, rel_tol=rel_tol, abs_tol=abs_tol)
+
+    @property
+    def uncertainty(self):
+        """
+        Per-entry uncertainty of the matrices, if the disclosure carries it: a dict mapping 'Af', 'Ad' and/or 'Bf' to
+        structured arrays (see uncertainty.py) aligned with the COO entries.  None if no uncertainty is available.
+        Subclasses set self._uncertainty in _prepare_disclosure().
+        :return:
+        """
+        return self._uncertainty
+
+    def monte_carlo(self, iterations=1000, seed=None, batch_size=100, processes=None):
+        """
+        Propagate the disclosed uncertainty to the aggregated results by Monte Carlo simulation.
+        :param iterations: number of iterations
+        :param seed: random seed; results are reproducible for a given seed, iterations and batch_size
+        :param batch_size: iterations sampled and solved together
+        :param processes: number of worker processes, or None to run in this process
+        :return: MonteCarloResult(activity, background, emissions), one row per iteration
+        """
+        return MonteCarlo(self, iterations=iterations, seed=seed, batch_size=batch_size, processes=processes).run()
+
+    def validate(self, check_flows=True):
+        """
+        Check the disclosure for consistency: matrix entries inside the shapes given by the flow lists, finite values,
+        no duplicate entries, flow 'index' fields matching their positions, and a valid functional unit in column 0.
+        :param check_flows: if False, skip the checks that read the flow lists
+        :return: list of ValidationIssue (empty if the disclosure is valid)
+        """
+        return validate_disclosure(self.disclosure, check_flows=check_flows, chunk_size=self.chunk_size)
+
+    def _terminated(self):
+        """
+        Boolean array over foreground flows: True where the column has a nonzero entry in Af, Ad or Bf
+        """
+        def compute():
+            terminated = np.zeros(len(self.foreground_flows), dtype=bool)
+            for name in ('Af', 'Ad', 'Bf'):
+                for rows, cols, vals in self.matrix_chunks(name):
+                    terminated[cols[vals != 0]] = True
+            return terminated
+
+        return self._cached('terminated', compute)
+
     def _check_cutoff(self, k):
         """
 
         :param k: an index into foreground flows
         :return: True if column k is empty across Af, Ad, and Bf; False otherwise
         """
-        for matrix in (self.Af, self.Ad, self.Bf):
-            for coords, val in matrix:
-                if coords[1] == k and val != 0:
-                    return False  # found a termination
-        return True
+        return not self._terminated()[k]
 
     @property
     def cutoffs(self):
         """
         Generator. Yields disclosed flows that are cutoffs (i.e. foreground flows that have no termination in any
-        of the foreground matrices and emissions that have no specified context)
+        of the foreground matrices and emissions that have neither a specified context nor a biosphere3 id)
         :return:
         """
         for i, ff in enumerate(self.foreground_flows):
             if self._check_cutoff(i):
                 yield ff
         for em in self.emission_flows:
-            if em.context is None: # Note this will throw an error until typed flows are implemented
+            if em.get('context') is None and em.get('biosphere3_id') is None:
                 yield em
 
     @property
@@ -121,17 +461,30 @@ class BaseDisclosure(object):
 
         # collate the data
         data = {
-            'foreground flows': d_i,
+            'foreground flows': [flow_to_dict(f) for f in d_i],
             'Af': {'shape': [p, p], 'data': d_iv},
-            'background flows': d_ii,
+            'background flows': [flow_to_dict(f) for f in d_ii],
             'Ad': {'shape': [n, p], 'data': d_v},
-            'foreground emissions': d_iii,
+            'foreground emissions': [flow_to_dict(f) for f in d_iii],
             'Bf': {'shape': [m, p], 'data': d_vi}
         }
 
+        if self.uncertainty is not None:
+            for name, u in self.uncertainty.items():
+                data[name]['uncertainty'] = uncertainty_to_json(u)
+
         return data
 
-    def write_json(self, folder_path=None, **kwargs):
+    def write_json(self, folder_path=None, registry=None, **kwargs):
+        """
+        Write the disclosure as JSON
+        :param folder_path: defaults to self.folder_path
+        :param registry: optional FlowRegistry.  If given, background flows and emissions are interned in the registry
+        (which is saved) and the file stores only references to them
+        :param kwargs: passed to json.dump.  Out of core the file is streamed, and formatting options are not
+        supported
+        :return: the path of the file written
+        """
 
         folder_path = folder_path or self.folder_path
 
@@ -147,7 +500,55 @@ class BaseDisclosure(object):
 
         full_efn += '.json'
 
+        data = self.data
+        if registry is not None:
+            data = registry.compact(data, full_efn)
+
+        if kwargs and any(isinstance(m, ChunkedMatrix) for m in self.disclosure[3:]):
+            raise TypeError('Formatting options are not supported for out of core disclosures')
+
         with open(full_efn, 'w') as f:
-            json.dump(self.data, f, **kwargs)
+            if not kwargs and any(isinstance(m, ArrayMatrix) for m in self.disclosure[3:]):
+                for piece in iter_json(data):
+                    f.write(piece)
+            else:
+                json.dump(data, f, default=list, **kwargs)
 
         return full_efn
+
+
+    def write_delta(self, base, base_file, folder_path=None):
+        """
+        Write the disclosure as a delta against a base disclosure (see delta.py); from_file reads it back by applying
+        it to the base file
+        :param base: the base BaseDisclosure
+        :param base_file: the file the base was written to (e.g. the result of base.write_json())
+        :param folder_path: defaults to self.folder_path
+        :return: the path of the file written
+        """
+        folder_path = folder_path or self.folder_path
+        if folder_path is not None and not os.path.isdir(folder_path):
+            os.mkdir(folder_path)
+        full_efn = os.path.join(folder_path or '', self.efn + '.json')
+
+        base_path = os.path.relpath(os.path.abspath(base_file), os.path.dirname(os.path.abspath(full_efn)))
+        with open(full_efn, 'w') as f:
+            json.dump(make_delta(base, self, base_path.replace(os.sep, '/')), f)
+
+        return full_efn
+
+
+class StaticDisclosure(BaseDisclosure):
+    """
+    A disclosure built from an already-computed 6-tuple, e.g. the result of combining or reducing other disclosures
+    """
+    def __init__(self, disclosure, uncertainty=None, **kwargs):
+        self._static = tuple(disclosure)
+        self._uncertainty = uncertainty
+        super(StaticDisclosure, self).__init__(**kwargs)
+
+    def _prepare_efn(self):
+        return self.filename or 'disclosure'
+
+    def _prepare_disclosure(self):
+        return self._static
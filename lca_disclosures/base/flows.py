@@ -0,0 +1,209 @@
+"""
+Identity of disclosed flows.
+
+Flows are identified across disclosures by a key built from the fields that name them in the outside world:
+background flows by their brightway id, emissions by their biosphere3 id, and foreground flows (which have no external
+id) by name, unit and location.
+
+Flows are held as ForegroundFlow, BackgroundFlow and EmissionFlow records.  These use __slots__ instead of a
+per-instance dict, and intern their repeated strings (units, locations, database names), so large flow lists cost a
+fraction of the memory of the equivalent dicts.  They are read-only mappings, so code written against flow dicts
+(flow['name'], flow.get('unit'), dict(flow), comparison with dicts) keeps working; to_dict() gives the serializable
+form.
+"""
+import sys
+
+try:
+    from collections.abc import Mapping
+except ImportError:  # python 2
+    from collections import Mapping
+
+FLOW_SECTIONS = ('foreground flows', 'background flows', 'foreground emissions')
+
+# the flow list indexing the rows of each matrix.  All three matrices have foreground flows as columns.
+MATRIX_ROWS = {
+    'Af': 'foreground flows',
+    'Ad': 'background flows',
+    'Bf': 'foreground emissions',
+}
+
+
+def _intern(value):
+    if isinstance(value, str):
+        return sys.intern(value)
+    if isinstance(value, (list, tuple)):
+        return [_intern(v) for v in value]
+    return value
+
+
+def _rebuild(cls, values, extra):
+    flow = cls(**extra)
+    for field, value in zip(cls.FIELDS, values):
+        setattr(flow, field, value)
+    return flow
+
+
+class Flow(Mapping):
+    """
+    Base class for flow records.  Subclasses list their fields in FIELDS.  A field set to None is treated as absent;
+    keys that are not fields are kept in a small dict of extras.
+    """
+    __slots__ = ('_extra',)
+    FIELDS = ()
+
+    def __init__(self, **kwargs):
+        for field in self.FIELDS:
+            setattr(self, field, _intern(kwargs.pop(field, None)))
+        self._extra = kwargs or None
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(**d)
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def reindexed(self, index):
+        """
+        A copy of this flow with a new index
+        """
+        flow = _rebuild(type(self), [getattr(self, f) for f in self.FIELDS], self._extra or {})
+        flow.index = index
+        return flow
+
+    def __reduce__(self):
+        return _rebuild, (type(self), [getattr(self, f) for f in self.FIELDS], self._extra or {})
+
+    def __getitem__(self, key):
+        if key in self.FIELDS:
+            value = getattr(self, key)
+            if value is not None:
+                return value
+        elif self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __iter__(self):
+        for field in self.FIELDS:
+            if getattr(self, field) is not None:
+                yield field
+        if self._extra is not None:
+            for key in self._extra:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, ', '.join('{}={!r}'.format(k, v) for k, v in self.items()))
+
+
+class ForegroundFlow(Flow):
+    __slots__ = FIELDS = ('index', 'name', 'unit', 'location')
+
+
+class BackgroundFlow(Flow):
+    __slots__ = FIELDS = ('index', 'ecoinvent_name', 'ecoinvent_id', 'brightway_id', 'unit', 'location')
+
+
+class EmissionFlow(Flow):
+    """
+    context is the compartment the emission goes to (e.g. ['air', 'urban air close to ground']), where known
+    """
+    __slots__ = FIELDS = ('index', 'name', 'biosphere3_id', 'unit', 'context')
+
+
+FLOW_TYPES = {
+    'foreground flows': ForegroundFlow,
+    'background flows': BackgroundFlow,
+    'foreground emissions': EmissionFlow,
+}
+
+
+def as_flows(flows, section):
+    """
+    Convert a list of flow dicts to flow records.  Records, and sequences other than lists (e.g. registry
+    references), are returned unchanged.
+    :param flows:
+    :param section: one of FLOW_SECTIONS
+    :return:
+    """
+    if not isinstance(flows, list):
+        return flows
+    cls = FLOW_TYPES[section]
+    return [f if isinstance(f, Flow) else cls.from_dict(f) for f in flows]
+
+
+def flow_to_dict(flow):
+    """
+    The serializable form of a flow record or dict
+    """
+    return flow.to_dict() if isinstance(flow, Flow) else flow
+
+
+def foreground_key(flow):
+    return 'foreground', flow.get('name'), flow.get('unit'), flow.get('location')
+
+
+def background_key(flow):
+    bid = flow.get('brightway_id')
+    if bid is not None:
+        return ('brightway',) + tuple(bid)
+    return 'background', flow.get('ecoinvent_name'), flow.get('unit'), flow.get('location')
+
+
+def emission_key(flow):
+    bid = flow.get('biosphere3_id')
+    if bid is not None:
+        return ('biosphere',) + tuple(bid)
+    return 'emission', flow.get('name'), flow.get('unit')
+
+
+FLOW_KEYS = {
+    'foreground flows': foreground_key,
+    'background flows': background_key,
+    'foreground emissions': emission_key,
+}
+
+
+def flow_keys(flows, section):
+    """
+    Identity keys for a list of flows
+    :param flows: the flow list
+    :param section: one of FLOW_SECTIONS
+    :return: list of keys, in flow order
+    """
+    key = FLOW_KEYS[section]
+    return [key(f) for f in flows]
+
+
+def key_index(keys, section=None):
+    """
+    Map each key to its position, raising ValueError if a key appears twice
+    :param keys:
+    :param section: used in the error message
+    :return: dict
+    """
+    index = {}
+    for i, k in enumerate(keys):
+        if k in index:
+            raise ValueError('Duplicate flow identity {} in {} (positions {} and {})'.format(k, section, index[k], i))
+        index[k] = i
+    return index
+
+
+def reindex_flows(flows):
+    """
+    Copies of the given flows with their 'index' fields set to their new positions
+    :param flows: iterable of flow records or dicts
+    :return: list
+    """
+    reindexed = []
+    for i, f in enumerate(flows):
+        if isinstance(f, Flow):
+            flow = f.reindexed(i)
+        else:
+            flow = dict(f)
+            flow['index'] = i
+        reindexed.append(flow)
+    return reindexed
@@ -1,15 +1,24 @@
 import os
 import json
 
+from .delta import is_delta, read_delta
 from .disclosure import BaseDisclosure
+from .lazy import lazy_disclosure
+from .ooc import read_json
+from .registry import resolve_references
+from .validation import raise_for_errors, validate_disclosure
+from .uncertainty import uncertainty_from_json
 
 
 class Disclosure(BaseDisclosure):
     """
     For restoring a disclosure from a file
     """
-    def __init__(self, extension=None, **kwargs):
+    def __init__(self, extension=None, registry=None, lazy=False, validate=True, **kwargs):
         self._ext = extension
+        self._registry = registry
+        self._lazy = lazy
+        self._validate = validate
         super(Disclosure, self).__init__(**kwargs)
 
     def _prepare_efn(self):
@@ -29,20 +38,81 @@ class Disclosure(BaseDisclosure):
 
     def _disclosure_from_json(self):
         fname_ext = os.path.join(self.folder_path, self.efn + self._ext)
-        with open(fname_ext) as fp:
-            j = json.load(fp)
+        if is_delta(fname_ext):
+            return self._disclosure_from_delta(fname_ext)
+        if self.out_of_core:
+            return self._disclosure_out_of_core(fname_ext)
 
-        return j['foreground flows'], j['background flows'], j['foreground emissions'], \
+        if self._lazy:
+            with self._stage('parse'):
+                disclosure, matrices = lazy_disclosure(fname_ext, self.folder_path, self._registry)
+            self._read_uncertainty(matrices)
+            self._check(disclosure, matrices)
+            return disclosure
+
+        with self._stage('parse'):
+            with open(fname_ext) as fp:
+                j = json.load(fp)
+
+        resolve_references(j, self.folder_path, self._registry)
+        self._read_uncertainty(j)
+
+        disclosure = j['foreground flows'], j['background flows'], j['foreground emissions'], \
             j['Af']['data'], j['Ad']['data'], j['Bf']['data']
+        self._check(disclosure, j)
+        return disclosure
+
+    def _disclosure_from_delta(self, fname_ext):
+        def load(path):
+            return from_file(path, registry=self._registry, validate=self._validate, chunk_size=self.chunk_size)
+
+        with self._stage('delta'):
+            disclosure, delta = read_delta(fname_ext, load, verify=self._validate)
+        self._check(disclosure, delta)
+        return disclosure
+
+    def _disclosure_out_of_core(self, fname_ext):
+        with self._stage('parse'):
+            flows, matrices, registry_path = read_json(fname_ext, self.out_of_core, self.chunk_size)
+        if registry_path is not None:
+            flows['flow registry'] = registry_path
+        resolve_references(flows, self.folder_path, self._registry)
+
+        disclosure = (flows['foreground flows'], flows['background flows'], flows['foreground emissions']) + \
+            tuple(matrices[name][0] for name in ('Af', 'Ad', 'Bf'))
+        self._check(disclosure, {name: {'shape': matrices[name][1]} for name in ('Af', 'Ad', 'Bf')})
+        return disclosure
+
+    def _check(self, disclosure, matrices):
+        if not self._validate:
+            return
+        with self._stage('validate'):
+            shapes = {name: matrices[name].get('shape') for name in ('Af', 'Ad', 'Bf')}
+            raise_for_errors(validate_disclosure(disclosure, shapes=shapes, check_flows=not self._lazy,
+                                                 chunk_size=self.chunk_size))
+
+    def _read_uncertainty(self, j):
+
+        uncertainty = {name: uncertainty_from_json(j[name]['uncertainty'])
+                       for name in ('Af', 'Ad', 'Bf') if 'uncertainty' in j[name]}
+        if uncertainty:
+            self._uncertainty = uncertainty
 
 
-def from_file(input_file):
+def from_file(input_file, **kwargs):
     """
     Infers type from file extension
     :param input_file:
+    :param kwargs: passed to the disclosure constructor (e.g. profile=True, or registry=FlowRegistry(...) to resolve
+    flow references against a registry other than the one named in the file).  For JSON files, lazy=True loads the
+    matrices only; the flow tables are parsed when first accessed.  The disclosure is validated on loading (raising
+    DisclosureValidationError); pass validate=False to skip this for trusted files.  out_of_core=<folder> streams the
+    matrices into chunked on-disk storage (see ooc.py); uncertainty information is not read in this mode.  A delta
+    file (see delta.py) is applied to the base file it names, which is loaded first; validation then includes checking
+    the fingerprints recorded in the delta.
     :return:
     """
     abspath = os.path.abspath(input_file)
     folder = os.path.dirname(abspath)
     filename, ext = os.path.splitext(os.path.basename(abspath))
-    return Disclosure(folder_path=folder, filename=filename, extension=ext)
+    return Disclosure(folder_path=folder, filename=filename, extension=ext, **kwargs)
@@ -0,0 +1,110 @@
+"""
+Traversal of the foreground graph.
+
+Af defines a directed graph on the foreground flows: a nonzero Af[i, j] means that flow j consumes flow i, so the
+inputs of j are the row indices stored in column j of the CSC form of Af.
+"""
+import numpy as np
+
+from ..utils import arrays_to_coo
+from .flows import MATRIX_ROWS, reindex_flows
+
+
+def _compressed_entries(adjacency, nodes):
+    """
+    Positions in adjacency.indices / adjacency.data of every entry in the given columns (CSC) or rows (CSR), and the
+    column or row each position belongs to
+    """
+    starts = adjacency.indptr[nodes]
+    counts = adjacency.indptr[nodes + 1] - starts
+    total = int(counts.sum())
+    offsets = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(total)
+    return offsets, np.repeat(nodes, counts)
+
+
+def upstream(disclosure, root=0, depth=None, threshold=None):
+    """
+    Breadth-first search of the foreground upstream of root, one tier at a time.
+
+    Each flow reached is given a cumulative contribution: 1 for root and, for any other flow, the largest product of
+    absolute Af coefficients along the path by which it was first reached.  A flow is expanded (its inputs visited) if
+    it lies fewer than `depth` tiers from root and its contribution is at least `threshold`.
+
+    :param disclosure: a BaseDisclosure
+    :param root: index of the foreground flow to start from
+    :param depth: maximum number of tiers to expand, or None for no limit
+    :param threshold: minimum cumulative contribution of an expanded flow, or None for no limit
+    :return: (reached, expanded, contribution) - boolean masks over the foreground flows and the contribution array
+    """
+    adjacency = disclosure.sparse_matrix('Af', 'csc')
+    p = adjacency.shape[1]
+    if not 0 <= root < p:
+        raise IndexError('root {} is not a foreground flow index'.format(root))
+
+    reached = np.zeros(p, dtype=bool)
+    expanded = np.zeros(p, dtype=bool)
+    contribution = np.zeros(p)
+    reached[root] = True
+    contribution[root] = 1.0
+
+    frontier = np.array([root], dtype=np.int64)
+    tier = 0
+    while len(frontier):
+        if depth is not None and tier >= depth:
+            break
+        if threshold is not None:
+            frontier = frontier[contribution[frontier] >= threshold]
+        expanded[frontier] = True
+
+        positions, parents = _compressed_entries(adjacency, frontier)
+        children = adjacency.indices[positions]
+        best = np.zeros(p)
+        np.maximum.at(best, children, contribution[parents] * np.abs(adjacency.data[positions]))
+
+        new = np.unique(children[~reached[children]])
+        reached[new] = True
+        contribution[new] = best[new]
+        frontier = new
+        tier += 1
+
+    return reached, expanded, contribution
+
+
+def subset_disclosure(disclosure, root=0, depth=None, threshold=None):
+    """
+    The part of a disclosure upstream of one foreground flow, as a 6-tuple.
+
+    Flows reached but not expanded by upstream() are kept as cutoffs: their rows remain in Af, but their columns in
+    Af, Ad and Bf are dropped.  Root becomes foreground flow 0; all other flows keep their relative order.  Background
+    flows and emissions not used by any expanded column are dropped.
+
+    :return: 6-tuple, as returned by _prepare_disclosure()
+    """
+    reached, expanded, _ = upstream(disclosure, root=root, depth=depth, threshold=threshold)
+
+    others = np.flatnonzero(reached)
+    kept = np.concatenate(([root], others[others != root]))
+    new_index = np.full(len(reached), -1, dtype=np.int64)
+    new_index[kept] = np.arange(len(kept))
+
+    foreground = disclosure.foreground_flows
+    flows = {'foreground flows': reindex_flows(foreground[i] for i in kept.tolist())}
+    matrices = {}
+    for name in ('Af', 'Ad', 'Bf'):
+        rows, cols, vals = disclosure.matrix_arrays(name)
+        mask = expanded[cols]
+        rows, cols, vals = rows[mask], new_index[cols[mask]], vals[mask]
+        if name == 'Af':
+            rows = new_index[rows]
+        else:
+            section = MATRIX_ROWS[name]
+            used = np.unique(rows)
+            row_index = np.full(len(disclosure.flows(section)), -1, dtype=np.int64)
+            row_index[used] = np.arange(len(used))
+            rows = row_index[rows]
+            section_flows = disclosure.flows(section)
+            flows[section] = reindex_flows(section_flows[i] for i in used.tolist())
+        matrices[name] = arrays_to_coo(rows, cols, vals)
+
+    return flows['foreground flows'], flows['background flows'], flows['foreground emissions'], \
+        matrices['Af'], matrices['Ad'], matrices['Bf']
@@ -0,0 +1,280 @@
+"""
+Lazy loading of flow tables from disclosure JSON files.
+
+Matrix-only work (aggregation, cutoffs of the foreground, subsetting by structure) needs the matrices and the sizes of
+the flow tables, but not the flows' names and ids.  lazy_disclosure() reads the file once, block by block, to record
+the byte span of each member of the top-level object (see iter_members); it then reads only the matrices' spans and
+parses their COO entries straight into numpy arrays.  A LazyFlowList reads and parses its own span the first time one
+of its flows is accessed.  Its length is known from the matrix shapes, so len() does not trigger parsing.
+
+Members are found by tracking, for every byte, whether it is inside a string (allowing for escaped quotes) and how
+deeply it is nested, with numpy over each block.  Text such as "Af": inside a flow's name is therefore never taken for
+a key.
+"""
+import io
+import json
+
+try:
+    from collections.abc import Sequence
+except ImportError:  # python 2
+    from collections import Sequence
+
+import numpy as np
+
+from .flows import FLOW_SECTIONS, MATRIX_ROWS, as_flows
+from .ooc import ArrayMatrix
+from .registry import resolve_references
+
+# bytes read at a time while locating members
+SCAN_BLOCK = 1 << 20
+
+_QUOTE, _BACKSLASH, _COMMA, _COLON = 0x22, 0x5c, 0x2c, 0x3a
+_OPEN, _CLOSE = (0x7b, 0x5b), (0x7d, 0x5d)
+
+# COO data is a list of numbers once its brackets and commas are blanked out
+_COO_SEPARATORS = bytes.maketrans(b'[],', b'   ')
+
+
+def _structure(block, in_string, backslashes, depth):
+    """
+    The separators of the outermost object within one block of a JSON document
+    :param block: bytes
+    :param in_string: whether the block starts inside a string
+    :param backslashes: the number of backslashes just before the block
+    :param depth: the nesting depth at the start of the block (0 outside the outermost object)
+    :return: (positions in the block of the object's '{', ',', ':' and '}', the state at the end of the block as
+    (in_string, backslashes, depth))
+    """
+    a = np.frombuffer(block, dtype=np.uint8)
+    positions = np.arange(len(a))
+    is_backslash = a == _BACKSLASH
+    last_other = np.maximum.accumulate(np.where(is_backslash, -1, positions))
+
+    # a quote is escaped if an odd number of backslashes precedes it
+    before = np.r_[-1, last_other[:-1]]
+    run = positions - 1 - before
+    run[before < 0] += backslashes
+    quotes = (a == _QUOTE) & (run % 2 == 0)
+
+    # inside a string if an odd number of quotes precedes the byte
+    inside = (np.cumsum(quotes) - quotes) % 2 != in_string
+    structural = ~inside & ~quotes
+    opens = structural & ((a == _OPEN[0]) | (a == _OPEN[1]))
+    closes = structural & ((a == _CLOSE[0]) | (a == _CLOSE[1]))
+    step = opens.astype(np.int64) - closes
+    after = depth + np.cumsum(step)
+    level = after - step
+
+    separators = (opens & (level == 0)) | (closes & (after == 0)) | \
+        (structural & (level == 1) & ((a == _COMMA) | (a == _COLON)))
+
+    end_run = len(a) - 1 - last_other[-1] + (backslashes if last_other[-1] < 0 else 0)
+    state = bool(quotes.sum() % 2) != in_string, int(end_run), int(after[-1])
+    return np.flatnonzero(separators), state
+
+
+def iter_members(fp, start=0, block_size=SCAN_BLOCK):
+    """
+    Generator.  Yields (key, start, stop) for each member of the JSON object at byte `start` of a binary file, where
+    start:stop is the byte span of the member's value.  The file is read block_size bytes at a time, and only as far
+    as the members that are consumed.
+    :param fp: binary file object
+    :param start: byte offset of the object, or of whitespace before it
+    :param block_size: bytes read at a time
+    """
+    state = False, 0, 0
+    separator = colon = None
+    offset = start
+    while True:
+        fp.seek(offset)
+        block = fp.read(block_size)
+        if not block:
+            raise ValueError('Unterminated JSON object at byte {}'.format(start))
+        found, state = _structure(block, *state)
+        for position in found.tolist():
+            char = block[position]
+            position += offset
+            if char == _COLON:
+                colon = position
+                continue
+            if colon is not None:
+                fp.seek(separator + 1)
+                key = json.loads(fp.read(colon - separator - 1).decode('utf-8'))
+                yield key, colon + 1, position
+                colon = None
+            if char in _CLOSE:
+                return
+            separator = position
+        offset += len(block)
+
+
+def read_span(fp, span, limit=None):
+    """
+    The bytes of a file at a (start, stop) span, or the first `limit` of them
+    """
+    fp.seek(span[0])
+    size = span[1] - span[0]
+    return fp.read(size if limit is None else min(size, limit))
+
+
+def _coo_arrays(raw):
+    """
+    Parse the bytes of a COO 'data' list into (rows, cols, vals) arrays
+    """
+    tokens = np.array(raw.translate(_COO_SEPARATORS).split())
+    if len(tokens) % 3:
+        raise ValueError('data is not a list of [[row, col], value] entries')
+    return tokens[0::3].astype(np.int64), tokens[1::3].astype(np.int64), tokens[2::3].astype(np.float64)
+
+
+def iter_coo(fp, span, chunk_size, block_size=SCAN_BLOCK):
+    """
+    Generator.  Parses the COO 'data' list at a byte span of a file into chunks of (rows, cols, vals) arrays of at
+    most chunk_size entries, reading block_size bytes at a time
+    :param fp: binary file object
+    :param span: (start, stop) byte offsets of the list
+    """
+    start, stop = span
+    tokens, tail = [], b''
+    while start < stop or tail:
+        fp.seek(start)
+        block = tail + fp.read(min(block_size, stop - start)).translate(_COO_SEPARATORS)
+        start = min(start + block_size, stop)
+        parts = block.split()
+        # a number cut off by the end of the block is finished in the next one
+        tail = parts.pop() if start < stop and parts and not block[-1:].isspace() else b''
+        tokens.extend(parts)
+        while len(tokens) >= 3 * chunk_size or (start >= stop and not tail and tokens):
+            chunk = np.array(tokens[:3 * chunk_size])
+            del tokens[:3 * chunk_size]
+            if len(chunk) % 3:
+                raise ValueError('data is not a list of [[row, col], value] entries')
+            yield chunk[0::3].astype(np.int64), chunk[1::3].astype(np.int64), chunk[2::3].astype(np.float64)
+
+
+def read_matrix(raw):
+    """
+    Parse the bytes of a matrix object
+    :param raw: the bytes of {"shape": ..., "data": ..., ...}
+    :return: (ArrayMatrix, dict of the matrix's other members, e.g. 'shape' and 'uncertainty')
+    """
+    members = {key: (start, stop) for key, start, stop in iter_members(io.BytesIO(raw))}
+    if 'data' not in members or 'shape' not in members:
+        raise ValueError('A matrix has no data or shape')
+    matrix = ArrayMatrix(*_coo_arrays(raw[slice(*members.pop('data'))]))
+    return matrix, {key: json.loads(raw[slice(*span)].decode('utf-8')) for key, span in members.items()}
+
+
+def scan_json(fp, block_size=SCAN_BLOCK):
+    """
+    Locate the matrices, flow tables and flow registry of a disclosure document
+    :param fp: binary file object
+    :param block_size: bytes read at a time
+    :return: dict of member name to the byte span of its value
+    """
+    wanted = set(MATRIX_ROWS) | set(FLOW_SECTIONS)
+    spans = {}
+    for key, start, stop in iter_members(fp, block_size=block_size):
+        if key in wanted or key == 'flow registry':
+            spans.setdefault(key, (start, stop))
+        if wanted.issubset(spans) and ('flow registry' in spans or not any(
+                read_span(fp, spans[section], limit=64).lstrip().startswith(b'{') for section in FLOW_SECTIONS)):
+            break
+
+    missing = [k for k in tuple(MATRIX_ROWS) + FLOW_SECTIONS if k not in spans]
+    if missing:
+        raise ValueError('Not a disclosure document: no {}'.format(', '.join(missing)))
+    return spans
+
+
+class LazyFlowList(Sequence):
+    """
+    A flow table that is read from its file on first access
+    :param path: the disclosure file
+    :param span: (start, stop) byte offsets of the table in the file
+    :param section: one of FLOW_SECTIONS
+    :param length: the number of flows, from the matrix shapes
+    :param references: for tables stored as flow registry references, (folder, registry path, registry) as taken by
+    resolve_references()
+    """
+    __slots__ = ('path', 'span', 'section', 'length', 'references', '_flows')
+
+    def __init__(self, path, span, section, length, references=None):
+        self.path = path
+        self.span = span
+        self.section = section
+        self.length = length
+        self.references = references
+        self._flows = None
+
+    @property
+    def loaded(self):
+        return self._flows is not None
+
+    @property
+    def flows(self):
+        if self._flows is None:
+            with open(self.path, 'rb') as fp:
+                value = json.loads(read_span(fp, self.span).decode('utf-8'))
+            if isinstance(value, dict):
+                folder, registry_path, registry = self.references
+                j = {self.section: value, 'flow registry': registry_path}
+                value = resolve_references(j, folder, registry)[self.section]
+            flows = as_flows(value, self.section)
+            if len(flows) != self.length:
+                raise ValueError('{} has {} flows but the matrices have {} rows'.format(self.section, len(flows),
+                                                                                      self.length))
+            self._flows = flows
+        return self._flows
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        return self.flows[i]
+
+    def __iter__(self):
+        return iter(self.flows)
+
+    def __eq__(self, other):
+        try:
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        except TypeError:
+            return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __repr__(self):
+        return 'LazyFlowList({!r}, {} flows{})'.format(self.section, self.length, '' if self.loaded else ', not loaded')
+
+
+def lazy_disclosure(path, folder=None, registry=None, block_size=SCAN_BLOCK):
+    """
+    Load the matrices of a disclosure file as arrays, with flow tables that load on first access
+    :param path: the disclosure file
+    :param folder: folder against which a flow registry path is resolved
+    :param registry: optional FlowRegistry
+    :param block_size: bytes read at a time while locating the members of the file
+    :return: (6-tuple, dict of matrix name to the matrix's other members, e.g. 'shape' and 'uncertainty')
+    """
+    with open(path, 'rb') as fp:
+        spans = scan_json(fp, block_size=block_size)
+        matrices, members = {}, {}
+        for name in MATRIX_ROWS:
+            try:
+                matrices[name], members[name] = read_matrix(read_span(fp, spans[name]))
+            except ValueError as e:
+                raise ValueError('Malformed {} in {}: {}'.format(name, path, e))
+        registry_path = None
+        if 'flow registry' in spans:
+            registry_path = json.loads(read_span(fp, spans['flow registry']).decode('utf-8'))
+    references = folder, registry_path, registry
+
+    lengths = {'foreground flows': members['Af']['shape'][1],
+               'background flows': members['Ad']['shape'][0],
+               'foreground emissions': members['Bf']['shape'][0]}
+    flows = tuple(LazyFlowList(path, spans[section], section, lengths[section], references=references)
+                  for section in FLOW_SECTIONS)
+    return flows + (matrices['Af'], matrices['Ad'], matrices['Bf']), members
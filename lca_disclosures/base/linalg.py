@@ -0,0 +1,156 @@
+"""
+Aggregation of a disclosure into a single unit process.
+
+The foreground activity levels x needed to deliver one unit of the functional unit (foreground flow 0) solve
+(I - Af) x = e_0.  The aggregated process then requires Ad x from the background and emits Bf x.
+
+Most foregrounds are acyclic or nearly so.  Strongly connected components of the Af graph are found with
+scipy.sparse.csgraph and the condensed graph is ordered topologically, so that (I - Af) is block triangular: each
+acyclic flow is solved by back-substitution and only the flows inside loops need a linear solve.
+"""
+from collections import namedtuple
+
+import numpy as np
+from scipy.sparse import csr_matrix, identity
+from scipy.sparse.csgraph import connected_components
+from scipy.sparse.linalg import spsolve, splu
+
+from .graph import _compressed_entries
+
+ForegroundStructure = namedtuple('ForegroundStructure', ('n_components', 'labels', 'sizes', 'levels'))
+ForegroundStructure.__doc__ = """
+Strongly connected components of the foreground.
+
+labels gives the component of each foreground flow and sizes the number of flows in each component.  levels is the
+topological order of the condensed graph, grouped: a list of arrays of component labels, where every component in a
+level is consumed only by components in earlier levels.  Components larger than 1 (and single flows that consume
+themselves) are loops.
+"""
+
+Aggregation = namedtuple('Aggregation', ('activity', 'background', 'emissions'))
+Aggregation.__doc__ = """
+A disclosure aggregated to a unit process: foreground activity levels x, background requirements Ad x and
+emissions Bf x, per unit of the functional unit.
+"""
+
+# loops larger than this are solved with a sparse rather than a dense solver
+DENSE_LIMIT = 500
+
+
+def foreground_structure(disclosure):
+    """
+    Find the strongly connected components of Af and a topological ordering of the condensed graph.
+    :param disclosure: a BaseDisclosure
+    :return: ForegroundStructure
+    """
+    af = disclosure.sparse_matrix('Af', 'csc')
+    n_components, labels = connected_components(af, directed=True, connection='strong')
+    sizes = np.bincount(labels, minlength=n_components)
+
+    # condensed edges run from consumer (column) to input (row)
+    rows, cols, _ = disclosure.matrix_arrays('Af')
+    src = labels[cols]
+    dst = labels[rows]
+    between = src != dst
+    condensed = np.unique(np.stack([src[between], dst[between]]), axis=1)
+    indegree = np.bincount(condensed[1], minlength=n_components)
+    successors = _csr_from_edges(condensed, n_components)
+
+    levels = []
+    level = np.flatnonzero(indegree == 0)
+    while len(level):
+        levels.append(level)
+        positions, _ = _compressed_entries(successors, level)
+        targets = successors.indices[positions]
+        np.subtract.at(indegree, targets, 1)
+        level = np.unique(targets[indegree[targets] == 0])
+
+    return ForegroundStructure(n_components, labels, sizes, levels)
+
+
+def _csr_from_edges(edges, n):
+    return csr_matrix((np.ones(edges.shape[1]), (edges[0], edges[1])), shape=(n, n))
+
+
+def factorise(disclosure):
+    """
+    Sparse LU factorisation of (I - Af).  The result's solve(b) solves (I - Af) x = b, and solve(b, trans='T') the
+    transposed (adjoint) system.
+    :param disclosure: a BaseDisclosure
+    :return: scipy.sparse.linalg.SuperLU
+    """
+    af = disclosure.sparse_matrix('Af', 'csc')
+    return splu((identity(af.shape[0], format='csc') - af).tocsc())
+
+
+def solve_lu(disclosure, demand):
+    """
+    Solve (I - Af) x = demand with a general sparse solver
+    """
+    af = disclosure.sparse_matrix('Af', 'csc')
+    system = (identity(af.shape[0], format='csc') - af).tocsc()
+    return np.atleast_1d(spsolve(system, demand))
+
+
+def solve_scc(disclosure, demand):
+    """
+    Solve (I - Af) x = demand by block back-substitution over the strongly connected components of Af, taken in
+    topological order.  Single flows are solved in vectorised batches, one topological level at a time; only loops
+    need a linear solve.
+    """
+    structure = disclosure.foreground_structure()
+    af = disclosure.sparse_matrix('Af', 'csc')
+    labels = structure.labels
+    diagonal = af.diagonal()
+
+    order = np.argsort(labels, kind='stable')
+    starts = np.concatenate(([0], np.cumsum(structure.sizes)))
+
+    rhs = np.array(demand, dtype=np.float64)
+    x = np.zeros_like(rhs)
+    single = structure.sizes == 1
+
+    for level in structure.levels:
+        singles = level[single[level]]
+        flows = order[starts[singles]]
+        x[flows] = rhs[flows] / (1.0 - diagonal[flows])
+        solved = [flows]
+
+        for component in level[~single[level]].tolist():
+            members = order[starts[component]:starts[component + 1]]
+            solved.append(members)
+            block = af[members][:, members]
+            system = identity(len(members), format='csc') - block
+            if len(members) <= DENSE_LIMIT:
+                x[members] = np.linalg.solve(system.toarray(), rhs[members])
+            else:
+                x[members] = spsolve(system.tocsc(), rhs[members])
+
+        # push the solved flows' requirements onto their inputs in later levels
+        positions, parents = _compressed_entries(af, np.concatenate(solved))
+        children = af.indices[positions]
+        external = labels[children] != labels[parents]
+        np.add.at(rhs, children[external], af.data[positions][external] * x[parents[external]])
+
+    return x
+
+
+SOLVERS = {
+    'scc': solve_scc,
+    'lu': solve_lu,
+}
+
+
+def aggregate(disclosure, method='scc'):
+    """
+    Aggregate a disclosure to a unit process delivering one unit of its functional unit
+    :param disclosure: a BaseDisclosure
+    :param method: 'scc' (block back-substitution, the default) or 'lu' (general sparse solve)
+    :return: Aggregation
+    """
+    p = len(disclosure.foreground_flows)
+    demand = np.zeros(p)
+    if p:
+        demand[0] = 1.0
+    x = SOLVERS[method](disclosure, demand)
+    return Aggregation(x, disclosure.matrix_product('Ad', x), disclosure.matrix_product('Bf', x))
@@ -0,0 +1,161 @@
+"""
+Combining several disclosures into one block-structured disclosure.
+
+Each input disclosure contributes a diagonal block of foreground flows.  Background flows and emissions are shared
+between blocks: flows with the same identity key are stored once.  Optionally, a cutoff flow of one disclosure can be
+linked to a foreground flow of another, which turns the cutoff's Af row into off-diagonal block entries.
+
+Uncertainty is carried over entry by entry, with the same offsets as the COO entries.  If only some inputs carry it,
+the entries of the others have none.  An entry given by several inputs is summed and loses its uncertainty, with a
+warning, since the distribution of the sum is not representable.
+"""
+import warnings
+
+import numpy as np
+
+from ..utils import arrays_to_coo
+from .disclosure import StaticDisclosure
+from .flows import FLOW_KEYS, MATRIX_ROWS, reindex_flows
+from .uncertainty import empty_uncertainty
+
+
+def _occupied_columns(disclosure):
+    p = len(disclosure.foreground_flows)
+    occupied = np.zeros(p, dtype=bool)
+    for name in ('Af', 'Ad', 'Bf'):
+        occupied[disclosure.matrix_arrays(name)[1]] = True
+    return occupied
+
+
+def _resolve_link(links, source):
+    seen = {source}
+    target = links[source]
+    while target in links:
+        if target in seen:
+            raise ValueError('Circular link involving {}'.format(source))
+        seen.add(target)
+        target = links[target]
+    return target
+
+
+def _foreground_maps(disclosures, links):
+    """
+    Assign a merged index to every foreground flow.  Flows that are linked away share the index of their target.
+    :return: list of index arrays (one per disclosure), list of (disclosure, position) for each merged flow
+    """
+    maps = [np.empty(len(d.foreground_flows), dtype=np.int64) for d in disclosures]
+    kept = []
+    for i, d in enumerate(disclosures):
+        for k in range(len(d.foreground_flows)):
+            if (i, k) not in links:
+                maps[i][k] = len(kept)
+                kept.append((i, k))
+    for source in links:
+        target = _resolve_link(links, source)
+        maps[source[0]][source[1]] = maps[target[0]][target[1]]
+    return maps, kept
+
+
+def _shared_maps(disclosures, section):
+    """
+    Deduplicate one flow list across disclosures by identity key.
+    :return: list of index arrays (one per disclosure), list of (disclosure, position) for each merged flow
+    """
+    key = FLOW_KEYS[section]
+    index = {}
+    kept = []
+    maps = []
+    for i, d in enumerate(disclosures):
+        flows = d.flows(section)
+        m = np.empty(len(flows), dtype=np.int64)
+        for k, f in enumerate(flows):
+            j = index.get(key(f))
+            if j is None:
+                j = index[key(f)] = len(kept)
+                kept.append((i, k))
+            m[k] = j
+        maps.append(m)
+    return maps, kept
+
+
+def merge_disclosures(disclosures, links=None, **kwargs):
+    """
+    Combine several disclosures into a single disclosure.
+
+    The foreground flows of each disclosure are kept, block by block, in the order the disclosures are given, so the
+    functional unit of the first disclosure is the functional unit of the result.  Background flows and emissions that
+    have the same identity key in several disclosures are merged.
+
+    links connects disclosures: it maps (i, k), the k-th foreground flow of disclosure i, to (j, l), the l-th foreground
+    flow of disclosure j.  Flow (i, k) must be a cutoff (its column is empty in Af, Ad and Bf); it is removed and its
+    Af row is redirected to flow (j, l).  links may be a dict or an iterable of pairs.
+
+    :param disclosures: iterable of BaseDisclosures
+    :param links: optional cutoff links, as described above
+    :param kwargs: passed to the StaticDisclosure constructor (e.g. filename, folder_path)
+    :return: StaticDisclosure
+    """
+    disclosures = list(disclosures)
+    links = dict(links or {})
+
+    def exists(flow):
+        i, k = flow
+        return 0 <= i < len(disclosures) and 0 <= k < len(disclosures[i].foreground_flows)
+
+    occupied = {}
+    for source, target in links.items():
+        for name, flow in (('source', source), ('target', target)):
+            if not exists(flow):
+                raise ValueError('Link {} {} does not exist'.format(name, flow))
+        i, k = source
+        if i not in occupied:
+            occupied[i] = _occupied_columns(disclosures[i])
+        if occupied[i][k]:
+            raise ValueError('Foreground flow {} of disclosure {} is not a cutoff and cannot be linked'.format(k, i))
+    if (0, 0) in links:
+        raise ValueError('The functional unit of the first disclosure cannot be linked')
+
+    fg_maps, fg_kept = _foreground_maps(disclosures, links)
+    row_maps = {'foreground flows': fg_maps}
+    kept = {'foreground flows': fg_kept}
+    for section in ('background flows', 'foreground emissions'):
+        row_maps[section], kept[section] = _shared_maps(disclosures, section)
+
+    uncertainties = [d.uncertainty or {} for d in disclosures]
+    carry = any(uncertainties)
+
+    p = len(fg_kept)
+    matrices = []
+    uncertainty = {} if carry else None
+    for name in ('Af', 'Ad', 'Bf'):
+        section = MATRIX_ROWS[name]
+        rows, cols, vals, us = [], [], [], []
+        for i, d in enumerate(disclosures):
+            r, c, v = d.matrix_arrays(name)
+            rows.append(row_maps[section][i][r])
+            cols.append(fg_maps[i][c])
+            vals.append(np.asarray(v, dtype=np.float64))
+            if carry:
+                u = uncertainties[i].get(name)
+                us.append(empty_uncertainty(len(v)) if u is None else u)
+
+        # entries in row-major order, summing those that several inputs give
+        linear = np.concatenate(rows) * max(p, 1) + np.concatenate(cols)
+        order = np.argsort(linear, kind='stable')
+        linear, starts, counts = np.unique(linear[order], return_index=True, return_counts=True)
+        summed = np.add.reduceat(np.concatenate(vals)[order], starts) if len(starts) else np.zeros(0)
+        matrices.append(arrays_to_coo(linear // max(p, 1), linear % max(p, 1), summed))
+
+        if carry:
+            u = np.concatenate(us)[order][starts]
+            shared = counts > 1
+            if np.any(shared):
+                warnings.warn('{} {} entries are given by several disclosures; their uncertainty is dropped'.format(
+                    int(shared.sum()), name))
+                u[shared] = empty_uncertainty(int(shared.sum()))
+            uncertainty[name] = u
+
+    flows = [reindex_flows([disclosures[i].flows(section)[k] for i, k in kept[section]])
+             for section in ('foreground flows', 'background flows', 'foreground emissions')]
+
+    return StaticDisclosure(flows + matrices, uncertainty=uncertainty, **kwargs)
@@ -0,0 +1,163 @@
+"""
+Monte Carlo propagation of coefficient uncertainty through a disclosure.
+
+The sparsity pattern of the disclosure is fixed, so every iteration only replaces the coefficient values.  All
+coefficients are sampled in vectorised batches; for each batch the foreground systems (I - Af) x = e_0 are solved
+together (as a stacked dense solve for small foregrounds, otherwise as sparse solves on a CSC matrix whose structure
+is built once), and Ad x and Bf x are computed as sparse products over the whole batch.
+
+Batches are independent and seeded from one numpy SeedSequence, so results depend only on the seed, the number of
+iterations and the batch size - not on how many processes are used.
+"""
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.sparse import csc_matrix, csr_matrix
+from scipy.sparse.linalg import splu
+
+from .uncertainty import empty_uncertainty, sample
+
+# foregrounds up to this size are solved as a stacked dense system
+DENSE_LIMIT = 200
+
+
+class MonteCarloResult(namedtuple('MonteCarloResult', ('activity', 'background', 'emissions'))):
+    """
+    Sampled aggregation results, one row per iteration: foreground activity levels x, background requirements Ad x
+    and emissions Bf x.
+    """
+    __slots__ = ()
+
+    def mean(self):
+        return MonteCarloResult(*(a.mean(axis=0) for a in self))
+
+    def std(self):
+        return MonteCarloResult(*(a.std(axis=0) for a in self))
+
+    def percentile(self, q):
+        return MonteCarloResult(*(np.percentile(a, q, axis=0) for a in self))
+
+
+def _spec(disclosure):
+    """
+    Everything a worker needs to run iterations, as plain numpy arrays (so it can be sent to another process)
+    """
+    uncertainty = disclosure.uncertainty
+    if uncertainty is None:
+        raise ValueError('The disclosure has no uncertainty information')
+    spec = {'p': len(disclosure.foreground_flows)}
+    for name in ('Af', 'Ad', 'Bf'):
+        rows, cols, vals = disclosure.matrix_arrays(name)
+        u = uncertainty.get(name)
+        spec[name] = {
+            'shape': disclosure.matrix_shape(name),
+            'rows': rows,
+            'cols': cols,
+            'vals': vals,
+            'uncertainty': empty_uncertainty(len(vals)) if u is None else u,
+        }
+    return spec
+
+
+def _scatter(matrix):
+    """
+    Sparse (nnz x rows) matrix summing per-entry contributions into their rows
+    """
+    nnz = len(matrix['rows'])
+    return csr_matrix((np.ones(nnz), (np.arange(nnz), matrix['rows'])), shape=(nnz, matrix['shape'][0]))
+
+
+def _solve_dense(p, af, samples):
+    size = samples.shape[0]
+    system = np.zeros((size, p * p))
+    system[:, np.arange(p) * (p + 1)] = 1.0
+    np.add.at(system, (slice(None), af['rows'] * p + af['cols']), -samples)
+    demand = np.zeros((size, p, 1))
+    demand[:, 0] = 1.0
+    return np.linalg.solve(system.reshape(size, p, p), demand)[:, :, 0]
+
+
+def _solve_sparse(p, af, samples):
+    # the structure of I - Af is built once; each iteration only recomputes the stored values
+    diagonal = np.arange(p)
+    rows = np.concatenate((diagonal, af['rows']))
+    cols = np.concatenate((diagonal, af['cols']))
+    stored, positions = np.unique(cols * p + rows, return_inverse=True)
+    indices = stored % p
+    indptr = np.concatenate(([0], np.cumsum(np.bincount(stored // p, minlength=p))))
+
+    demand = np.zeros(p)
+    demand[0] = 1.0
+    x = np.empty((samples.shape[0], p))
+    values = np.empty(len(rows))
+    values[:p] = 1.0
+    for i in range(samples.shape[0]):
+        values[p:] = -samples[i]
+        data = np.bincount(positions, weights=values, minlength=len(stored))
+        x[i] = splu(csc_matrix((data, indices, indptr), shape=(p, p))).solve(demand)
+    return x
+
+
+def run_batch(spec, seed, size):
+    """
+    Run `size` iterations.  Module-level, so that it can be dispatched to a process pool.
+    :param spec: as returned by _spec()
+    :param seed: a numpy SeedSequence
+    :param size: number of iterations
+    :return: MonteCarloResult
+    """
+    rng = np.random.default_rng(seed)
+    p = spec['p']
+    samples = {name: sample(spec[name]['uncertainty'], spec[name]['vals'], size, rng) for name in ('Af', 'Ad', 'Bf')}
+
+    af = spec['Af']
+    if p <= DENSE_LIMIT:
+        x = _solve_dense(p, af, samples['Af'])
+    else:
+        x = _solve_sparse(p, af, samples['Af'])
+
+    results = [x]
+    for name in ('Ad', 'Bf'):
+        matrix = spec[name]
+        contributions = samples[name] * x[:, matrix['cols']]
+        results.append(_scatter(matrix).T.dot(contributions.T).T)
+    return MonteCarloResult(*results)
+
+
+class MonteCarlo(object):
+    """
+    Monte Carlo analysis of a disclosure with uncertainty information.
+
+    :param disclosure: a BaseDisclosure whose uncertainty property is not None
+    :param iterations: number of iterations
+    :param seed: seed for numpy's SeedSequence; None draws fresh entropy
+    :param batch_size: iterations sampled and solved together
+    :param processes: number of worker processes; None or 1 runs in this process
+    """
+    def __init__(self, disclosure, iterations=1000, seed=None, batch_size=100, processes=None):
+        self.spec = _spec(disclosure)
+        self.iterations = iterations
+        self.seed = seed
+        self.batch_size = batch_size
+        self.processes = processes
+
+    def batches(self):
+        sizes = [self.batch_size] * (self.iterations // self.batch_size)
+        if self.iterations % self.batch_size:
+            sizes.append(self.iterations % self.batch_size)
+        seeds = np.random.SeedSequence(self.seed).spawn(len(sizes))
+        return seeds, sizes
+
+    def run(self):
+        """
+        :return: MonteCarloResult with one row per iteration
+        """
+        seeds, sizes = self.batches()
+        specs = [self.spec] * len(sizes)
+        if self.processes is None or self.processes <= 1:
+            results = list(map(run_batch, specs, seeds, sizes))
+        else:
+            with ProcessPoolExecutor(max_workers=self.processes) as executor:
+                results = list(executor.map(run_batch, specs, seeds, sizes))
+        return MonteCarloResult(*(np.concatenate(parts) for parts in zip(*results)))
@@ -0,0 +1,234 @@
+"""
+Out-of-core storage of disclosure matrices.
+
+A disclosure created with out_of_core=<folder> keeps its matrices in ChunkedMatrix objects: the rows, columns and
+values of the COO entries are stored in flat binary files and memory-mapped, instead of being held as lists of
+[[row, col], value] entries.  Operations that only need to stream over the entries (cutoffs, validation,
+sparsification, products with Ad and Bf, writing JSON) read them chunk_size entries at a time, so their memory use is
+bounded by the chunk size rather than by the number of entries.  ChunkedMatrix is the on-disk kind of ArrayMatrix,
+which holds the same three arrays in memory (e.g. the matrices loaded by from_file(..., lazy=True)).
+
+from_file(..., out_of_core=<folder>) reads the matrices of a JSON file straight into chunked storage: the members of
+the document are located with lazy.scan_json(), which reads it block by block and respects JSON strings, and the COO
+entries of each matrix are parsed block by block into chunks, so that neither the document nor the entry lists are
+ever held in memory.
+"""
+import json
+import os
+import shutil
+import tempfile
+import weakref
+
+try:
+    from collections.abc import Sequence
+except ImportError:  # python 2
+    from collections import Sequence
+
+import numpy as np
+
+from ..utils import arrays_to_coo, coo_to_arrays
+from .flows import FLOW_SECTIONS
+
+# number of COO entries read or processed at a time
+CHUNK_SIZE = 1000000
+
+_COLUMNS = (('rows', np.int64), ('cols', np.int64), ('vals', np.float64))
+
+
+def _open_array(path, dtype):
+    if os.path.getsize(path) == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r')
+
+
+class ArrayMatrix(Sequence):
+    """
+    The COO entries of one matrix held as three numpy arrays (rows, cols, vals).  As a sequence it behaves like the
+    usual list of [[row, col], value] entries.
+    """
+    def __init__(self, rows, cols, vals):
+        self.rows = np.asarray(rows, dtype=np.int64)
+        self.cols = np.asarray(cols, dtype=np.int64)
+        self.vals = np.asarray(vals, dtype=np.float64)
+
+    def chunks(self, chunk_size=CHUNK_SIZE):
+        """
+        Generator.  Yields (rows, cols, vals) arrays of at most chunk_size entries, in order
+        """
+        for start in range(0, len(self), chunk_size):
+            stop = start + chunk_size
+            yield np.array(self.rows[start:stop]), np.array(self.cols[start:stop]), np.array(self.vals[start:stop])
+
+    def __len__(self):
+        return len(self.vals)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return arrays_to_coo(self.rows[i], self.cols[i], self.vals[i])
+        return [[int(self.rows[i]), int(self.cols[i])], float(self.vals[i])]
+
+    def __iter__(self):
+        for chunk in self.chunks():
+            for entry in arrays_to_coo(*chunk):
+                yield entry
+
+    def __eq__(self, other):
+        try:
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        except TypeError:
+            return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __repr__(self):
+        return 'ArrayMatrix({} entries)'.format(len(self))
+
+
+class ChunkedMatrix(ArrayMatrix):
+    """
+    The COO entries of one matrix, stored in a folder as three flat binary arrays (rows.bin, cols.bin, vals.bin) and
+    memory-mapped.
+    :param folder: the folder holding the arrays
+    """
+    def __init__(self, folder):
+        self.folder = folder
+        for name, dtype in _COLUMNS:
+            setattr(self, name, _open_array(os.path.join(folder, name + '.bin'), dtype))
+
+    @classmethod
+    def write(cls, folder, chunks):
+        """
+        Store COO entries given as chunks of arrays
+        :param folder: the folder to create
+        :param chunks: iterable of (rows, cols, vals)
+        :return: ChunkedMatrix
+        """
+        os.makedirs(folder)
+        files = [open(os.path.join(folder, name + '.bin'), 'wb') for name, _ in _COLUMNS]
+        try:
+            for chunk in chunks:
+                for fp, values, (_, dtype) in zip(files, chunk, _COLUMNS):
+                    np.asarray(values, dtype=dtype).tofile(fp)
+        finally:
+            for fp in files:
+                fp.close()
+        return cls(folder)
+
+    @classmethod
+    def from_coo(cls, folder, data, chunk_size=CHUNK_SIZE):
+        """
+        Store a list of [[row, col], value] entries, or an ArrayMatrix
+        """
+        if isinstance(data, ArrayMatrix):
+            return cls.write(folder, data.chunks(chunk_size))
+        return cls.write(folder, (coo_to_arrays(data[start:start + chunk_size])
+                                  for start in range(0, len(data), chunk_size)))
+
+    def __repr__(self):
+        return 'ChunkedMatrix({!r}, {} entries)'.format(self.folder, len(self))
+
+
+def matrix_chunks(data, chunk_size=CHUNK_SIZE):
+    """
+    Generator.  Yields (rows, cols, vals) arrays for the entries of a matrix: in chunks for a ChunkedMatrix, or as a
+    single chunk for an ArrayMatrix or a list of entries
+    """
+    if isinstance(data, ChunkedMatrix):
+        for chunk in data.chunks(chunk_size):
+            yield chunk
+    elif isinstance(data, ArrayMatrix):
+        yield data.rows, data.cols, data.vals
+    else:
+        yield coo_to_arrays(data)
+
+
+def storage_folder(out_of_core, owner):
+    """
+    A new folder for the chunked matrices of one disclosure
+    :param out_of_core: a folder in which to create it, or True for a temporary folder that is removed when `owner`
+    is garbage collected
+    :param owner: the disclosure
+    :return: path
+    """
+    if out_of_core is True:
+        folder = tempfile.mkdtemp(prefix='disclosure-')
+        weakref.finalize(owner, shutil.rmtree, folder, True)
+        return folder
+    if not os.path.isdir(out_of_core):
+        os.makedirs(out_of_core)
+    return tempfile.mkdtemp(prefix='disclosure-', dir=out_of_core)
+
+
+def to_chunked(matrices, folder, chunk_size=CHUNK_SIZE):
+    """
+    Store each matrix that is not already chunked
+    :param matrices: dict of matrix name to COO data
+    :param folder: folder in which to create one sub-folder per matrix
+    :return: dict of matrix name to ChunkedMatrix
+    """
+    return {name: data if isinstance(data, ChunkedMatrix) else
+            ChunkedMatrix.from_coo(os.path.join(folder, name), data, chunk_size)
+            for name, data in matrices.items()}
+
+
+def iter_json(data):
+    """
+    Generator.  Yields the JSON encoding of a disclosure's data in pieces, as json.dump would write it, streaming the
+    entries of any ArrayMatrix (e.g. a ChunkedMatrix) one chunk at a time
+    """
+    encoder = json.JSONEncoder()
+    if isinstance(data, ArrayMatrix):
+        yield '['
+        first = True
+        for chunk in data.chunks():
+            if len(chunk[0]):
+                encoded = encoder.encode(arrays_to_coo(*chunk))
+                yield encoded[1:-1] if first else ', ' + encoded[1:-1]
+                first = False
+        yield ']'
+    elif isinstance(data, dict):
+        yield '{'
+        for i, (key, value) in enumerate(data.items()):
+            yield '{}{}: '.format(', ' if i else '', encoder.encode(key))
+            for piece in iter_json(value):
+                yield piece
+        yield '}'
+    else:
+        for piece in encoder.iterencode(data):
+            yield piece
+
+
+def read_json(path, folder, chunk_size=CHUNK_SIZE):
+    """
+    Read a disclosure JSON file, streaming its matrices into chunked storage
+    :param path: the file
+    :param folder: folder in which to store the matrices
+    :param chunk_size: entries parsed at a time
+    :return: (dict of section to decoded flow table, dict of matrix name to (ChunkedMatrix, declared shape), flow
+    registry path or None)
+    """
+    # lazy.py builds on ArrayMatrix, so it is imported here rather than at the top
+    from .lazy import iter_coo, iter_members, read_span, scan_json
+
+    with open(path, 'rb') as fp:
+        spans = scan_json(fp)
+        flows = {section: json.loads(read_span(fp, spans[section]).decode('utf-8')) for section in FLOW_SECTIONS}
+        registry_path = None
+        if 'flow registry' in spans:
+            registry_path = json.loads(read_span(fp, spans['flow registry']).decode('utf-8'))
+
+        matrices = {}
+        for name in ('Af', 'Ad', 'Bf'):
+            members = {}
+            for key, start, stop in iter_members(fp, spans[name][0]):
+                members[key] = start, stop
+                if 'data' in members and 'shape' in members:
+                    break
+            if 'data' not in members or 'shape' not in members:
+                raise ValueError('Malformed {} in {}: no data or shape'.format(name, path))
+            shape = json.loads(read_span(fp, members['shape']).decode('utf-8'))
+            chunks = iter_coo(fp, members['data'], chunk_size)
+            matrices[name] = (ChunkedMatrix.write(os.path.join(folder, name), chunks), [int(n) for n in shape])
+    return flows, matrices, registry_path
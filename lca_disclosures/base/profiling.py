@@ -0,0 +1,176 @@
+"""
+Stage-level instrumentation for disclosure construction.
+
+A disclosure created with ``profile=True`` (or with a ``profile_hook``) records, for each named stage of its
+construction, the wall time, the number of times the stage was entered and the peak traced memory.  Object counts
+(p, n, m and the number of nonzeros in each matrix) are recorded once the disclosure is prepared.  When profiling is
+disabled the stages are entered through a shared no-op context manager, so the instrumentation costs one attribute
+lookup per stage.
+"""
+import logging
+import time
+import tracemalloc
+
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class _NullStage(object):
+    """
+    No-op context manager used for every stage when profiling is disabled
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+NULL_STAGE = _NullStage()
+
+
+class StageRecord(object):
+    """
+    Accumulated measurements for one named stage
+    """
+    __slots__ = ('name', 'calls', 'wall_time', 'peak_memory')
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.wall_time = 0.0
+        self.peak_memory = 0
+
+    def as_dict(self):
+        return {'calls': self.calls, 'wall_time': self.wall_time, 'peak_memory': self.peak_memory}
+
+    def __repr__(self):
+        return 'StageRecord({!r}, calls={}, wall_time={:.6f}, peak_memory={})'.format(self.name, self.calls,
+                                                                                     self.wall_time, self.peak_memory)
+
+
+class _Stage(object):
+
+    __slots__ = ('_stats', '_record', '_start', '_base_memory', '_peak')
+
+    def __init__(self, stats, record):
+        self._stats = stats
+        self._record = record
+        self._peak = 0
+
+    def __enter__(self):
+        self._stats._push(self)
+        self._start = time.perf_counter()
+        return self._record
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        elapsed = time.perf_counter() - self._start
+        self._stats._pop(self, elapsed)
+        return False
+
+
+class DisclosureStats(object):
+    """
+    Per-stage wall time, call counts, peak memory and object counts for a disclosure.
+
+    :param hook: optional callable, called as ``hook(stats, record)`` each time a stage completes
+    :param trace_memory: if True (default), peak memory of each stage is measured with ``tracemalloc``
+    """
+    def __init__(self, hook=None, trace_memory=True):
+        self.hook = hook
+        self.trace_memory = trace_memory
+        self.stages = OrderedDict()
+        self.counts = OrderedDict()
+        self._stack = []
+        self._started_tracing = False
+
+    def stage(self, name):
+        """
+        Context manager measuring one pass through the stage called ``name``
+        :param name:
+        :return:
+        """
+        try:
+            record = self.stages[name]
+        except KeyError:
+            record = self.stages[name] = StageRecord(name)
+        return _Stage(self, record)
+
+    def count(self, name, n=1):
+        """
+        Increment the object counter ``name`` by ``n``
+        """
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def record_disclosure(self, disclosure):
+        """
+        Record the dimensions of a prepared disclosure: p, n, m and the number of nonzeros in each matrix
+        :param disclosure: a BaseDisclosure
+        :return:
+        """
+        self.counts['p'] = len(disclosure.foreground_flows)
+        self.counts['n'] = len(disclosure.background_flows)
+        self.counts['m'] = len(disclosure.emission_flows)
+        for name in ('Af', 'Ad', 'Bf'):
+            self.counts['nnz_{}'.format(name)] = len(getattr(disclosure, name))
+
+    def _push(self, stage):
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            current, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                parent = self._stack[-1]
+                parent._peak = max(parent._peak, peak)
+            stage._base_memory = current
+            stage._peak = current
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+        self._stack.append(stage)
+
+    def _pop(self, stage, elapsed):
+        self._stack.pop()
+        record = stage._record
+        record.calls += 1
+        record.wall_time += elapsed
+        if self.trace_memory:
+            peak = max(stage._peak, tracemalloc.get_traced_memory()[1])
+            record.peak_memory = max(record.peak_memory, peak - stage._base_memory)
+            if self._stack:
+                parent = self._stack[-1]
+                parent._peak = max(parent._peak, peak)
+                if hasattr(tracemalloc, 'reset_peak'):
+                    tracemalloc.reset_peak()
+            elif self._started_tracing:
+                tracemalloc.stop()
+                self._started_tracing = False
+
+        logger.debug('stage %s: %.6f s, peak memory %d B', record.name, elapsed, record.peak_memory)
+        if self.hook is not None:
+            self.hook(self, record)
+
+    def as_dict(self):
+        return {
+            'stages': OrderedDict((k, v.as_dict()) for k, v in self.stages.items()),
+            'counts': OrderedDict(self.counts),
+        }
+
+    def report(self):
+        """
+        Returns a plain-text timing report, one line per stage followed by the object counts
+        :return:
+        """
+        width = max([len('stage')] + [len(k) for k in self.stages])
+        lines = ['{:<{w}}  {:>6}  {:>12}  {:>14}'.format('stage', 'calls', 'wall time/s', 'peak memory/B', w=width)]
+        for record in self.stages.values():
+            lines.append('{:<{w}}  {:>6}  {:>12.6f}  {:>14}'.format(record.name, record.calls, record.wall_time,
+                                                                   record.peak_memory, w=width))
+        if self.counts:
+            lines.append('')
+            lines.append(', '.join('{}={}'.format(k, v) for k, v in self.counts.items()))
+        return '\n'.join(lines)
+
+    def __str__(self):
+        return self.report()
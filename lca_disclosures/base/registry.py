@@ -0,0 +1,316 @@
+"""
+A shared, content-addressed store of background flows and emissions.
+
+Disclosures built on the same background repeat the same background flow and emission entries.  A FlowRegistry
+interns each flow once, under a stable hash of its identity key (see flows.py), and gives it an integer id.  A
+disclosure written with a registry stores only the ids of its background flows and emissions, plus the path of the
+registry file; from_file resolves the ids again, and a disclosure loaded this way shares the registry's flow entries
+instead of holding its own copies.  Writing such a disclosure without a registry expands the references, so the
+output is an ordinary disclosure file.
+
+The registry file is a JSON document holding one list of flows per section; a flow's id is its position in the
+list, and flows are only ever appended, so ids are stable.  Several writers, in one process or several, may add to
+the same registry file.  A registry with a path gives out new ids only while it holds the file's lock (a '.lock' file
+next to it): it first merges in the flows that other writers have saved, then saves its new flows before releasing
+the lock, so two writers never give different flows the same id.  compact() interns all the flows of a disclosure
+under one lock.  FlowRegistry.open() reloads a registry whose file has changed, and a registry asked for an id it
+does not hold reloads its file before giving up.  A flow may only be interned under an identity that is already taken
+if its metadata is the same.
+"""
+import hashlib
+import json
+import os
+import time
+from contextlib import contextmanager
+
+try:
+    from collections.abc import Sequence
+except ImportError:  # python 2
+    from collections import Sequence
+
+import numpy as np
+
+from .flows import FLOW_KEYS, FLOW_TYPES
+
+REGISTRY_SECTIONS = ('background flows', 'foreground emissions')
+
+# seconds to wait for another writer to release a registry file
+LOCK_TIMEOUT = 60
+
+
+def flow_hash(flow, section):
+    """
+    Stable hash of a flow's identity key
+    """
+    key = json.dumps(list(FLOW_KEYS[section](flow)), separators=(',', ':'))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def _metadata(flow):
+    """
+    A flow's fields other than its index, in a form that compares equal however the flow was read
+    """
+    return json.dumps({k: v for k, v in flow.items() if k != 'index'}, sort_keys=True)
+
+
+def _stamp(path):
+    """
+    (modification time, size) of a file, or None if it does not exist
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+@contextmanager
+def _file_lock(path, timeout=LOCK_TIMEOUT):
+    """
+    Hold an exclusive lock on a file, as a lock file next to it that only one process can create
+    """
+    lock = path + '.lock'
+    deadline = time.time() + timeout
+    while True:
+        try:
+            fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            if time.time() > deadline:
+                raise TimeoutError('Timed out waiting for {} (delete it if no writer is running)'.format(lock))
+            time.sleep(0.01)
+    try:
+        yield
+    finally:
+        os.close(fd)
+        os.remove(lock)
+
+
+class FlowRegistry(object):
+    """
+    Interns background flows and emissions, giving each an integer id.
+
+    :param path: the registry file.  If it exists it is loaded.
+    """
+    _open = {}
+
+    def __init__(self, path=None):
+        self.path = path
+        self._flows = {section: [] for section in REGISTRY_SECTIONS}
+        self._ids = {section: {} for section in REGISTRY_SECTIONS}
+        self._dirty = False
+        self._stamp = None
+        self._locked = False
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    @classmethod
+    def open(cls, path):
+        """
+        Return the registry stored at path, shared by every disclosure that refers to it so that they share the same
+        flow entries.  The file is loaded once per process, and again whenever it has changed on disk (e.g. another
+        writer added flows); since ids are stable, it is reloaded in place.
+        """
+        path = os.path.abspath(path)
+        registry = cls._open.get(path)
+        if registry is None:
+            registry = cls._open[path] = cls(path)
+        else:
+            registry.refresh()
+        return registry
+
+    def refresh(self):
+        """
+        Merge in the flows that other writers have saved, if the file has changed since it was loaded or saved
+        :return: True if flows were added
+        """
+        if self.path is None:
+            return False
+        stamp = _stamp(self.path)
+        if stamp is None or stamp == self._stamp:
+            return False
+        saved = self._read(self.path)
+        added = False
+        for section in REGISTRY_SECTIONS:
+            flows, theirs = self._flows[section], saved[section]
+            shared = min(len(flows), len(theirs))
+            if any(flow_hash(theirs[i], section) != flow_hash(flows[i], section) for i in range(shared)) or \
+                    (len(flows) > shared and len(theirs) > shared):
+                raise ValueError('The {} of registry {} have different ids from those saved in the file'.format(
+                    section, self.path))
+            for i in range(shared, len(theirs)):
+                self._ids[section][flow_hash(theirs[i], section)] = i
+                flows.append(theirs[i])
+                added = True
+        self._stamp = stamp
+        return added
+
+    @contextmanager
+    def locked(self):
+        """
+        Hold the lock of the registry file, so that the flows interned meanwhile get ids no other writer gives out.
+        On entry the registry is brought up to date with the file; on exit new flows are saved.  A registry without
+        a path needs no lock.
+        """
+        if self.path is None or self._locked:
+            yield self
+            return
+        with _file_lock(self.path):
+            self._locked = True
+            try:
+                self.refresh()
+                yield self
+                self._write(self.path)
+            finally:
+                self._locked = False
+
+    def __len__(self):
+        return sum(len(flows) for flows in self._flows.values())
+
+    def intern(self, flow, section):
+        """
+        Add a flow to the registry, unless a flow with the same identity is already present
+        :param flow: a flow entry; its 'index' field is not stored
+        :param section: 'background flows' or 'foreground emissions'
+        :return: the flow's id
+        """
+        h = flow_hash(flow, section)
+        flow_id = self._ids[section].get(h)
+        if flow_id is None:
+            with self.locked():
+                flow_id = self._ids[section].get(h)
+                if flow_id is None:
+                    flow_id = self._ids[section][h] = len(self._flows[section])
+                    record = FLOW_TYPES[section].from_dict(flow)
+                    record.index = None
+                    self._flows[section].append(record)
+                    self._dirty = True
+                    return flow_id
+        stored = self._flows[section][flow_id]
+        if _metadata(stored) != _metadata(flow):
+            raise ValueError('Flow {!r} has the identity of registry {} id {} but different metadata ({!r})'.format(
+                dict(flow), section, flow_id, dict(stored)))
+        return flow_id
+
+    def flow(self, section, flow_id):
+        """
+        The stored flow entry (shared - do not modify it).  An id the registry does not hold is looked up again after
+        reloading the file, in case another writer has added it.
+        """
+        flows = self._flows[section]
+        if not 0 <= flow_id < len(flows) and self.refresh():
+            flows = self._flows[section]
+        if not 0 <= flow_id < len(flows):
+            raise ValueError('Flow id {} is not in the {} of registry {} ({} flows)'.format(
+                flow_id, section, self.path, len(flows)))
+        return flows[flow_id]
+
+    @staticmethod
+    def _read(path):
+        with open(path) as fp:
+            j = json.load(fp)
+        return {section: [FLOW_TYPES[section].from_dict(f) for f in j.get(section, [])] for section in REGISTRY_SECTIONS}
+
+    def load(self):
+        stamp = _stamp(self.path)
+        for section, flows in self._read(self.path).items():
+            self._flows[section] = flows
+            self._ids[section] = {flow_hash(f, section): i for i, f in enumerate(flows)}
+        self._stamp = stamp
+        self._dirty = False
+
+    def _write(self, path):
+        if not self._dirty:
+            return
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as fp:
+            json.dump({section: [f.to_dict() for f in flows] for section, flows in self._flows.items()}, fp)
+        os.replace(tmp, path)
+        self._stamp = _stamp(path)
+        self._dirty = False
+
+    def save(self, path=None):
+        """
+        Write the registry if it has changed since it was loaded or last saved, after merging in the flows other
+        writers have saved to the file.  The file is replaced atomically.
+        """
+        path = path or self.path
+        if path is None:
+            raise ValueError('The registry has no path')
+        if path != self.path:
+            self.path = path
+            self._stamp = None
+            self._dirty = True
+        with self.locked():
+            pass
+
+    def compact(self, data, output_path):
+        """
+        Replace the background flows and emissions of serialized disclosure data with registry references
+        :param data: a disclosure's data dict
+        :param output_path: the file the data will be written to, used to store the registry path relative to it
+        :return: a new data dict
+        """
+        compact = dict(data)
+        if self.path is None:
+            raise ValueError('The registry has no path')
+        with self.locked():
+            for section in REGISTRY_SECTIONS:
+                compact[section] = {'registry': [self.intern(f, section) for f in data[section]]}
+        compact['flow registry'] = os.path.relpath(os.path.abspath(self.path),
+                                                   os.path.dirname(os.path.abspath(output_path)))
+        return compact
+
+
+class RegistryFlowList(Sequence):
+    """
+    A flow list held as registry ids.  Items are produced on access as copies of the registry records with their
+    index set to their position.
+    """
+    __slots__ = ('registry', 'section', 'ids')
+
+    def __init__(self, registry, section, ids):
+        self.registry = registry
+        self.section = section
+        self.ids = np.asarray(ids, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return self.registry.flow(self.section, int(self.ids[i])).reindexed(i if i >= 0 else len(self) + i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __eq__(self, other):
+        try:
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        except TypeError:
+            return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __repr__(self):
+        return 'RegistryFlowList({!r}, {} flows)'.format(self.section, len(self))
+
+
+def resolve_references(j, folder, registry=None):
+    """
+    Resolve the registry references in a loaded disclosure file, in place
+    :param j: the parsed JSON document
+    :param folder: the folder containing the file, against which the registry path is resolved
+    :param registry: optional FlowRegistry to use instead of the one named in the file
+    :return: j
+    """
+    for section in REGISTRY_SECTIONS:
+        if isinstance(j.get(section), dict):
+            if registry is None:
+                registry = FlowRegistry.open(os.path.join(folder, j['flow registry']))
+            j[section] = RegistryFlowList(registry, section, j[section]['registry'])
+    return j
@@ -0,0 +1,108 @@
+"""
+First-order sensitivity of an aggregated score to every disclosed coefficient.
+
+The score is a weighted sum of the aggregated results, s = w_b . (Ad x) + w_e . (Bf x), where x solves
+(I - Af) x = e_0; with w_e a vector of characterisation factors, s is an LCIA score.  Writing g = Ad^T w_b + Bf^T w_e,
+the derivatives are
+
+    ds/dAd[i, j] = w_b[i] x[j]
+    ds/dBf[i, j] = w_e[i] x[j]
+    ds/dAf[i, j] = lambda[i] x[j],  where (I - Af)^T lambda = g
+
+so one forward solve (for x) and one adjoint solve (for lambda), both with the same LU factorisation, give the
+sensitivity to every nonzero.  Elasticities (relative sensitivities, a/s ds/da) are also given, as they make
+coefficients of different units comparable.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+MATRICES = ('Af', 'Ad', 'Bf')
+
+RANKING_DTYPE = np.dtype([
+    ('matrix', 'U2'),
+    ('entry', np.int64),
+    ('row', np.int64),
+    ('col', np.int64),
+    ('value', np.float64),
+    ('sensitivity', np.float64),
+    ('elasticity', np.float64),
+])
+
+
+class SensitivityResult(namedtuple('SensitivityResult', ('score', 'activity', 'adjoint', 'sensitivities',
+                                                         'elasticities', 'entries'))):
+    """
+    score is the aggregated score, activity the foreground activity levels x and adjoint the solution lambda of the
+    adjoint system.  sensitivities and elasticities map each matrix name to an array aligned with its COO entries;
+    entries holds the matrices' (rows, cols, vals).
+    """
+    __slots__ = ()
+
+    def ranked(self, top=None):
+        """
+        All entries, ranked by the magnitude of their elasticity
+        :param top: optional number of entries to return
+        :return: structured array with RANKING_DTYPE; 'entry' is the position in the matrix's COO data
+        """
+        parts = []
+        for name in MATRICES:
+            rows, cols, vals = self.entries[name]
+            part = np.empty(len(vals), dtype=RANKING_DTYPE)
+            part['matrix'] = name
+            part['entry'] = np.arange(len(vals))
+            part['row'], part['col'], part['value'] = rows, cols, vals
+            part['sensitivity'] = self.sensitivities[name]
+            part['elasticity'] = self.elasticities[name]
+            parts.append(part)
+        ranking = np.concatenate(parts)
+        magnitude = np.abs(ranking['elasticity'])
+        order = np.argsort(-np.where(np.isnan(magnitude), -np.inf, magnitude), kind='stable')
+        return ranking[order[:top]] if top is not None else ranking[order]
+
+
+def sensitivity(disclosure, background=None, emissions=None):
+    """
+    Sensitivities of the score w_b . (Ad x) + w_e . (Bf x) to every coefficient
+    :param disclosure: a BaseDisclosure
+    :param background: weights of the background flows (w_b), or None
+    :param emissions: weights of the emissions (w_e, e.g. characterisation factors), or None
+    :return: SensitivityResult
+    """
+    if background is None and emissions is None:
+        raise ValueError('Give weights for the background flows and/or the emissions')
+    weights = {
+        'Ad': np.zeros(disclosure.matrix_shape('Ad')[0]) if background is None else np.asarray(background, float),
+        'Bf': np.zeros(disclosure.matrix_shape('Bf')[0]) if emissions is None else np.asarray(emissions, float),
+    }
+    for name, w in weights.items():
+        if w.shape != (disclosure.matrix_shape(name)[0],):
+            raise ValueError('Expected {} weights for {}, got {}'.format(disclosure.matrix_shape(name)[0], name,
+                                                                        w.shape))
+
+    p = len(disclosure.foreground_flows)
+    if not p:
+        raise ValueError('The disclosure has no foreground flows, so no functional unit to take sensitivities of')
+    lu = disclosure.factorisation()
+    demand = np.zeros(p)
+    demand[0] = 1.0
+    x = lu.solve(demand)
+
+    # g = Ad^T w_b + Bf^T w_e: the score per unit of each foreground activity
+    g = np.zeros(p)
+    entries = {name: disclosure.matrix_arrays(name) for name in MATRICES}
+    for name in ('Ad', 'Bf'):
+        rows, cols, vals = entries[name]
+        g += np.bincount(cols, weights=vals * weights[name][rows], minlength=p)
+    score = float(g.dot(x))
+    adjoint = lu.solve(g, trans='T')
+
+    row_weights = {'Af': adjoint, 'Ad': weights['Ad'], 'Bf': weights['Bf']}
+    sensitivities = {}
+    elasticities = {}
+    for name in MATRICES:
+        rows, cols, vals = entries[name]
+        sensitivities[name] = row_weights[name][rows] * x[cols]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            elasticities[name] = vals * sensitivities[name] / score if score else np.full(len(vals), np.nan)
+    return SensitivityResult(score, x, adjoint, sensitivities, elasticities, entries)
@@ -0,0 +1,153 @@
+"""
+Sparsification and quantisation of disclosed coefficients.
+
+Normalisation leaves many negligible coefficients in the matrices (e.g. 1e-15 round-off).  Entries can be dropped
+below an absolute threshold, or below a threshold relative to the largest entry in the same column of the same
+matrix, with separate tolerances per matrix.  The remaining values can be rounded to float32 precision or to a number
+of significant digits, which shortens their JSON representation.
+
+The report gives the number of entries removed, the serialized size before and after, and the error this causes in
+the aggregated results.
+"""
+import os
+import tempfile
+from collections import namedtuple
+
+import numpy as np
+
+from ..utils import arrays_to_coo
+from .ooc import ChunkedMatrix, iter_json
+
+SparsifyReport = namedtuple('SparsifyReport', ('removed', 'size_before', 'size_after', 'background_error',
+                                               'emissions_error'))
+SparsifyReport.__doc__ = """
+removed maps each matrix name to the number of entries dropped.  size_before and size_after are the lengths in bytes
+of the JSON serializations.  background_error and emissions_error are the largest absolute differences in the
+aggregated background requirements (Ad x) and emissions (Bf x).
+"""
+
+
+def _serialized_size(data):
+    return sum(len(piece) for piece in iter_json(data))
+
+
+def quantise(vals, precision):
+    """
+    Round values for storage.
+    :param vals: array of values
+    :param precision: 'float32' to round to the nearest single-precision value (and write it with the shortest decimal
+    representation), or an integer number of significant digits
+    :return: array of float64
+    """
+    if precision == 'float32':
+        return vals.astype(np.float32).astype(str).astype(np.float64)
+    fmt = '%.{}g'.format(int(precision))
+    return np.array([float(fmt % v) for v in vals.tolist()], dtype=np.float64)
+
+
+def _column_max(chunks, n_cols):
+    column_max = np.zeros(n_cols)
+    for rows, cols, vals in chunks:
+        np.maximum.at(column_max, cols, np.abs(vals))
+    return column_max
+
+
+def _sparsify_chunk(rows, cols, vals, atol, rtol, column_max, precision):
+    """
+    :return: (kept-entry mask, rows, cols, vals of the kept entries)
+    """
+    magnitude = np.abs(vals)
+    keep = magnitude >= atol if atol else np.ones(len(vals), dtype=bool)
+    if rtol:
+        keep &= magnitude >= rtol * column_max[cols]
+    kept = vals[keep]
+    if precision is not None:
+        kept = quantise(kept, precision)
+        nonzero = kept != 0
+        keep[np.flatnonzero(keep)[~nonzero]] = False
+        kept = kept[nonzero]
+    return keep, rows[keep], cols[keep], kept
+
+
+def sparsify_matrices(disclosure, atol=0.0, rtol=0.0, tolerances=None, precision=None):
+    """
+    Apply thresholds and quantisation to the matrices of a disclosure.  Out-of-core matrices are processed chunk by
+    chunk, and the results are stored next to them.
+    :param disclosure: a BaseDisclosure
+    :param atol: drop entries whose absolute value is below atol
+    :param rtol: drop entries whose absolute value is below rtol times the largest absolute value in their column
+    :param tolerances: optional per-matrix overrides, e.g. {'Bf': {'atol': 1e-12}}
+    :param precision: None, 'float32' or a number of significant digits
+    :return: (dict of matrix name to COO data, dict of matrix name to kept-entry mask; masks of out-of-core matrices
+    are only kept, and are otherwise None, if the disclosure has uncertainty)
+    """
+    tolerances = tolerances or {}
+    p = len(disclosure.foreground_flows)
+    folder = None
+    matrices = {}
+    masks = {}
+    for name in ('Af', 'Ad', 'Bf'):
+        tol = tolerances.get(name, {})
+        m_atol, m_rtol = tol.get('atol', atol), tol.get('rtol', rtol)
+        column_max = _column_max(disclosure.matrix_chunks(name), p) if m_rtol else None
+
+        matrix = getattr(disclosure, name)
+        if not isinstance(matrix, ChunkedMatrix):
+            keep, rows, cols, vals = _sparsify_chunk(*disclosure.matrix_arrays(name), atol=m_atol, rtol=m_rtol,
+                                                     column_max=column_max, precision=precision)
+            matrices[name] = arrays_to_coo(rows, cols, vals)
+            masks[name] = keep
+            continue
+
+        keeps = []
+
+        def chunks():
+            for chunk in disclosure.matrix_chunks(name):
+                keep, rows, cols, vals = _sparsify_chunk(*chunk, atol=m_atol, rtol=m_rtol, column_max=column_max,
+                                                         precision=precision)
+                if disclosure.uncertainty is not None:
+                    keeps.append(keep)
+                yield rows, cols, vals
+
+        if folder is None:
+            folder = tempfile.mkdtemp(prefix='sparsified-', dir=os.path.dirname(matrix.folder))
+        matrices[name] = ChunkedMatrix.write(os.path.join(folder, name), chunks())
+        if disclosure.uncertainty is not None:
+            masks[name] = np.concatenate(keeps) if keeps else np.zeros(0, dtype=bool)
+        else:
+            masks[name] = None
+    return matrices, masks
+
+
+def sparsify_disclosure(disclosure, atol=0.0, rtol=0.0, tolerances=None, precision=None):
+    """
+    Sparsify and quantise a disclosure.  Arguments are as for sparsify_matrices().
+    :return: (6-tuple, uncertainty dict or None, dict of matrix name to kept-entry mask or None)
+    """
+    matrices, masks = sparsify_matrices(disclosure, atol=atol, rtol=rtol, tolerances=tolerances, precision=precision)
+    result = (disclosure.foreground_flows, disclosure.background_flows, disclosure.emission_flows,
+              matrices['Af'], matrices['Ad'], matrices['Bf'])
+
+    uncertainty = None
+    if disclosure.uncertainty is not None:
+        uncertainty = {name: u[masks[name]] for name, u in disclosure.uncertainty.items()}
+
+    return result, uncertainty, masks
+
+
+def sparsify_report(before, after):
+    """
+    Compare a disclosure with its sparsified version
+    :param before: the original BaseDisclosure
+    :param after: the sparsified BaseDisclosure
+    :return: SparsifyReport
+    """
+    exact = before.aggregate()
+    approx = after.aggregate()
+    return SparsifyReport(
+        {name: len(getattr(before, name)) - len(getattr(after, name)) for name in ('Af', 'Ad', 'Bf')},
+        _serialized_size(before.data),
+        _serialized_size(after.data),
+        float(np.max(np.abs(exact.background - approx.background), initial=0.0)),
+        float(np.max(np.abs(exact.emissions - approx.emissions), initial=0.0)),
+    )
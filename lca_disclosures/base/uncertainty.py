@@ -0,0 +1,165 @@
+"""
+Per-entry uncertainty of disclosed coefficients.
+
+Uncertainty is stored as a numpy structured array aligned with the COO entries of a matrix, using the brightway /
+stats_arrays parameterisation: an integer distribution type plus loc, scale, shape, minimum, maximum and negative.
+Missing parameters are NaN; a missing loc means the entry's amount.
+"""
+import numpy as np
+
+UNDEFINED = 0
+NO_UNCERTAINTY = 1
+LOGNORMAL = 2
+NORMAL = 3
+UNIFORM = 4
+TRIANGULAR = 5
+
+UNCERTAINTY_DTYPE = np.dtype([
+    ('uncertainty type', np.int64),
+    ('loc', np.float64),
+    ('scale', np.float64),
+    ('shape', np.float64),
+    ('minimum', np.float64),
+    ('maximum', np.float64),
+    ('negative', np.bool_),
+])
+
+PARAMETERS = ('loc', 'scale', 'shape', 'minimum', 'maximum')
+
+
+def _param(exchange, name):
+    value = exchange.get(name)
+    return np.nan if value is None else value
+
+
+def uncertainty_array(exchanges):
+    """
+    Build an uncertainty array from an iterable of exchange-like mappings (anything with .get())
+    :param exchanges:
+    :return: structured array with UNCERTAINTY_DTYPE
+    """
+    return np.array([
+        (x.get('uncertainty type') or UNDEFINED,) + tuple(_param(x, k) for k in PARAMETERS) +
+        (bool(x.get('negative', False)),)
+        for x in exchanges
+    ], dtype=UNCERTAINTY_DTYPE)
+
+
+def empty_uncertainty(count):
+    """
+    An uncertainty array of `count` entries with no uncertainty
+    """
+    u = np.zeros(count, dtype=UNCERTAINTY_DTYPE)
+    for k in PARAMETERS:
+        u[k] = np.nan
+    return u
+
+
+def scale_uncertainty(u, factors):
+    """
+    The uncertainty of the entries after multiplying their amounts by `factors`.  Negative factors flip the sign of
+    the distribution.
+    :param u: uncertainty array
+    :param factors: array of multipliers, aligned with u
+    :return: a new uncertainty array
+    """
+    u = u.copy()
+    factors = np.asarray(factors, dtype=np.float64)
+    magnitude = np.abs(factors)
+    flip = factors < 0
+
+    lognormal = u['uncertainty type'] == LOGNORMAL
+    with np.errstate(divide='ignore'):
+        u['loc'][lognormal] += np.log(magnitude[lognormal])
+    u['negative'][lognormal] ^= flip[lognormal]
+
+    linear = ~lognormal
+    for k in ('loc', 'scale', 'minimum', 'maximum'):
+        u[k][linear] *= factors[linear] if k != 'scale' else magnitude[linear]
+    swap = linear & flip
+    u['minimum'][swap], u['maximum'][swap] = u['maximum'][swap], u['minimum'][swap]
+    return u
+
+
+# the parameters each supported distribution cannot do without (a missing loc means the entry's amount)
+REQUIRED = {
+    LOGNORMAL: ('scale',),
+    NORMAL: ('scale',),
+    UNIFORM: ('minimum', 'maximum'),
+    TRIANGULAR: ('minimum', 'maximum'),
+}
+
+
+def _check_parameters(u, idx, kind):
+    for name in REQUIRED[kind]:
+        missing = idx[np.isnan(u[name][idx])]
+        if len(missing):
+            raise ValueError('Uncertainty entry {} (type {}) has no {}; {} entries of this type lack it'.format(
+                int(missing[0]), kind, name, len(missing)))
+
+
+def sample(u, amounts, size, rng):
+    """
+    Draw `size` samples of every entry, vectorised over entries of each distribution type.  Entries with no
+    uncertainty, or with a distribution type not supported here, are fixed at their amounts.  Raises ValueError if an
+    entry lacks a parameter its distribution needs (see REQUIRED), rather than sampling NaN.
+    :param u: uncertainty array
+    :param amounts: the entries' amounts
+    :param size: number of samples
+    :param rng: numpy Generator
+    :return: array of shape (size, len(u))
+    """
+    amounts = np.asarray(amounts, dtype=np.float64)
+    out = np.empty((size, len(u)))
+    out[:] = amounts
+    loc = np.where(np.isnan(u['loc']), amounts, u['loc'])
+    kind = u['uncertainty type']
+
+    idx = np.flatnonzero(kind == LOGNORMAL)
+    if len(idx):
+        _check_parameters(u, idx, LOGNORMAL)
+        sign = np.where(u['negative'][idx], -1.0, 1.0)
+        log_loc = np.where(np.isnan(u['loc'][idx]), np.log(np.abs(amounts[idx])), u['loc'][idx])
+        out[:, idx] = sign * np.exp(log_loc + u['scale'][idx] * rng.standard_normal((size, len(idx))))
+
+    idx = np.flatnonzero(kind == NORMAL)
+    if len(idx):
+        _check_parameters(u, idx, NORMAL)
+        out[:, idx] = loc[idx] + u['scale'][idx] * rng.standard_normal((size, len(idx)))
+
+    idx = np.flatnonzero(kind == UNIFORM)
+    if len(idx):
+        _check_parameters(u, idx, UNIFORM)
+        low, high = u['minimum'][idx], u['maximum'][idx]
+        out[:, idx] = low + (high - low) * rng.random((size, len(idx)))
+
+    idx = np.flatnonzero(kind == TRIANGULAR)
+    if len(idx):
+        _check_parameters(u, idx, TRIANGULAR)
+        low, high = u['minimum'][idx], u['maximum'][idx]
+        mode = np.clip(loc[idx], low, high)
+        out[:, idx] = rng.triangular(low, mode, high, size=(size, len(idx)))
+
+    return out
+
+
+def uncertainty_to_json(u):
+    """
+    Serialize an uncertainty array as a dict of parallel lists; NaN becomes None
+    """
+    j = {'uncertainty type': u['uncertainty type'].tolist(), 'negative': u['negative'].tolist()}
+    for k in PARAMETERS:
+        j[k] = [None if np.isnan(v) else v for v in u[k].tolist()]
+    return j
+
+
+def uncertainty_from_json(j):
+    """
+    Inverse of uncertainty_to_json
+    """
+    u = np.zeros(len(j['uncertainty type']), dtype=UNCERTAINTY_DTYPE)
+    u['uncertainty type'] = j['uncertainty type']
+    u['negative'] = j['negative']
+    for k in PARAMETERS:
+        u[k] = np.array(j[k], dtype=np.float64)
+    return u
@@ -0,0 +1,225 @@
+"""
+Consistency checks for disclosures.
+
+The checks run over the COO arrays of each matrix in O(nnz), plus one pass over each flow list.  Out-of-core matrices
+are read in chunks; the duplicate check then reads them twice, partitioning the entries by block of columns on disk.
+
+- coordinates inside the matrix shape (shape-mismatch, index-out-of-range)
+- finite values (non-finite-value)
+- no repeated (row, col) entries (duplicate-entry)
+- flow lists that can be read in full, giving as many flows as their length (unreadable-flows, flow-count-mismatch)
+- flow 'index' fields matching list positions (flow-index-mismatch)
+- a non-empty foreground whose column 0, the functional unit, is not itself consumed by the foreground
+  (empty-foreground, functional-unit-consumed)
+
+functional-unit-consumed is only a warning.  A product system with a recycling or co-product loop can feed part of
+its reference product back into its own supply chain; such a disclosure still aggregates correctly (the loop is
+solved by the foreground inverse), so it must not be rejected on loading.
+
+Problems are returned as ValidationIssue records rather than raised, so that callers can decide what to do with
+warnings; DisclosureValidationError is raised by the loaders when there are errors.
+"""
+import os
+import tempfile
+from collections import namedtuple
+
+import numpy as np
+
+from ..utils import coo_to_arrays
+from .flows import FLOW_SECTIONS, MATRIX_ROWS
+from .ooc import CHUNK_SIZE, ArrayMatrix, ChunkedMatrix, matrix_chunks
+
+ERROR = 'error'
+WARNING = 'warning'
+
+ValidationIssue = namedtuple('ValidationIssue', ('section', 'code', 'message', 'indices', 'severity'))
+ValidationIssue.__doc__ = """
+section is a matrix name or flow section.  indices are positions in the section's COO data or flow list (an array,
+possibly empty).
+"""
+
+
+class DisclosureValidationError(ValueError):
+    """
+    Raised when a disclosure fails validation.  The issues found are in self.issues
+    """
+    def __init__(self, issues):
+        self.issues = issues
+        errors = [i for i in issues if i.severity == ERROR]
+        super(DisclosureValidationError, self).__init__(
+            'Invalid disclosure: ' + '; '.join('{}: {}'.format(i.section, i.message) for i in errors))
+
+
+def _issue(section, code, message, indices=(), severity=ERROR):
+    return ValidationIssue(section, code, message, np.asarray(indices, dtype=np.int64), severity)
+
+
+def _duplicates(linear):
+    order = np.argsort(linear, kind='stable')
+    return order[1:][linear[order[1:]] == linear[order[:-1]]]
+
+
+def _inside(rows, cols, shape):
+    return (rows >= 0) & (rows < shape[0]) & (cols >= 0) & (cols < shape[1])
+
+
+def _chunked_duplicates(chunks, shape, chunk_size, folder=None):
+    """
+    Positions of repeated entries in a matrix read in chunks.  The columns are split into blocks of about chunk_size
+    entries.  One pass counts the entries of each column; a second pass partitions the entries by block into
+    temporary memory-mapped arrays, laid out block after block; each block is then checked on its own.  The matrix is
+    read twice whatever its size, and memory stays bounded by the chunk and block sizes.
+    :param folder: where to create the temporary arrays (default: the system temporary folder)
+    """
+    n_cols = shape[1]
+    counts = np.zeros(n_cols, dtype=np.int64)
+    for rows, cols, vals in chunks():
+        counts += np.bincount(cols[_inside(rows, cols, shape)], minlength=n_cols)
+    total = int(counts.sum())
+    if total < 2:
+        return np.empty(0, dtype=np.int64)
+
+    # block boundaries: start a new block whenever the running count passes a multiple of chunk_size
+    block = np.cumsum(counts) // max(chunk_size, 1)
+    boundaries = np.concatenate(([0], np.flatnonzero(np.diff(block)) + 1, [n_cols]))
+    block_of_column = np.repeat(np.arange(len(boundaries) - 1), np.diff(boundaries))
+    sizes = np.bincount(block_of_column, weights=counts, minlength=len(boundaries) - 1).astype(np.int64)
+    starts = np.concatenate(([0], np.cumsum(sizes)))
+
+    with tempfile.TemporaryDirectory(prefix='duplicates-', dir=folder) as scratch:
+        linear = np.memmap(os.path.join(scratch, 'linear.bin'), dtype=np.int64, mode='w+', shape=(total,))
+        positions = np.memmap(os.path.join(scratch, 'positions.bin'), dtype=np.int64, mode='w+', shape=(total,))
+
+        cursor = starts[:-1].copy()
+        offset = 0
+        for rows, cols, vals in chunks():
+            selected = np.flatnonzero(_inside(rows, cols, shape))
+            blocks = block_of_column[cols[selected]]
+            order = np.argsort(blocks, kind='stable')
+            selected, blocks = selected[order], blocks[order]
+            per_block = np.bincount(blocks, minlength=len(cursor))
+            first = np.concatenate(([0], np.cumsum(per_block)[:-1]))
+            destination = cursor[blocks] + np.arange(len(blocks)) - first[blocks]
+            linear[destination] = rows[selected] * n_cols + cols[selected]
+            positions[destination] = selected + offset
+            cursor += per_block
+            offset += len(cols)
+
+        repeated = [np.array(positions[lo:hi][_duplicates(np.array(linear[lo:hi]))])
+                    for lo, hi in zip(starts[:-1], starts[1:]) if hi - lo > 1]
+        del linear, positions
+    return np.concatenate(repeated) if repeated else np.empty(0, dtype=np.int64)
+
+
+def _check_matrix(name, data, shape, declared, chunk_size):
+    issues = []
+    if declared is not None and tuple(declared) != shape:
+        issues.append(_issue(name, 'shape-mismatch', 'declared shape {} but the flow lists give {}'.format(
+            tuple(declared), shape)))
+
+    if isinstance(data, ChunkedMatrix):
+        def chunks():
+            return data.chunks(chunk_size)
+    else:
+        try:
+            arrays = (data.rows, data.cols, data.vals) if isinstance(data, ArrayMatrix) else coo_to_arrays(data)
+        except (TypeError, ValueError, IndexError) as e:
+            return issues + [_issue(name, 'malformed',
+                                    'data is not a list of [[row, col], value] entries ({})'.format(e))]
+
+        def chunks():
+            return [arrays]
+
+    outside, bad = [], []
+    offset = 0
+    for rows, cols, vals in chunks():
+        outside.append(np.flatnonzero(~_inside(rows, cols, shape)) + offset)
+        bad.append(np.flatnonzero(~np.isfinite(vals)) + offset)
+        offset += len(vals)
+    outside = np.concatenate(outside) if outside else np.empty(0, dtype=np.int64)
+    bad = np.concatenate(bad) if bad else np.empty(0, dtype=np.int64)
+
+    if len(outside):
+        issues.append(_issue(name, 'index-out-of-range', '{} entries outside shape {}'.format(len(outside), shape),
+                             outside))
+    if len(bad):
+        issues.append(_issue(name, 'non-finite-value', '{} entries are not finite'.format(len(bad)), bad))
+
+    # duplicates are checked among the entries inside the shape
+    if offset > 1:
+        if isinstance(data, ChunkedMatrix):
+            repeated = _chunked_duplicates(chunks, shape, chunk_size, folder=os.path.dirname(data.folder))
+        else:
+            rows, cols, _ = arrays
+            inside = np.flatnonzero(_inside(rows, cols, shape))
+            repeated = inside[_duplicates(rows[inside] * shape[1] + cols[inside])]
+        if len(repeated):
+            issues.append(_issue(name, 'duplicate-entry', '{} repeated (row, col) entries'.format(len(repeated)),
+                                 np.sort(repeated)))
+    return issues
+
+
+def _check_flows(section, flows):
+    try:
+        read = list(flows)
+    except (LookupError, ValueError) as e:
+        return [_issue(section, 'unreadable-flows', 'the flows cannot be read ({})'.format(e))]
+    if len(read) != len(flows):
+        return [_issue(section, 'flow-count-mismatch', '{} flows were read from a list of length {}'.format(
+            len(read), len(flows)))]
+    indices = np.array([-1 if f.get('index') is None else f['index'] for f in read], dtype=np.int64)
+    wrong = np.flatnonzero(indices != np.arange(len(read)))
+    if len(wrong):
+        return [_issue(section, 'flow-index-mismatch', "{} flows have an 'index' that is not their position".format(
+            len(wrong)), wrong)]
+    return []
+
+
+def validate_disclosure(disclosure, shapes=None, check_flows=True, chunk_size=CHUNK_SIZE):
+    """
+    Check a disclosure 6-tuple
+    :param disclosure: (foreground flows, background flows, emission flows, Af, Ad, Bf)
+    :param shapes: optional dict of matrix name to declared shape (e.g. from a file), checked against the flow lists
+    :param check_flows: if False, the flow lists are only counted, not read (e.g. for lazily loaded flows)
+    :param chunk_size: entries read at a time from out-of-core matrices
+    :return: list of ValidationIssue
+    """
+    shapes = shapes or {}
+    flows = dict(zip(FLOW_SECTIONS, disclosure[:3]))
+    matrices = dict(zip(('Af', 'Ad', 'Bf'), disclosure[3:]))
+    p = len(flows['foreground flows'])
+
+    issues = []
+    if p == 0:
+        issues.append(_issue('foreground flows', 'empty-foreground', 'there are no foreground flows'))
+
+    for name, data in matrices.items():
+        shape = (len(flows[MATRIX_ROWS[name]]), p)
+        issues.extend(_check_matrix(name, data, shape, shapes.get(name), chunk_size))
+
+    if check_flows:
+        for section in FLOW_SECTIONS:
+            issues.extend(_check_flows(section, flows[section]))
+
+    if p and not any(i.section == 'Af' and i.severity == ERROR for i in issues):
+        consumed, offset = [], 0
+        for rows, cols, vals in matrix_chunks(matrices['Af'], chunk_size):
+            consumed.append(np.flatnonzero((rows == 0) & (cols != 0) & (vals != 0)) + offset)
+            offset += len(vals)
+        consumed = np.concatenate(consumed) if consumed else []
+        if len(consumed):
+            issues.append(_issue('Af', 'functional-unit-consumed',
+                                 'the functional unit (foreground flow 0) is an input to {} other foreground '
+                                 'flows'.format(len(consumed)), consumed, severity=WARNING))
+    return issues
+
+
+def raise_for_errors(issues):
+    """
+    Raise DisclosureValidationError if any of the issues is an error
+    :param issues: list of ValidationIssue
+    :return: issues
+    """
+    if any(i.severity == ERROR for i in issues):
+        raise DisclosureValidationError(issues)
+    return issues
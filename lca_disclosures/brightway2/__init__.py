@@ -0,0 +1,7 @@
+from ..utils import lazy_import
+
+# brightway2, bw2data and bw2io are only imported when one of these is first used
+Bw2Disclosure = lazy_import('lca_disclosures.brightway2.disclosure', 'Bw2Disclosure')
+DisclosureImporter = lazy_import('lca_disclosures.brightway2.importer', 'DisclosureImporter')
+import_disclosures = lazy_import('lca_disclosures.brightway2.batch', 'import_disclosures')
+write_disclosure = lazy_import('lca_disclosures.brightway2.writer', 'write_disclosure')
@@ -0,0 +1,256 @@
+"""
+Batch import of many disclosure files into the current brightway2 project.
+
+DisclosureImporter handles one file at a time, and every instance builds its own strategy list and matches against
+the background databases again.  import_disclosures() imports a whole batch in four stages:
+
+- parse: each file is read and validated with from_file, in parallel across an optional concurrent.futures executor
+- link: background flows and emissions are linked to existing activities through one BackgroundIndex, which reads
+  each background database once for the whole batch
+- rows: the activity and exchange table rows of each file are built in parallel
+- write: the rows of every file are inserted in one transaction, then each database is processed.  Databases that are
+  replaced (overwrite=True) lose their old rows in the same transaction, so a failed write leaves them as they were
+
+A file that fails at any stage is reported in its BatchResult, with the time spent in each stage, and does not stop
+the others.  Workers are given only module-level functions and picklable arguments, so a process pool can be used.
+"""
+import os
+import time
+from collections import namedtuple
+
+from ..base import StaticDisclosure, from_file
+from . import extraction
+from .writer import _foreground_activities, activity_rows, exchange_rows, insert_rows
+
+BatchResult = namedtuple('BatchResult', ('path', 'db_name', 'error', 'timings'))
+BatchResult.__doc__ = """
+The outcome of importing one file.  error is None on success, otherwise the exception message; timings maps each
+stage reached (parse, link, rows, write, process) to its duration in seconds.
+"""
+
+
+class BackgroundIndex(object):
+    """
+    The activities of the background and biosphere databases of the current project, read once per database and
+    shared by every disclosure of a batch.
+
+    A flow is linked by its brightway key ('brightway_id' or 'biosphere3_id') if that activity exists.  Otherwise a
+    background flow is matched by name, unit and location within the same database, as DisclosureImporter does;
+    emissions are matched by code only.
+    :param executor: optional concurrent.futures executor used to decode activity data
+    """
+    def __init__(self, executor=None):
+        self.executor = executor
+        self._codes = {}
+        self._fields = {}
+        self.stats = {'databases': 0, 'by key': 0, 'by fields': 0, 'unlinked': 0}
+
+    def _load(self, db):
+        from bw2data import databases
+        codes, fields = set(), {}
+        if db in databases:
+            for (_, code), data in extraction.iter_activities(db, executor=self.executor):
+                codes.add(code)
+                match = (data.get('name'), data.get('unit'), data.get('location'))
+                # ambiguous matches are not used
+                fields[match] = None if match in fields else code
+            self.stats['databases'] += 1
+        self._codes[db] = codes
+        self._fields[db] = fields
+
+    def link(self, flow, field):
+        """
+        The key of the activity a flow links to, or None
+        :param flow: a background flow or emission
+        :param field: 'brightway_id' or 'biosphere3_id'
+        """
+        key = flow.get(field)
+        if key is None:
+            self.stats['unlinked'] += 1
+            return None
+        db, code = key
+        if db not in self._codes:
+            self._load(db)
+        if code in self._codes[db]:
+            self.stats['by key'] += 1
+            return db, code
+        if field == 'brightway_id':
+            code = self._fields[db].get((flow.get('ecoinvent_name'), flow.get('unit'), flow.get('location')))
+            if code is not None:
+                self.stats['by fields'] += 1
+                return db, code
+        self.stats['unlinked'] += 1
+        return None
+
+    def link_all(self, flows, field, section):
+        """
+        Keys for a list of flows, raising ValueError if any cannot be linked
+        """
+        keys = [self.link(f, field) for f in flows]
+        unlinked = [i for i, k in enumerate(keys) if k is None]
+        if unlinked:
+            raise ValueError('{} {} could not be linked, e.g. positions {}'.format(len(unlinked), section,
+                                                                                  unlinked[:5]))
+        return keys
+
+
+def _parse(path, validate):
+    """
+    Read one file.  Module-level, so that it can run in a process pool.
+    :return: (StaticDisclosure, seconds)
+    """
+    start = time.perf_counter()
+    disclosure = from_file(path, validate=validate)
+    static = StaticDisclosure(disclosure.disclosure, uncertainty=disclosure.uncertainty, filename=disclosure.efn)
+    return static, time.perf_counter() - start
+
+
+def _rows(disclosure, db_name, background_keys, emission_keys):
+    """
+    Build the table rows of one linked disclosure.  Module-level, so that it can run in a process pool.
+    :return: (activity rows, exchange rows, seconds)
+    """
+    start = time.perf_counter()
+    activities = _foreground_activities(disclosure, db_name)
+    foreground_keys = [(db_name, a['code']) for a in activities]
+    if len(set(foreground_keys)) != len(foreground_keys):
+        raise ValueError('Foreground flows do not have distinct names, units and locations')
+    rows = (list(activity_rows(activities, db_name)),
+            list(exchange_rows(disclosure, foreground_keys, background_keys, emission_keys)))
+    return rows + (time.perf_counter() - start,)
+
+
+def _run_all(executor, function, arguments):
+    """
+    Call function(*args) for each tuple of arguments, in the executor if there is one
+    :return: list of (result, error message), in order
+    """
+    if executor is None:
+        calls = [lambda args=args: function(*args) for args in arguments]
+    else:
+        calls = [executor.submit(function, *args).result for args in arguments]
+    results = []
+    for call in calls:
+        try:
+            results.append((call(), None))
+        except Exception as e:
+            results.append((None, '{}: {}'.format(type(e).__name__, e)))
+    return results
+
+
+def import_disclosures(filepaths, db_names=None, executor=None, overwrite=False, validate=True, process=True):
+    """
+    Import many disclosure files, each as a new database in the current brightway2 project
+    :param filepaths: list of disclosure files
+    :param db_names: optional list of database names, parallel to filepaths; by default each file's name without
+    extension
+    :param executor: optional concurrent.futures executor for parsing files, building rows and decoding background
+    activities
+    :param overwrite: replace databases that already exist (otherwise those files fail)
+    :param validate: validate each file as it is read
+    :param process: write the processed matrix arrays of each new database
+    :return: list of BatchResult, parallel to filepaths
+    """
+    from bw2data import Database, databases
+    from bw2data.backends.peewee import sqlite3_lci_db
+
+    filepaths = list(filepaths)
+    if db_names is None:
+        db_names = [os.path.splitext(os.path.basename(path))[0] for path in filepaths]
+    if len(db_names) != len(filepaths):
+        raise ValueError('Expected {} database names, got {}'.format(len(filepaths), len(db_names)))
+
+    errors = [None] * len(filepaths)
+    timings = [{} for _ in filepaths]
+    active = list(range(len(filepaths)))
+
+    def fail(i, message):
+        errors[i] = message
+        active.remove(i)
+
+    # parse
+    parsed = {}
+    for i, (result, error) in zip(list(active), _run_all(executor, _parse, [(filepaths[i], validate)
+                                                                             for i in active])):
+        if error is not None:
+            fail(i, error)
+        else:
+            parsed[i], timings[i]['parse'] = result
+
+    # link
+    index = BackgroundIndex(executor=executor)
+    links = {}
+    seen = set()
+    for i in list(active):
+        start = time.perf_counter()
+        try:
+            if db_names[i] in seen:
+                raise ValueError('Database {} is given twice in this batch'.format(db_names[i]))
+            seen.add(db_names[i])
+            if db_names[i] in databases and not overwrite:
+                raise ValueError('Database {} already exists'.format(db_names[i]))
+            links[i] = (index.link_all(parsed[i].background_flows, 'brightway_id', 'background flows'),
+                        index.link_all(parsed[i].emission_flows, 'biosphere3_id', 'emissions'))
+        except Exception as e:
+            fail(i, '{}: {}'.format(type(e).__name__, e))
+        timings[i]['link'] = time.perf_counter() - start
+
+    # rows
+    rows = {}
+    for i, (result, error) in zip(list(active), _run_all(executor, _rows, [(parsed[i], db_names[i]) + links[i]
+                                                                            for i in active])):
+        if error is not None:
+            fail(i, error)
+        else:
+            activities, exchanges, timings[i]['rows'] = result
+            rows[i] = activities, exchanges
+
+    # write every database in one transaction, deleting the old rows of replaced databases within it
+    depends = {i: sorted({db for db, _ in links[i][0] + links[i][1]}) for i in active}
+    registered, replaced = [], []
+    for i in list(active):
+        if db_names[i] in databases:
+            replaced.append(i)
+            continue
+        try:
+            Database(db_names[i]).register(format='Disclosure', depends=depends[i])
+            registered.append(i)
+        except Exception as e:
+            if db_names[i] in databases:
+                del databases[db_names[i]]
+            fail(i, '{}: {}'.format(type(e).__name__, e))
+    try:
+        with sqlite3_lci_db.atomic():
+            connection = sqlite3_lci_db.db.connection()
+            for i in active:
+                start = time.perf_counter()
+                if i in replaced:
+                    connection.execute('DELETE FROM exchangedataset WHERE output_database = ?', (db_names[i],))
+                    connection.execute('DELETE FROM activitydataset WHERE database = ?', (db_names[i],))
+                insert_rows(connection, *rows[i])
+                timings[i]['write'] = time.perf_counter() - start
+    except Exception as e:
+        for i in registered:
+            if i in active:
+                del databases[db_names[i]]
+        for i in list(active):
+            fail(i, '{}: {}'.format(type(e).__name__, e))
+
+    for i in replaced:
+        if i in active:
+            databases[db_names[i]].update(format='Disclosure', depends=depends[i])
+    for i in active:
+        databases[db_names[i]]['number'] = len(rows[i][0])
+    databases.flush()
+
+    if process:
+        for i in list(active):
+            start = time.perf_counter()
+            try:
+                Database(db_names[i]).process()
+            except Exception as e:
+                fail(i, '{}: {}'.format(type(e).__name__, e))
+            timings[i]['process'] = time.perf_counter() - start
+
+    return [BatchResult(path, name, error, timing)
+            for path, name, error, timing in zip(filepaths, db_names, errors, timings)]
@@ -1,9 +1,18 @@
-import brightway2 as bw
+"""
+Disclosures of brightway2 foreground databases.
+
+brightway2 is imported when a disclosure is prepared, not with this module, so that importing the package stays cheap.
+"""
 import numpy as np
 
 from ..base import BaseDisclosure
-from ..utils import matrix_to_coo
+from ..base.flows import BackgroundFlow, EmissionFlow, ForegroundFlow
+from ..base.uncertainty import PARAMETERS, empty_uncertainty, scale_uncertainty, uncertainty_array
+from ..utils import arrays_to_coo
+from . import extraction
 
+# exchanges classified per executor task
+BLOCK_SIZE = 50000
 
 def reconstruct_matrix(matrix_dict, normalise=False, clear_diagonal=False):
     m = np.zeros(matrix_dict['shape'])
@@ -19,13 +28,173 @@ def reconstruct_matrix(matrix_dict, normalise=False, clear_diagonal=False):
     return m
 
 
+def normalise_foreground(coords, p):
+    """
+    Sparse equivalent of matrix_to_coo(reconstruct_matrix(..., normalise=True, clear_diagonal=True)): each column is
+    divided by minus its diagonal (production) entry and the diagonal is cleared, without building a dense p x p
+    matrix.  Entries are returned in row-major order.  As in reconstruct_matrix, later entries for the same
+    coordinates replace earlier ones, and nothing is normalised if the diagonal sums to zero.  A column with no
+    production entry gives non-finite values for its stored entries only, rather than for the whole column.
+    :param coords: list of [(row, col), value] with production amounts as negative diagonal entries
+    :param p: number of foreground flows
+    :return: list of [[row, col], value]
+    """
+    entries = {}
+    for (r, c), v in coords:
+        entries[(r, c)] = v
+    if not entries:
+        return []
+
+    keys = np.array(list(entries.keys()), dtype=np.int64)
+    rows, cols = keys[:, 0], keys[:, 1]
+    vals = np.fromiter(entries.values(), dtype=np.float64, count=len(entries))
+
+    on_diagonal = rows == cols
+    diagonal = np.zeros(p)
+    diagonal[rows[on_diagonal]] = vals[on_diagonal]
+    if diagonal.sum() != 0:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            vals = -vals / diagonal[cols]
+        vals[on_diagonal] += 1.0
+
+    order = np.lexsort((cols, rows))
+    order = order[vals[order] != 0]
+    return arrays_to_coo(rows[order], cols[order], vals[order])
+
+
+def find_functional_units(coords, p):
+    """
+    Foreground flows that are not consumed by any other foreground flow, but do consume something themselves
+    :param coords: list of [(row, col), value] for the non-production foreground exchanges
+    :param p: number of foreground flows
+    :return: list of indices
+    """
+    entries = {}
+    for (r, c), v in coords:
+        entries[(r, c)] = v
+    keys = np.array(list(entries.keys()), dtype=np.int64).reshape(-1, 2)
+    vals = np.fromiter(entries.values(), dtype=np.float64, count=len(entries))
+    row_sums = np.bincount(keys[:, 0], weights=vals, minlength=p)
+    col_sums = np.bincount(keys[:, 1], weights=vals, minlength=p)
+    return np.flatnonzero((row_sums == 0) & (col_sums != 0)).tolist()
+
+
+def _classify_block(block, fg_index):
+    """
+    Classify a block of exchanges into Af, Ad and Bf entries.  Module-level, so that it can run in a process pool.
+    Background flows and emissions are numbered locally, in order of first use within the block; see
+    Bw2Disclosure._classify for the merge.
+    :param block: list of (output key, input key, type, amount)
+    :param fg_index: dict of foreground key to column
+    :return: (Af coords, technosphere keys, Ad coords, biosphere keys, Bf coords, dict of matrix name to the positions
+    in the block of the exchanges behind its coords)
+    """
+    foreground_coords, techno_coords, bio_coords = [], [], []
+    technosphere, biosphere = [], []
+    techno_index, bio_index = {}, {}
+    positions = {'Af': [], 'Ad': [], 'Bf': []}
+
+    for n, (k, key, kind, amount) in enumerate(block):
+        col = fg_index[k]
+        row = fg_index.get(key)
+        if row is not None:
+            foreground_coords.append([(row, col), -amount if kind == 'production' else amount])
+            matrix = 'Af'
+        elif kind == 'technosphere':
+            if key not in techno_index:
+                techno_index[key] = len(technosphere)
+                technosphere.append(key)
+            techno_coords.append([(techno_index[key], col), amount])
+            matrix = 'Ad'
+        elif kind == 'biosphere':
+            if key not in bio_index:
+                bio_index[key] = len(biosphere)
+                biosphere.append(key)
+            bio_coords.append([(bio_index[key], col), amount])
+            matrix = 'Bf'
+        else:
+            continue
+        positions[matrix].append(n)
+
+    return foreground_coords, technosphere, techno_coords, biosphere, bio_coords, positions
+
+
+def _renumber(keys, coords, index, flows):
+    """
+    Give a block's locally numbered keys their global numbers, appending keys not seen in earlier blocks to flows
+    """
+    for key in keys:
+        if key not in index:
+            index[key] = len(flows)
+            flows.append(key)
+    numbers = [index[key] for key in keys]
+    return [[(numbers[r], c), v] for (r, c), v in coords]
+
+
+def _activity_dicts(project_name, keys):
+    """
+    Activity data for a list of keys, read through the ORM.  Module-level, so that it can run in a process pool.
+    """
+    import brightway2 as bw
+    bw.projects.set_current(project_name)
+    return [bw.Database(x[0]).get(x[1]).as_dict() for x in keys]
+
+
+def _blocks(items, size):
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+def _processed_uncertainty(entries):
+    """
+    Uncertainty array for entries of a processed exchange array
+    """
+    u = empty_uncertainty(len(entries))
+    u['uncertainty type'] = entries['uncertainty_type']
+    for k in PARAMETERS:
+        u[k] = entries[k]
+    u['negative'] = entries['negative']
+    return u
+
+
+def _processed_exchange(entry, production):
+    """
+    An exchange-like dict for one entry of a processed exchange array, as used by Bw2Disclosure._foreground_uncertainty
+    """
+    x = {k: float(entry[k]) for k in PARAMETERS}
+    x['uncertainty type'] = int(entry['uncertainty_type'])
+    x['negative'] = bool(entry['negative'])
+    x['type'] = 'production' if production else 'technosphere'
+    return x
+
+
 class Bw2Disclosure(BaseDisclosure):
 
-    def __init__(self, project_name, database_name, fu=None, **kwargs):
+    def __init__(self, project_name, database_name, fu=None, keep_uncertainty=False, bulk=False, executor=None,
+                 processed=False, block_size=BLOCK_SIZE, **kwargs):
+        """
+
+        :param project_name: brightway2 project
+        :param database_name: the foreground database
+        :param fu: key of the functional unit; detected from the exchanges if not given
+        :param keep_uncertainty: if True, keep the uncertainty parameters of each exchange (see self.uncertainty)
+        :param bulk: if True, read activities and exchanges with bulk queries on the SQLite backend instead of the ORM
+        :param executor: optional concurrent.futures executor.  Exchanges are classified and activity metadata is
+        looked up in blocks across it, and exchange data is decoded with it in bulk mode.  The result is the same as
+        without an executor.
+        :param processed: if True, build the disclosure from the database's processed exchange array instead of its
+        exchanges (see _prepare_from_processed).  The database must have been processed since it last changed.
+        :param block_size: exchanges (or activities, for metadata) per executor task
+        :param kwargs: passed to BaseDisclosure
+        """
 
         self.project_name = project_name
         self.database_name = database_name
         self.fu = fu
+        self.keep_uncertainty = keep_uncertainty
+        self.bulk = bulk
+        self.executor = executor
+        self.processed = processed
+        self.block_size = block_size
         super(Bw2Disclosure, self).__init__(**kwargs)
 
         # self.efn = self._prepare_efn()
@@ -40,100 +209,317 @@ class Bw2Disclosure(BaseDisclosure):
 
         return efn
 
-    def _prepare_disclosure(self):
+    def _activity_keys(self):
+        if self.bulk:
+            return extraction.activity_keys(self.database_name)
+        import brightway2 as bw
+        return [(a['database'], a['code']) for a in bw.Database(self.database_name)]
 
-        bw.projects.set_current(self.project_name)
-        db = bw.Database(self.database_name)
-        foreground = [(a['database'], a['code'])for a in db]
+    def _keys_of_ids(self, wanted):
+        """
+        Keys of the given activity ids.  Only the keys of this database and of the databases it depends on (read with
+        a bulk query) are looked up in bw.mapping; the whole mapping is searched only for ids not found there (e.g. if
+        'depends' is out of date).
+        :param wanted: set of integer ids
+        :return: dict of id to key
+        """
+        import brightway2 as bw
+        keys = {}
+        if not wanted:
+            return keys
+        for db in [self.database_name] + list(bw.databases[self.database_name].get('depends', [])):
+            for k in extraction.activity_keys(db):
+                if k in bw.mapping and bw.mapping[k] in wanted:
+                    keys[bw.mapping[k]] = k
+        missing = wanted.difference(keys)
+        if missing:
+            keys.update((i, k) for k, i in bw.mapping.items() if i in missing)
+        return keys
 
-        # set fu to be the first item in the foreground matrix
-        if self.fu is not None and self.fu in foreground:
-            fu_list = [self.fu]
-            foreground = fu_list + [x for x in foreground if x not in fu_list]
-            
+    def _exchanges(self):
+        """
+        Generator.  Yields (output key, exchange) for every exchange of the foreground database
+        """
+        if self.bulk:
+            for k, x in extraction.iter_exchanges(self.database_name, executor=self.executor):
+                x['input'] = tuple(x['input'])
+                yield k, x
         else:
-            temp_foreground = []
-            for a in db:
+            import brightway2 as bw
+            for a in bw.Database(self.database_name):
                 k = (a['database'], a['code'])
                 for x in a.exchanges():
-                    if x['input'] in foreground and x['type'] != 'production':
-                        temp_foreground.append([(foreground.index(x['input']), foreground.index(k)), x['amount']])
-            
-            temp_matrix = reconstruct_matrix({'data': temp_foreground, 'shape': (len(foreground), len(foreground))})
-            
-            fu_list = [foreground[i] for i, x in enumerate(foreground)
-                       if list(temp_matrix.sum(axis=1))[i] == 0 and list(temp_matrix.sum(axis=0))[i] != 0]
-            foreground = fu_list + [x for x in foreground if x not in fu_list]
-        
-        foreground_coords = []
-        technosphere = []
-        biosphere = []
-        techno_coords = []
-        bio_coords = []
-
-        for a in db:
-            k = (a['database'], a['code'])
-            for x in a.exchanges():
-                if x['input'] in foreground and x['type'] != 'production':
-                    foreground_coords.append([(foreground.index(x['input']), foreground.index(k)), x['amount']])
-                elif x['input'] in foreground and x['type'] == 'production':
-                    foreground_coords.append([(foreground.index(x['input']), foreground.index(k)), -x['amount']])
-                elif x['type'] == 'technosphere':
-                    if x['input'] not in technosphere:
-                        technosphere.append(x['input'])
-                    techno_coords.append([(technosphere.index(x['input']), foreground.index(k)), x['amount']])
-                elif x['type'] == 'biosphere':
-                    if x['input'] not in biosphere:
-                        biosphere.append(x['input'])
-                    bio_coords.append([(biosphere.index(x['input']), foreground.index(k)), x['amount']])
-                    
-        technosphere_info = [bw.Database(x[0]).get(x[1]) for x in technosphere]
-        biosphere_info = [bw.Database(x[0]).get(x[1]) for x in biosphere]
-        foreground_info = [bw.Database(x[0]).get(x[1]) for x in foreground]
-        
+                    yield k, x
+
+    def _activity_info(self, keys):
+        if self.bulk:
+            info = extraction.get_activities(keys, executor=self.executor)
+            return [info[k] for k in keys]
+        if self.executor is not None and len(keys) > self.block_size:
+            blocks = _blocks(keys, self.block_size)
+            return [a for b in self.executor.map(_activity_dicts, [self.project_name] * len(blocks), blocks) for a in b]
+        import brightway2 as bw
+        return [bw.Database(x[0]).get(x[1]) for x in keys]
+
+    def _classify(self, exchanges, fg_index):
+        """
+        Classify the exchanges into Af, Ad and Bf entries.  With an executor, the exchanges are split into blocks of
+        block_size that are classified in parallel (_classify_block); the blocks are then merged in order, numbering
+        each block's new background flows and emissions after those of earlier blocks, so that the flow lists and
+        entries are exactly those of a serial pass.
+        :param exchanges: list of (output key, exchange)
+        :param fg_index: dict of foreground key to column
+        :return: (Af coords, technosphere keys, Ad coords, biosphere keys, Bf coords, dict of matrix name to the
+        exchanges behind its coords, filled only if keep_uncertainty)
+        """
+        rows = [(k, x['input'], x['type'], x['amount']) for k, x in exchanges]
+        if self.executor is None or len(rows) <= self.block_size:
+            blocks = [rows]
+            results = [_classify_block(rows, fg_index)]
+        else:
+            blocks = _blocks(rows, self.block_size)
+            results = self.executor.map(_classify_block, blocks, [fg_index] * len(blocks))
+        self._count('classify blocks', len(blocks))
+
+        foreground_coords, techno_coords, bio_coords = [], [], []
+        technosphere, biosphere = [], []
+        techno_index, bio_index = {}, {}
+        kept = {'Af': [], 'Ad': [], 'Bf': []}
+        offset = 0
+        for block, (af, t_keys, ad, b_keys, bf, positions) in zip(blocks, results):
+            foreground_coords.extend(af)
+            techno_coords.extend(_renumber(t_keys, ad, techno_index, technosphere))
+            bio_coords.extend(_renumber(b_keys, bf, bio_index, biosphere))
+            if self.keep_uncertainty:
+                for name, matrix_positions in positions.items():
+                    kept[name].extend(exchanges[offset + n][1] for n in matrix_positions)
+            offset += len(block)
+        return foreground_coords, technosphere, techno_coords, biosphere, bio_coords, kept
+
+    def _prepare_disclosure(self):
+        import brightway2 as bw
+
+        bw.projects.set_current(self.project_name)
+        if self.processed:
+            return self._prepare_from_processed()
+
+        with self._stage('activities'):
+            foreground = self._activity_keys()
+        self._count('activities', len(foreground))
+
+        with self._stage('exchanges'):
+            exchanges = list(self._exchanges())
+        self._count('exchanges', len(exchanges))
+
+        # set fu to be the first item in the foreground matrix
+        with self._stage('fu_detection'):
+            if self.fu is not None and self.fu in foreground:
+                fu_list = [self.fu]
+
+            else:
+                fg_index = {k: i for i, k in enumerate(foreground)}
+                temp_foreground = [[(fg_index[x['input']], fg_index[k]), x['amount']] for k, x in exchanges
+                                   if x['input'] in fg_index and x['type'] != 'production']
+                fu_list = [foreground[i] for i in find_functional_units(temp_foreground, len(foreground))]
+
+            fu_set = set(fu_list)
+            foreground = fu_list + [x for x in foreground if x not in fu_set]
+
+        fg_index = {k: i for i, k in enumerate(foreground)}
+
+        with self._stage('classify'):
+            foreground_coords, technosphere, techno_coords, biosphere, bio_coords, kept = \
+                self._classify(exchanges, fg_index)
+
+        foreground_names, technosphere_names, biosphere_names = self._flow_records(foreground, technosphere,
+                                                                                   biosphere)
+
+        with self._stage('normalise'):
+            processed_coords = normalise_foreground(foreground_coords, len(foreground))
+
+        if self.keep_uncertainty:
+            with self._stage('uncertainty'):
+                self._uncertainty = {
+                    'Af': self._foreground_uncertainty(foreground_coords, kept['Af'], processed_coords),
+                    'Ad': uncertainty_array(kept['Ad']),
+                    'Bf': uncertainty_array(kept['Bf']),
+                }
+
+        foreground_coords = processed_coords
+        # foreground_matrix = {'data':foreground_coords, 'shape':(len(foreground), len(foreground))}
+
+        return foreground_names, technosphere_names, biosphere_names, foreground_coords, techno_coords, bio_coords
+
+    def _prepare_from_processed(self):
+        """
+        Build the disclosure from the processed exchange array that brightway stores for the database: a structured
+        array with the integer ids of each exchange's input and output, its type code and its amount.  The exchanges
+        are partitioned into Af, Ad and Bf with numpy, and keys and metadata are looked up only for the final flow
+        lists.
+
+        Flows are classified as in _prepare_disclosure.  Background flows and emissions are numbered in order of first
+        use, taking the columns in foreground order.  Processed amounts are stored as float32, so coefficients agree
+        with the exchange-based path to single precision only.
+        """
+        import brightway2 as bw
+        from bw2data.utils import TYPE_DICTIONARY
+
+        with self._stage('activities'):
+            foreground = self._activity_keys()
+            ids = np.array([bw.mapping[k] for k in foreground], dtype=np.int64)
+        self._count('activities', len(foreground))
+        p = len(foreground)
+        if not p:
+            raise ValueError('Database {} has no activities to disclose'.format(self.database_name))
+
+        with self._stage('exchanges'):
+            array = np.load(bw.Database(self.database_name).filepath_processed())
+        self._count('exchanges', len(array))
+
+        inputs = array['input'].astype(np.int64)
+        amounts = array['amount'].astype(np.float64)
+        kind = array['type']
+
+        with self._stage('positions'):
+            # a database whose activities have no exchanges has an empty processed array
+            size = max(int(a.max()) + 1 for a in (ids, inputs, array['output']) if len(a))
+            position = np.full(size, -1, dtype=np.int64)
+            position[ids] = np.arange(p)
+            cols = position[array['output']]
+            rows = position[inputs]
+            production = kind == TYPE_DICTIONARY['production']
+            in_foreground = rows >= 0
+
+        with self._stage('fu_detection'):
+            if self.fu is not None and self.fu in foreground:
+                fu_list = [foreground.index(self.fu)]
+            else:
+                internal = in_foreground & ~production
+                fu_list = find_functional_units(
+                    list(zip(zip(rows[internal].tolist(), cols[internal].tolist()), amounts[internal].tolist())), p)
+            rest = np.setdiff1d(np.arange(p), fu_list)
+            order = np.concatenate((np.array(fu_list, dtype=np.int64), rest))
+            rank = np.empty(p, dtype=np.int64)
+            rank[order] = np.arange(p)
+            foreground = [foreground[i] for i in order.tolist()]
+
+        with self._stage('classify'):
+            # entries in column order, keeping the stored order within each column
+            by_column = np.argsort(rank[cols], kind='stable')
+            cols = rank[cols][by_column]
+            rows = np.where(in_foreground, rank[np.maximum(rows, 0)], -1)[by_column]
+            inputs, amounts, kind, production = inputs[by_column], amounts[by_column], kind[by_column], \
+                production[by_column]
+            array = array[by_column]
+
+            af = rows >= 0
+            ad = ~af & (kind == TYPE_DICTIONARY['technosphere'])
+            bf = ~af & (kind == TYPE_DICTIONARY['biosphere'])
+
+            foreground_coords = list(zip(zip(rows[af].tolist(), cols[af].tolist()),
+                                         np.where(production[af], -amounts[af], amounts[af]).tolist()))
+            blocks = {}
+            for name, mask in (('Ad', ad), ('Bf', bf)):
+                unique, first, inverse = np.unique(inputs[mask], return_index=True, return_inverse=True)
+                numbering = np.empty(len(unique), dtype=np.int64)
+                numbering[np.argsort(first, kind='stable')] = np.arange(len(unique))
+                blocks[name] = unique[np.argsort(first, kind='stable')], numbering[inverse], cols[mask], amounts[mask]
+
+        with self._stage('keys'):
+            keys = self._keys_of_ids(set(blocks['Ad'][0].tolist()) | set(blocks['Bf'][0].tolist()))
+            technosphere = [keys[i] for i in blocks['Ad'][0].tolist()]
+            biosphere = [keys[i] for i in blocks['Bf'][0].tolist()]
+
+        foreground_names, technosphere_names, biosphere_names = self._flow_records(foreground, technosphere,
+                                                                                   biosphere)
+
+        with self._stage('normalise'):
+            processed_coords = normalise_foreground(foreground_coords, p)
+
+        if self.keep_uncertainty:
+            with self._stage('uncertainty'):
+                af_exchanges = [_processed_exchange(x, is_production)
+                                for x, is_production in zip(array[af], production[af].tolist())]
+                self._uncertainty = {
+                    'Af': self._foreground_uncertainty(foreground_coords, af_exchanges, processed_coords),
+                    'Ad': _processed_uncertainty(array[ad]),
+                    'Bf': _processed_uncertainty(array[bf]),
+                }
+
+        techno_coords = arrays_to_coo(*blocks['Ad'][1:])
+        bio_coords = arrays_to_coo(*blocks['Bf'][1:])
+        return foreground_names, technosphere_names, biosphere_names, processed_coords, techno_coords, bio_coords
+
+    def _flow_records(self, foreground, technosphere, biosphere):
+        """
+        Look up the metadata of the final index lists and build the flow records
+        :return: foreground, background and emission flow lists
+        """
+        with self._stage('metadata'):
+            technosphere_info = self._activity_info(technosphere)
+            biosphere_info = self._activity_info(biosphere)
+            foreground_info = self._activity_info(foreground)
+        self._count('metadata lookups', len(technosphere) + len(biosphere) + len(foreground))
+
         technosphere_names = [
-                                {
-                                    'index': i,
-                                    'ecoinvent_name': technosphere_info[i].get('name', 'n/a'),
-                                    'ecoinvent_id': technosphere_info[i].get('activity', 'n/a'),
-                                    'brightway_id': technosphere[i],
-                                    'unit': technosphere_info[i].get('unit', 'n/a'),
-                                    'location': technosphere_info[i].get('location', 'n/a')
-                                }
+                                BackgroundFlow(
+                                    index=i,
+                                    ecoinvent_name=technosphere_info[i].get('name', 'n/a'),
+                                    ecoinvent_id=technosphere_info[i].get('activity', 'n/a'),
+                                    brightway_id=technosphere[i],
+                                    unit=technosphere_info[i].get('unit', 'n/a'),
+                                    location=technosphere_info[i].get('location', 'n/a')
+                                )
                                 for i, x in enumerate(technosphere)
         ]
 
         biosphere_names = [
-                            {
-                                'index': i,
-                                'name': "{}, {}, {}".format(biosphere_info[i]['name'], biosphere_info[i]['type'],
-                                                            ",".join(biosphere_info[i]['categories'])),
-                                'biosphere3_id': biosphere[i],
-                                'unit': biosphere_info[i]['unit']
-                            }
+                            EmissionFlow(
+                                index=i,
+                                name="{}, {}, {}".format(biosphere_info[i]['name'], biosphere_info[i]['type'],
+                                                         ",".join(biosphere_info[i]['categories'])),
+                                biosphere3_id=biosphere[i],
+                                unit=biosphere_info[i]['unit'],
+                                context=biosphere_info[i].get('categories')
+                            )
                             for i, x in enumerate(biosphere)
         ]
 
         foreground_names = [
-                            {
-                                'index': i,
-                                'name': foreground_info[i]['name'],
-                                'unit': foreground_info[i]['unit'],
-                                'location': foreground_info[i]['location']
-                            }
+                            ForegroundFlow(
+                                index=i,
+                                name=foreground_info[i]['name'],
+                                unit=foreground_info[i]['unit'],
+                                location=foreground_info[i]['location']
+                            )
                             for i, x in enumerate(foreground)
         ]
-        
-        # techno_matrix = {'data':techno_coords, 'shape':(len(technosphere),len(foreground))}
-        # bio_matrix = {'data':bio_coords, 'shape':(len(biosphere),len(foreground))}
-        
-        unprocessed_foreground_matrix = {'data': foreground_coords, 'shape': (len(foreground), len(foreground))}
-        processed_matrix = reconstruct_matrix(unprocessed_foreground_matrix, normalise=True,  clear_diagonal=True)
-        
-        foreground_coords = matrix_to_coo(processed_matrix)
-        # foreground_matrix = {'data':foreground_coords, 'shape':(len(foreground), len(foreground))}
 
-        return foreground_names, technosphere_names, biosphere_names, foreground_coords, techno_coords, bio_coords
+        return foreground_names, technosphere_names, biosphere_names
+
+    @staticmethod
+    def _foreground_uncertainty(raw_coords, raw_exchanges, processed_coords):
+        """
+        Uncertainty of the processed Af entries.  Each column of the raw foreground matrix is divided by its
+        production amount, so the uncertainty of each input exchange is scaled by the same factor.
+        :param raw_coords: foreground coords before normalisation, with production as negative diagonal entries
+        :param raw_exchanges: the exchanges, parallel to raw_coords
+        :param processed_coords: the normalised Af entries
+        :return: uncertainty array aligned with processed_coords
+        """
+        production = {}
+        inputs = {}
+        for ((r, c), v), x in zip(raw_coords, raw_exchanges):
+            if x['type'] == 'production' and r == c:
+                production[c] = v
+            else:
+                inputs[(r, c)] = x
+
+        normalised = sum(production.values()) != 0
+        factors = [-1.0 / production[c] if normalised and production.get(c) else 1.0
+                   for (r, c), v in processed_coords]
+        u = uncertainty_array(inputs.get((r, c), {}) for (r, c), v in processed_coords)
+        return scale_uncertainty(u, factors)
 
 
 """
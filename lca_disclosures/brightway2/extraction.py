@@ -0,0 +1,126 @@
+"""
+Bulk extraction of activities and exchanges from the brightway2 SQLite backend.
+
+Iterating over a Database and calling a.exchanges() issues one query per activity through the ORM.  The functions
+here read the exchange table for a whole database with a single query, fetched in chunks, and decode the pickled
+exchange payloads in an optional concurrent.futures executor while the next chunk is being fetched.  Activity
+metadata is likewise fetched in chunked IN (...) queries rather than one query per key.
+
+These functions read the tables of bw2data's peewee SQLite backend (ActivityDataset, ExchangeDataset) directly.
+bw2data is imported when they are first called, not with this module.
+"""
+import pickle
+
+# rows fetched and decoded together
+CHUNK_SIZE = 10000
+
+# SQLite limits the number of bound parameters in a query
+MAX_VARIABLES = 900
+
+
+def _decode(rows):
+    """
+    Unpickle a chunk of rows.  Module-level, so that it can be dispatched to a process pool.
+    :param rows: list of (database, code, pickled data) tuples
+    :return: list of ((database, code), data dict)
+    """
+    return [((db, code), pickle.loads(bytes(data))) for db, code, data in rows]
+
+
+def _fetch_chunks(cursor, chunk_size):
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield rows
+
+
+def _decoded(chunks, decode, executor):
+    """
+    Decode chunks, keeping one chunk in flight in the executor while the next is fetched
+    """
+    if executor is None:
+        for rows in chunks:
+            for item in decode(rows):
+                yield item
+        return
+
+    pending = None
+    for rows in chunks:
+        future = executor.submit(decode, rows)
+        if pending is not None:
+            for item in pending.result():
+                yield item
+        pending = future
+    if pending is not None:
+        for item in pending.result():
+            yield item
+
+
+def iter_exchanges(database_name, chunk_size=CHUNK_SIZE, executor=None):
+    """
+    Generator.  Yields (output key, exchange dict) for every exchange whose output is in the named database.  Exchanges
+    are yielded grouped by output activity, in the order the activities are stored.
+    :param database_name: name of the brightway2 database
+    :param chunk_size: number of rows fetched and decoded at a time
+    :param executor: optional concurrent.futures executor used to decode the pickled payloads
+    :return:
+    """
+    from bw2data.backends.peewee import sqlite3_lci_db
+    cursor = sqlite3_lci_db.execute_sql(
+        'SELECT e.output_database, e.output_code, e.data FROM exchangedataset AS e '
+        'JOIN activitydataset AS a ON a.database = e.output_database AND a.code = e.output_code '
+        'WHERE e.output_database = ? ORDER BY a.id, e.id',
+        (database_name,)
+    )
+    return _decoded(_fetch_chunks(cursor, chunk_size), _decode, executor)
+
+
+def iter_activities(database_name, chunk_size=CHUNK_SIZE, executor=None):
+    """
+    Generator.  Yields (key, activity data dict) for every activity of the named database, in the order they are stored
+    :param database_name: name of the brightway2 database
+    :param chunk_size: number of rows fetched and decoded at a time
+    :param executor: optional concurrent.futures executor used to decode the pickled payloads
+    """
+    from bw2data.backends.peewee import sqlite3_lci_db
+    cursor = sqlite3_lci_db.execute_sql('SELECT database, code, data FROM activitydataset WHERE database = ? ORDER BY id',
+                                        (database_name,))
+    return _decoded(_fetch_chunks(cursor, chunk_size), _decode, executor)
+
+
+def activity_keys(database_name):
+    """
+    Keys of the activities in the named database, in the order they are stored
+    """
+    from bw2data.backends.peewee import sqlite3_lci_db
+    cursor = sqlite3_lci_db.execute_sql('SELECT database, code FROM activitydataset WHERE database = ? ORDER BY id',
+                                        (database_name,))
+    return [tuple(row) for row in cursor.fetchall()]
+
+
+def get_activities(keys, chunk_size=MAX_VARIABLES, executor=None):
+    """
+    Fetch activity data for many keys at once
+    :param keys: iterable of (database, code) keys
+    :param chunk_size: number of codes per query
+    :param executor: optional concurrent.futures executor used to decode the pickled payloads
+    :return: dict of key to activity data dict
+    """
+    from bw2data.backends.peewee import sqlite3_lci_db
+    by_database = {}
+    for db, code in keys:
+        by_database.setdefault(db, []).append(code)
+
+    def chunks():
+        for db, codes in by_database.items():
+            for start in range(0, len(codes), chunk_size):
+                batch = codes[start:start + chunk_size]
+                cursor = sqlite3_lci_db.execute_sql(
+                    'SELECT database, code, data FROM activitydataset WHERE database = ? AND code IN ({})'.format(
+                        ', '.join('?' * len(batch))),
+                    [db] + batch
+                )
+                yield cursor.fetchall()
+
+    return dict(_decoded(chunks(), _decode, executor))
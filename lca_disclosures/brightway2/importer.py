@@ -17,6 +17,8 @@ from bw2io.strategies import (
     link_technosphere_by_activity_hash,
 )
 
+from ..base.validation import raise_for_errors, validate_disclosure
+
 class DisclosureExtractor(object):
     """Extractor used by the DisclosureImporter
     """
@@ -80,8 +82,9 @@ class DisclosureImporter(LCIImporter):
     """
     format = "Disclosure"
     extractor = DisclosureExtractor
+    validation_issues = ()
     
-    def __init__(self, filepath, db_name=None):
+    def __init__(self, filepath, db_name=None, validate=True):
                       
         self.strategies = [
             normalize_units,
@@ -98,7 +101,9 @@ class DisclosureImporter(LCIImporter):
         ]
         start = time()
         data = self.extractor.extract(filepath)
-        
+        if validate:
+            self.validation_issues = self.validate(data)
+
         if db_name is None:
             self.db_name = "Disclosure_database"
         else:
@@ -110,6 +115,18 @@ class DisclosureImporter(LCIImporter):
         self.data = self.process_disclosure(data)
         self.required_databases = self.get_required_databases(data)
         
+    @staticmethod
+    def validate(data):
+        """
+        Check the disclosure data before it is processed, raising DisclosureValidationError if it is inconsistent
+        :param data: the disclosure as extracted from the file
+        :return: list of ValidationIssue (warnings only)
+        """
+        disclosure = (data['foreground flows'], data['background flows'], data['foreground emissions'],
+                      data['Af']['data'], data['Ad']['data'], data['Bf']['data'])
+        shapes = {name: data[name].get('shape') for name in ('Af', 'Ad', 'Bf')}
+        return raise_for_errors(validate_disclosure(disclosure, shapes=shapes))
+
     def process_disclosure(self, data):
 
         new_data = []
@@ -169,7 +186,7 @@ class DisclosureImporter(LCIImporter):
         if kwargs.get('type') == 'biosphere':
             new_exchange = {
                 'amount': kwargs.get('amount'),
-                'categories': kwargs.get('categories'),
+                'categories': kwargs.get('categories') or (tuple(kwargs['context']) if kwargs.get('context') else None),
                 'database': kwargs.get('database'),
                 'name': kwargs.get('name'),
                 'type': kwargs.get('type'),
@@ -0,0 +1,186 @@
+"""
+Fast writing of linked disclosures to a brightway2 database.
+
+DisclosureImporter builds nested activity and exchange dicts, then links them with bw2io strategies.  A disclosure
+whose background flows and emissions already carry brightway keys ('brightway_id', 'biosphere3_id') needs no linking,
+so write_disclosure() builds the table rows directly from the COO arrays and inserts them with executemany in one
+transaction, then processes the database to write its matrix arrays.
+
+Foreground activity codes are the activity hash of name, unit and location - the codes DisclosureImporter assigns -
+so both paths give the same keys.
+
+bw2data and bw2io are imported when write_disclosure() is first called, not with this module.
+"""
+import pickle
+
+import numpy as np
+
+from ..base.uncertainty import PARAMETERS, UNDEFINED
+from .extraction import MAX_VARIABLES
+
+PICKLE_PROTOCOL = 4
+
+
+def _foreground_activities(disclosure, db_name):
+    from bw2io.utils import activity_hash
+    activities = []
+    for flow in disclosure.foreground_flows:
+        activities.append({
+            'name': flow['name'],
+            'unit': flow['unit'],
+            'location': flow['location'],
+            'reference product': flow['name'],
+            'production amount': 1,
+            'comment': '',
+            'type': 'process',
+            'database': db_name,
+            'code': activity_hash({'name': flow['name'], 'unit': flow['unit'], 'location': flow['location']}),
+        })
+    return activities
+
+
+def _linked_keys(flows, field, section):
+    keys = []
+    for f in flows:
+        key = f.get(field)
+        if key is None:
+            raise ValueError('{} {!r} has no {}; use DisclosureImporter to link it'.format(section, f.get('index'),
+                                                                                          field))
+        keys.append(tuple(key))
+    return keys
+
+
+def _missing_keys(keys):
+    """
+    The keys that do not exist in the activity table, checked with chunked IN (...) queries
+    """
+    from bw2data.backends.peewee import sqlite3_lci_db
+    by_database = {}
+    for db, code in set(keys):
+        by_database.setdefault(db, []).append(code)
+    missing = []
+    for db, codes in by_database.items():
+        found = set()
+        for start in range(0, len(codes), MAX_VARIABLES):
+            batch = codes[start:start + MAX_VARIABLES]
+            cursor = sqlite3_lci_db.execute_sql(
+                'SELECT code FROM activitydataset WHERE database = ? AND code IN ({})'.format(
+                    ', '.join('?' * len(batch))),
+                [db] + batch
+            )
+            found.update(row[0] for row in cursor.fetchall())
+        missing.extend((db, code) for code in codes if code not in found)
+    return missing
+
+
+def _uncertainty_fields(u, i):
+    if u is None or u['uncertainty type'][i] == UNDEFINED:
+        return {}
+    fields = {'uncertainty type': int(u['uncertainty type'][i])}
+    for k in PARAMETERS:
+        if not np.isnan(u[k][i]):
+            fields[k] = float(u[k][i])
+    if u['negative'][i]:
+        fields['negative'] = True
+    return fields
+
+
+def exchange_rows(disclosure, foreground_keys, background_keys, emission_keys):
+    """
+    Generator.  Yields exchangedataset rows (data, input_code, input_database, output_code, output_database, type),
+    grouped by matrix: production exchanges, then Af, Ad and Bf entries.
+    """
+    uncertainty = disclosure.uncertainty or {}
+
+    for db, code in foreground_keys:
+        data = {'input': (db, code), 'output': (db, code), 'amount': 1.0, 'type': 'production'}
+        yield pickle.dumps(data, protocol=PICKLE_PROTOCOL), code, db, code, db, 'production'
+
+    for name, inputs, kind in (('Af', foreground_keys, 'technosphere'), ('Ad', background_keys, 'technosphere'),
+                               ('Bf', emission_keys, 'biosphere')):
+        rows, cols, vals = disclosure.matrix_arrays(name)
+        u = uncertainty.get(name)
+        for i, (r, c, v) in enumerate(zip(rows.tolist(), cols.tolist(), vals.tolist())):
+            input_key, output_key = inputs[r], foreground_keys[c]
+            data = {'input': input_key, 'output': output_key, 'amount': v, 'type': kind}
+            data.update(_uncertainty_fields(u, i))
+            yield (pickle.dumps(data, protocol=PICKLE_PROTOCOL), input_key[1], input_key[0], output_key[1],
+                   output_key[0], kind)
+
+
+def activity_rows(activities, db_name):
+    """
+    Generator.  Yields activitydataset rows (data, code, database, location, name, product, type)
+    """
+    for a in activities:
+        yield (pickle.dumps(a, protocol=PICKLE_PROTOCOL), a['code'], db_name, a['location'], a['name'],
+               a['reference product'], a['type'])
+
+
+def insert_rows(connection, activities, exchanges):
+    """
+    Insert activitydataset and exchangedataset rows with executemany.  The caller manages the transaction.
+    :param connection: the SQLite connection of sqlite3_lci_db
+    :param activities: iterable of rows, as from activity_rows()
+    :param exchanges: iterable of rows, as from exchange_rows()
+    """
+    connection.executemany(
+        'INSERT INTO activitydataset (data, code, database, location, name, product, type) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+        activities
+    )
+    connection.executemany(
+        'INSERT INTO exchangedataset (data, input_code, input_database, output_code, output_database, type) '
+        'VALUES (?, ?, ?, ?, ?, ?)',
+        exchanges
+    )
+
+
+def write_disclosure(disclosure, db_name, overwrite=False, check_links=True, process=True):
+    """
+    Write a linked disclosure to the current brightway2 project as a new database
+    :param disclosure: a BaseDisclosure whose background flows have 'brightway_id' and whose emissions have
+    'biosphere3_id'
+    :param db_name: name of the database to create
+    :param overwrite: replace the database if it exists (otherwise a ValueError is raised)
+    :param check_links: check that every linked background and biosphere activity exists
+    :param process: write the processed matrix arrays
+    :return: the new Database
+    """
+    from bw2data import Database, databases
+    from bw2data.backends.peewee import sqlite3_lci_db
+
+    background_keys = _linked_keys(disclosure.background_flows, 'brightway_id', 'Background flow')
+    emission_keys = _linked_keys(disclosure.emission_flows, 'biosphere3_id', 'Emission')
+
+    required = sorted({db for db, _ in background_keys + emission_keys})
+    unknown = [db for db in required if db not in databases]
+    if unknown:
+        raise ValueError('The disclosure links to databases not in this project: {}'.format(', '.join(unknown)))
+    if check_links:
+        missing = _missing_keys(background_keys + emission_keys)
+        if missing:
+            raise ValueError('{} linked activities do not exist, e.g. {}'.format(len(missing), missing[:5]))
+
+    if db_name in databases:
+        if not overwrite:
+            raise ValueError('Database {} already exists'.format(db_name))
+        Database(db_name).delete(warn=False)
+
+    activities = _foreground_activities(disclosure, db_name)
+    foreground_keys = [(db_name, a['code']) for a in activities]
+    if len(set(foreground_keys)) != len(foreground_keys):
+        raise ValueError('Foreground flows do not have distinct names, units and locations')
+
+    db = Database(db_name)
+    db.register(format='Disclosure', depends=required)
+
+    with sqlite3_lci_db.atomic():
+        insert_rows(sqlite3_lci_db.db.connection(), activity_rows(activities, db_name),
+                    exchange_rows(disclosure, foreground_keys, background_keys, emission_keys))
+
+    databases[db_name]['number'] = len(activities)
+    databases.flush()
+    if process:
+        db.process()
+    return db
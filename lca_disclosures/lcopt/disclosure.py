@@ -1,8 +1,13 @@
 from ..base import BaseDisclosure
+from ..base.flows import BackgroundFlow, EmissionFlow, ForegroundFlow
 from ..utils import matrix_to_coo
+from .links import LINK_CACHE, resolve_links
 
 import numpy as np
 
+# foreground columns extracted per executor task
+BLOCK_SIZE = 256
+
 
 def specify_matrix(model, ps_id):
     
@@ -23,12 +28,40 @@ def specify_matrix(model, ps_id):
     return matrix
 
 
+def _column_block(matrix, foreground, technosphere, biosphere, columns):
+    """
+    The Af, Ad and Bf columns of a block of foreground flows, as dense arrays.  Module-level, so that it can run in a
+    process pool.
+    :param matrix: the specified lcopt matrix
+    :param foreground: matrix indices of the foreground flows (the rows of Af)
+    :param technosphere: matrix indices of the technosphere flows (the rows of Ad)
+    :param biosphere: matrix indices of the biosphere flows (the rows of Bf)
+    :param columns: matrix indices of the foreground flows in the block
+    :return: (Af block, Ad block, Bf block)
+    """
+    return tuple(matrix[np.ix_(rows, columns)] for rows in (foreground, technosphere, biosphere))
+
+
 class LcoptDisclosure(BaseDisclosure):
 
-    def __init__(self, model, parameter_set=None, **kwargs):
+    def __init__(self, model, parameter_set=None, executor=None, block_size=BLOCK_SIZE, link_cache=LINK_CACHE,
+                 **kwargs):
+        """
+        :param model: an LcoptModel
+        :param parameter_set: name or position of the parameter set to evaluate; the unspecified matrix if None
+        :param executor: optional concurrent.futures executor.  The matrix columns are extracted and the flow metadata
+        is looked up in blocks across it; the result is the same as without an executor.
+        :param block_size: foreground columns (or flows, for metadata) per executor task
+        :param link_cache: LinkCache of resolved external links, shared by default across the process (see links.py);
+        None to resolve every link from the model
+        :param kwargs: passed to BaseDisclosure
+        """
 
         self.model = model
         self.parameter_set = parameter_set
+        self.executor = executor
+        self.block_size = block_size
+        self.link_cache = link_cache
 
         super(LcoptDisclosure, self).__init__(**kwargs)
 
@@ -44,108 +77,104 @@ class LcoptDisclosure(BaseDisclosure):
 
         return efn
 
-    def _prepare_disclosure(self):
-        
-        if self.parameter_set is None:
-            matrix = self.model.matrix.copy()
+    def _items(self, names):
+        """
+        The lcopt item of each name, looked up once per name (across the executor, if any)
+        :return: dict of name to item
+        """
+        names = list(set(names))
+        if self.executor is None or len(names) <= self.block_size:
+            codes = [self.model.get_exchange(x) for x in names]
         else:
-            matrix = specify_matrix(self.model, self.parameter_set)
-
-        background = [(i, x) for i, x in enumerate(self.model.names) if list(matrix.sum(axis=0))[i] == 0]
-        foreground = [(i, x) for i, x in enumerate(self.model.names) if list(matrix.sum(axis=0))[i] != 0]
-        fu = [(i, x) for i, x in enumerate(self.model.names)
-              if list(matrix.sum(axis=1))[i] == 0 and list(matrix.sum(axis=0))[i] != 0]
-        unused = [(i, x) for i, x in enumerate(self.model.names)
-                  if list(matrix.sum(axis=1))[i] == 0 and list(matrix.sum(axis=0))[i] == 0]
-        
-        background = sorted(list(set(background) - set(unused)))  # get rid of unused items
-        foreground = sorted(list(set(foreground) - set(unused)))  # get rid of unused items
-        foreground = fu + [x for x in foreground if x not in fu]  # set fu to be the first item in the foreground matrix
-        
-        # split background into technosphere and biosphere portions
-        technosphere = [x for x in background
-                        if self.model.database['items'][self.model.get_exchange(x[1])]['lcopt_type'] == "input"]
-        biosphere = [x for x in background
-                     if self.model.database['items'][self.model.get_exchange(x[1])]['lcopt_type'] == "biosphere"]
-        
-        # Create Af
-        p = len(foreground)
-        Af_shape = (p, p)
-        Af = np.zeros(Af_shape)
-
-        for i, c in enumerate(foreground):
-            c_lookup = c[0]
-            for j, r in enumerate(foreground):
-                r_lookup = r[0]
-                Af[i, j] = matrix[c_lookup, r_lookup]
-                
-        # Create Ad
-        Ad_shape = (len(technosphere), p)
-        Ad = np.zeros(Ad_shape)
-        
-        for i, c in enumerate(foreground):
-            c_lookup = c[0]
-            for j, r in enumerate(technosphere):
-                r_lookup = r[0]
-                Ad[j, i] = matrix[r_lookup,c_lookup ]
-                
-        # Create Bf
-        Bf_shape = (len(biosphere), p)
-        Bf = np.zeros(Bf_shape)
-        for i, c in enumerate(foreground):
-            c_lookup = c[0]
-            for j, r in enumerate(biosphere):
-                r_lookup = r[0]
-                Bf[j, i] = matrix[r_lookup, c_lookup]
-        
-        # Get extra info about the foreground flows
-        foreground_info = [self.model.database['items'][self.model.get_exchange(x[1])] for x in foreground]
-
-        # Get technosphere and biosphere data from external links
-        technosphere_links = [self.model.database['items'][
-                                  self.model.get_exchange(x[1])].get('ext_link', (None, '{}'.format(x[1])))
-                              for x in background
-                              if self.model.database['items'][self.model.get_exchange(x[1])]['lcopt_type'] == "input"]
-        biosphere_links = [self.model.database['items'][self.model.get_exchange(x[1])]['ext_link']
-                           for x in background
-                           if self.model.database['items'][self.model.get_exchange(x[1])]['lcopt_type'] == "biosphere"]
+            codes = list(self.executor.map(self.model.get_exchange, names, chunksize=self.block_size))
+        items = self.model.database['items']
+        return {x: items[c] for x, c in zip(names, codes)}
+
+    def _matrices(self, matrix, foreground, technosphere, biosphere):
+        """
+        Dense Af, Ad and Bf: with an executor, in blocks of block_size foreground columns, joined in column order
+        """
+        rows = [np.array([x[0] for x in flows], dtype=np.int64) for flows in (foreground, technosphere, biosphere)]
+        columns = rows[0]
+        if self.executor is None or len(columns) <= self.block_size:
+            return _column_block(matrix, rows[0], rows[1], rows[2], columns)
+
+        blocks = [columns[start:start + self.block_size] for start in range(0, len(columns), self.block_size)]
+        n = len(blocks)
+        results = list(self.executor.map(_column_block, [matrix] * n, [rows[0]] * n, [rows[1]] * n, [rows[2]] * n,
+                                         blocks))
+        return tuple(np.hstack([r[k] for r in results]) for k in range(3))
+
+    def _prepare_disclosure(self):
         
-        # Get technosphere ids
-        technosphere_info = []
-        for t in technosphere_links:
-            y = t[0]
-            if y is None:
-                technosphere_info.append(self.model.database['items'][self.model.get_exchange(t[1])])
+        with self._stage('specify'):
+            if self.parameter_set is None:
+                matrix = self.model.matrix.copy()
             else:
-                e = [i for i, x in enumerate(self.model.external_databases) if x['name'] == y][0]
-                technosphere_info.append(self.model.external_databases[e]['items'][t])
+                matrix = specify_matrix(self.model, self.parameter_set)
+
+        with self._stage('partition'):
+            col_sums = matrix.sum(axis=0)
+            row_sums = matrix.sum(axis=1)
+            background = [(i, x) for i, x in enumerate(self.model.names) if col_sums[i] == 0]
+            foreground = [(i, x) for i, x in enumerate(self.model.names) if col_sums[i] != 0]
+            fu = [(i, x) for i, x in enumerate(self.model.names) if row_sums[i] == 0 and col_sums[i] != 0]
+            unused = [(i, x) for i, x in enumerate(self.model.names) if row_sums[i] == 0 and col_sums[i] == 0]
         
-        # Get biosphere ids
-        biosphere_ids = []
-        for b in biosphere_links:
-            y = b[0]
-            e = [i for i, x in enumerate(self.model.external_databases) if x['name'] == y][0]
-            biosphere_ids.append((self.model.external_databases[e]['items'][b]))
+            background = sorted(list(set(background) - set(unused)))  # get rid of unused items
+            foreground = sorted(list(set(foreground) - set(unused)))  # get rid of unused items
+            fu_set = set(fu)
+            foreground = fu + [x for x in foreground if x not in fu_set]  # set fu to be the first item in the foreground matrix
+
+            items = self._items([x[1] for x in foreground + background])
+            self._count('metadata lookups', len(items))
+
+            # split background into technosphere and biosphere portions
+            technosphere = [x for x in background if items[x[1]]['lcopt_type'] == "input"]
+            biosphere = [x for x in background if items[x[1]]['lcopt_type'] == "biosphere"]
+
+        with self._stage('matrices'):
+            Af, Ad, Bf = self._matrices(matrix, foreground, technosphere, biosphere)
+
+        with self._stage('metadata'):
+            # Get extra info about the foreground flows
+            foreground_info = [items[x[1]] for x in foreground]
+
+            # Get technosphere and biosphere data from external links
+            technosphere_links = [items[x[1]].get('ext_link', (None, '{}'.format(x[1]))) for x in technosphere]
+            biosphere_links = [items[x[1]]['ext_link'] for x in biosphere]
         
+            # Get technosphere ids
+            external = [t for t in technosphere_links if t[0] is not None]
+            resolved = iter(resolve_links(self.model, external, self.link_cache))
+            technosphere_info = [self.model.database['items'][self.model.get_exchange(t[1])] if t[0] is None
+                                 else next(resolved) for t in technosphere_links]
+
+            # Get biosphere ids
+            biosphere_ids = resolve_links(self.model, biosphere_links, self.link_cache)
+
         # final preparations
-        foreground_names = [{'index': i,
-                             'name': x[1],
-                             'unit': foreground_info[i]['unit'],
-                             'location': foreground_info[i]['location']}
+        foreground_names = [ForegroundFlow(index=i,
+                                           name=x[1],
+                                           unit=foreground_info[i]['unit'],
+                                           location=foreground_info[i]['location'])
                             for i, x in enumerate(foreground)]
-        technosphere_names = [{'index': i,
-                               'ecoinvent_name': technosphere_info[i].get('name', 'n/a'),
-                               'ecoinvent_id': technosphere_info[i].get('activity', 'n/a'),
-                               'brightway_id': list(technosphere_links[i]),
-                               'unit': technosphere_info[i].get('unit', 'n/a'),
-                               'location':technosphere_info[i].get('location', 'n/a')}
+        technosphere_names = [BackgroundFlow(index=i,
+                                             ecoinvent_name=technosphere_info[i].get('name', 'n/a'),
+                                             ecoinvent_id=technosphere_info[i].get('activity', 'n/a'),
+                                             brightway_id=list(technosphere_links[i]),
+                                             unit=technosphere_info[i].get('unit', 'n/a'),
+                                             location=technosphere_info[i].get('location', 'n/a'))
                               for i, x in enumerate(technosphere)]
-        biosphere_names = [{'index': i,
-                            'name': "{}, {}, {}".format(biosphere_ids[i]['name'], biosphere_ids[i]['type'],
-                                                        ",".join(biosphere_ids[i]['categories'])),
-                            'biosphere3_id': list(biosphere_links[i]),
-                            'unit': biosphere_ids[i]['unit']}
+        biosphere_names = [EmissionFlow(index=i,
+                                        name="{}, {}, {}".format(biosphere_ids[i]['name'], biosphere_ids[i]['type'],
+                                                                 ",".join(biosphere_ids[i]['categories'])),
+                                        biosphere3_id=list(biosphere_links[i]),
+                                        unit=biosphere_ids[i]['unit'],
+                                        context=biosphere_ids[i].get('categories'))
                            for i, x in enumerate(biosphere)]
 
-        return foreground_names, technosphere_names, biosphere_names, \
-            matrix_to_coo(Af), matrix_to_coo(Ad), matrix_to_coo(Bf)
+        with self._stage('coo'):
+            Af_coo, Ad_coo, Bf_coo = matrix_to_coo(Af), matrix_to_coo(Ad), matrix_to_coo(Bf)
+
+        return foreground_names, technosphere_names, biosphere_names, Af_coo, Ad_coo, Bf_coo
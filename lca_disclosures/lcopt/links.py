@@ -0,0 +1,102 @@
+"""
+A process-wide cache of resolved lcopt external links.
+
+lcopt models link their background and biosphere items to external databases (e.g. ecoinvent, biosphere3) by
+(database name, code) keys, and many models and parameter sets link to the same activities.  LINK_CACHE keeps the
+metadata of resolved links, shared by every LcoptDisclosure in the process, in a size-bounded LRU cache.
+
+The cache assumes that a (database name, code) key means the same activity in every model.  If a database is replaced
+(e.g. a new version under the same name), call LINK_CACHE.invalidate(database=name).
+"""
+import threading
+from collections import OrderedDict
+
+# resolved links kept in LINK_CACHE
+CACHE_SIZE = 100000
+
+
+class LinkCache(object):
+    """
+    LRU cache of external link metadata keyed by (database name, code)
+    :param maxsize: number of links kept
+    """
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return tuple(key) in self._items
+
+    @property
+    def hit_rate(self):
+        """
+        Fraction of lookups answered from the cache, or None before the first lookup
+        """
+        lookups = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / lookups if lookups else None
+
+    def get(self, key, load):
+        """
+        The cached value for key, calling load(key) to resolve it on a miss
+        :param key: (database name, code)
+        :param load: function of the key
+        """
+        key = tuple(key)
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.stats['hits'] += 1
+                return self._items[key]
+            self.stats['misses'] += 1
+
+        value = load(key)
+
+        with self._lock:
+            self._items[key] = value
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+                self.stats['evictions'] += 1
+        return value
+
+    def invalidate(self, key=None, database=None):
+        """
+        Drop one key, every key of one database, or everything
+        """
+        with self._lock:
+            if key is not None:
+                self._items.pop(tuple(key), None)
+            elif database is not None:
+                for k in [k for k in self._items if k[0] == database]:
+                    del self._items[k]
+            else:
+                self._items.clear()
+
+
+LINK_CACHE = LinkCache()
+
+
+def resolve_links(model, links, cache=LINK_CACHE):
+    """
+    Metadata of external links, from the cache where possible
+    :param model: the LcoptModel whose external_databases resolve the links
+    :param links: list of (database name, code)
+    :param cache: a LinkCache, or None to resolve every link from the model
+    :return: list of item dicts, parallel to links
+    """
+    databases = {}
+
+    def load(key):
+        if not databases:
+            # first match wins, as in a linear search of external_databases
+            for db in reversed(model.external_databases):
+                databases[db['name']] = db
+        return databases[key[0]]['items'][key]
+
+    if cache is None:
+        return [load(tuple(link)) for link in links]
+    return [cache.get(link, load) for link in links]
@@ -0,0 +1,392 @@
+"""
+A small local HTTP service that serves disclosures on request.
+
+    python -m lca_disclosures.server --port 8000 --root /data/disclosures
+
+GET /disclosure builds (or fetches from the cache) a disclosure and returns it:
+
+    /disclosure?source=file&path=model.json
+    /disclosure?source=bw2&project=My_project&database=My_foreground
+    /disclosure?source=lcopt&model=model.lcopt&parameter_set=0
+
+Optional parameters: format=json (the default, streamed as it is encoded) or format=npz (the matrices as numpy
+arrays plus the flow lists as JSON, see npz_bytes()).  File and lcopt paths are resolved relative to the service's
+root folder and may not leave it; their cache keys include the file's modification time and size, so a file that
+changes is built again.  Likewise bw2 keys include the modification time brightway2 records for the database (looked
+up in the executor, see bw2_version()).  GET /stats returns the cache statistics.
+
+Disclosures are built in a concurrent.futures executor (by default a process pool, since brightway2 keeps its current
+project in global state), never on the event loop.  Prepared disclosures are kept in an LRU cache, and concurrent
+requests for a disclosure that is still being built wait for the same build.  Responses are encoded in a thread pool
+too: npz archives whole, and JSON piece by piece, handed to the event loop through a queue of at most QUEUE_SIZE
+pieces so that a slow client holds back the encoder rather than filling memory.  If a streamed response fails after
+its head has been sent, the connection is aborted, so that the client sees a truncated response rather than a second
+one.
+
+Only the standard library is used; the brightway2 and lcopt builders are imported when first requested.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlsplit
+
+import numpy as np
+
+from .base import StaticDisclosure, from_file
+from .base.ooc import iter_json
+
+SOURCES = ('file', 'bw2', 'lcopt')
+
+# pieces of streamed JSON are collected into writes of about this many characters
+WRITE_SIZE = 65536
+
+# writes encoded ahead of the client
+QUEUE_SIZE = 8
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           500: 'Internal Server Error'}
+
+
+class RequestError(ValueError):
+    """
+    A request that cannot be served; status is the HTTP status to respond with
+    """
+    def __init__(self, message, status=400):
+        super(RequestError, self).__init__(message)
+        self.status = status
+
+
+def build_disclosure(key):
+    """
+    Build the disclosure for a cache key.  Module-level, so that it can run in a process pool; the result is a
+    StaticDisclosure, which can be sent back to the event loop's process.
+    :param key: (source, ...) as returned by DisclosureService.key()
+    :return: StaticDisclosure
+    """
+    source = key[0]
+    if source == 'file':
+        disclosure = from_file(key[1])
+    elif source == 'bw2':
+        from .brightway2.disclosure import Bw2Disclosure
+        disclosure = Bw2Disclosure(key[1], key[2])
+    elif source == 'lcopt':
+        from lcopt import LcoptModel
+        from .lcopt.disclosure import LcoptDisclosure
+        disclosure = LcoptDisclosure(LcoptModel(load=key[1], autosetup=False), parameter_set=key[2])
+    else:
+        raise ValueError('Unknown source {}'.format(source))
+    return StaticDisclosure(disclosure.disclosure, uncertainty=disclosure.uncertainty, filename=disclosure.efn)
+
+
+def bw2_version(project, database):
+    """
+    The modification time brightway2 records for a database, or None if it has none.  Module-level, so that it can run
+    in a process pool; it makes the project current, as building the disclosure would.
+    """
+    from bw2data import databases, projects
+    projects.set_current(project)
+    return databases[database].get('modified') if database in databases else None
+
+
+def json_chunks(data):
+    """
+    Generator.  The JSON encoding of disclosure data as UTF-8 bytes, in pieces of about WRITE_SIZE characters
+    """
+    buffered, size = [], 0
+    for piece in iter_json(data):
+        buffered.append(piece)
+        size += len(piece)
+        if size >= WRITE_SIZE:
+            yield ''.join(buffered).encode('utf-8')
+            buffered, size = [], 0
+    if buffered:
+        yield ''.join(buffered).encode('utf-8')
+
+
+def npz_bytes(disclosure):
+    """
+    The disclosure as a numpy .npz archive: rows, cols and vals arrays for each matrix (e.g. 'Af_rows'), its shape
+    (e.g. 'Af_shape'), and the three flow lists as a JSON document in 'flows' (a uint8 array of UTF-8 bytes)
+    """
+    arrays = {}
+    for name in ('Af', 'Ad', 'Bf'):
+        rows, cols, vals = disclosure.matrix_arrays(name)
+        arrays[name + '_rows'], arrays[name + '_cols'], arrays[name + '_vals'] = rows, cols, vals
+        arrays[name + '_shape'] = np.array(disclosure.matrix_shape(name))
+    data = disclosure.data
+    flows = {section: data[section] for section in ('foreground flows', 'background flows', 'foreground emissions')}
+    arrays['flows'] = np.frombuffer(json.dumps(flows).encode('utf-8'), dtype=np.uint8)
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def _stamp(path):
+    """
+    (modification time, size) of a file, to tell versions of it apart in cache keys
+    """
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+class DisclosureCache(object):
+    """
+    LRU cache of prepared disclosures, with coalescing of concurrent builds of the same key
+    :param build: function of a key, run in the executor
+    :param executor: concurrent.futures executor
+    :param maxsize: number of disclosures kept
+    """
+    def __init__(self, build, executor, maxsize=16):
+        self.build = build
+        self.executor = executor
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._pending = {}
+        self.stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'evictions': 0}
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    async def get(self, key):
+        if key in self._items:
+            self._items.move_to_end(key)
+            self.stats['hits'] += 1
+            return self._items[key]
+
+        pending = self._pending.get(key)
+        if pending is not None:
+            self.stats['coalesced'] += 1
+            return await asyncio.shield(pending)
+
+        self.stats['misses'] += 1
+        loop = asyncio.get_event_loop()
+        pending = self._pending[key] = asyncio.ensure_future(loop.run_in_executor(self.executor, self.build, key))
+        try:
+            value = await asyncio.shield(pending)
+        finally:
+            del self._pending[key]
+
+        self._items[key] = value
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+            self.stats['evictions'] += 1
+        return value
+
+    def invalidate(self, key=None):
+        """
+        Drop one key, or everything
+        """
+        if key is None:
+            self._items.clear()
+        else:
+            self._items.pop(key, None)
+
+
+class DisclosureService(object):
+    """
+    :param root: folder against which file and lcopt paths are resolved; defaults to the working directory
+    :param executor: concurrent.futures executor for building disclosures; a ProcessPoolExecutor by default
+    :param cache_size: number of prepared disclosures kept in memory
+    :param build: function building a disclosure from a key (build_disclosure by default)
+    :param encoder: ThreadPoolExecutor in which responses are encoded; one is created by default
+    :param version: function of (project, database) giving a version of a brightway2 database, run in the executor
+    (bw2_version by default)
+    """
+    def __init__(self, root=None, executor=None, cache_size=16, build=build_disclosure, encoder=None,
+                 version=bw2_version):
+        self.root = os.path.abspath(root or os.getcwd())
+        self.executor = executor or ProcessPoolExecutor()
+        self.encoder = encoder or ThreadPoolExecutor()
+        self.version = version
+        self.cache = DisclosureCache(build, self.executor, maxsize=cache_size)
+
+    def _path(self, query, name):
+        value = query.get(name)
+        if not value:
+            raise RequestError('Missing parameter {}'.format(name))
+        path = os.path.realpath(os.path.join(self.root, value))
+        if os.path.commonpath([path, os.path.realpath(self.root)]) != os.path.realpath(self.root):
+            raise RequestError('{} is outside the service root'.format(value))
+        if not os.path.isfile(path):
+            raise RequestError('No such file: {}'.format(value), status=404)
+        return path
+
+    async def key(self, query):
+        """
+        The cache key for a request's query parameters
+        """
+        source = query.get('source', 'file')
+        if source == 'file':
+            path = self._path(query, 'path')
+            return 'file', path, _stamp(path)
+        if source == 'bw2':
+            if not query.get('project') or not query.get('database'):
+                raise RequestError('bw2 requests need project and database')
+            loop = asyncio.get_event_loop()
+            version = await loop.run_in_executor(self.executor, self.version, query['project'], query['database'])
+            return 'bw2', query['project'], query['database'], version
+        if source == 'lcopt':
+            parameter_set = query.get('parameter_set')
+            if parameter_set is not None and parameter_set.isdigit():
+                parameter_set = int(parameter_set)
+            path = self._path(query, 'model')
+            return 'lcopt', path, parameter_set, _stamp(path)
+        raise RequestError('Unknown source {}; expected one of {}'.format(source, ', '.join(SOURCES)))
+
+    async def handle(self, reader, writer):
+        started = False
+        try:
+            try:
+                method, target = await self._read_request(reader)
+                if method != 'GET':
+                    raise RequestError('Only GET is supported', status=405)
+                url = urlsplit(target)
+                query = dict(parse_qsl(url.query))
+                if url.path == '/stats':
+                    await self._send(writer, 200, 'application/json',
+                                     json.dumps(dict(self.cache.stats, size=len(self.cache))).encode('utf-8'))
+                elif url.path == '/disclosure':
+                    fmt = query.get('format', 'json')
+                    if fmt not in ('json', 'npz'):
+                        raise RequestError('Unknown format {}'.format(fmt))
+                    disclosure = await self.cache.get(await self.key(query))
+                    if fmt == 'npz':
+                        body = await asyncio.get_event_loop().run_in_executor(self.encoder, npz_bytes, disclosure)
+                        await self._send(writer, 200, 'application/octet-stream', body)
+                    else:
+                        writer.write(self._head(200, 'application/json', ['Transfer-Encoding: chunked']))
+                        started = True
+                        await self._stream_json(writer, disclosure)
+                else:
+                    raise RequestError('Unknown path {}'.format(url.path), status=404)
+            except RequestError as e:
+                await self._send(writer, e.status, 'application/json', json.dumps({'error': str(e)}).encode('utf-8'))
+            except Exception as e:
+                if started:
+                    # the 200 head has gone out; a second response cannot follow it
+                    writer.transport.abort()
+                    return
+                await self._send(writer, 500, 'application/json',
+                                 json.dumps({'error': '{}: {}'.format(type(e).__name__, e)}).encode('utf-8'))
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_request(reader):
+        request_line = (await reader.readline()).decode('latin-1').strip()
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+        parts = request_line.split()
+        if len(parts) != 3:
+            raise RequestError('Malformed request line')
+        return parts[0], parts[1]
+
+    @staticmethod
+    def _head(status, content_type, extra=()):
+        lines = ['HTTP/1.1 {} {}'.format(status, REASONS.get(status, '')), 'Content-Type: ' + content_type,
+                 'Connection: close'] + list(extra)
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+    async def _send(self, writer, status, content_type, body):
+        writer.write(self._head(status, content_type, ['Content-Length: {}'.format(len(body))]))
+        writer.write(body)
+        await writer.drain()
+
+    async def _stream_json(self, writer, disclosure):
+        """
+        Write the disclosure as the chunked body of a response whose head has been sent.  The JSON is encoded in the
+        encoder pool; a semaphore keeps it at most QUEUE_SIZE writes ahead, and it stops once the response is
+        abandoned.
+        """
+        loop = asyncio.get_event_loop()
+        queue = asyncio.Queue()
+        slots = threading.Semaphore(QUEUE_SIZE)
+        abandoned = threading.Event()
+
+        def put(item):
+            while not slots.acquire(timeout=0.1):
+                if abandoned.is_set():
+                    return False
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+            return True
+
+        def encode():
+            # ends with None, or with the exception that stopped the encoding
+            try:
+                for chunk in json_chunks(disclosure.data):
+                    if abandoned.is_set() or not put(chunk):
+                        return
+                end = None
+            except Exception as e:
+                end = e
+            put(end)
+
+        loop.run_in_executor(self.encoder, encode)
+        try:
+            while True:
+                chunk = await queue.get()
+                slots.release()
+                if chunk is None:
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+                await self._write_chunk(writer, chunk)
+            writer.write(b'0\r\n\r\n')
+            await writer.drain()
+        finally:
+            abandoned.set()
+
+    @staticmethod
+    async def _write_chunk(writer, data):
+        writer.write('{:x}\r\n'.format(len(data)).encode('latin-1') + data + b'\r\n')
+        await writer.drain()
+
+    async def start(self, host='127.0.0.1', port=8000):
+        """
+        Start listening
+        :return: asyncio Server
+        """
+        return await asyncio.start_server(self.handle, host, port)
+
+
+def serve(host='127.0.0.1', port=8000, **kwargs):
+    """
+    Run a DisclosureService until interrupted
+    :param kwargs: passed to DisclosureService
+    """
+    service = DisclosureService(**kwargs)
+    loop = asyncio.get_event_loop()
+    server = loop.run_until_complete(service.start(host, port))
+    try:
+        loop.run_forever()
+    finally:
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        service.executor.shutdown()
+        service.encoder.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve disclosures over HTTP')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--root', default=None, help='folder containing disclosure and lcopt files')
+    parser.add_argument('--cache-size', type=int, default=16)
+    args = parser.parse_args()
+    serve(args.host, args.port, root=args.root, cache_size=args.cache_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,76 @@
+import importlib
+
+import numpy as np
 from scipy.sparse import coo_matrix
 
 
 def matrix_to_coo(m):
     m_coo = coo_matrix(m)
     return [[[int(m_coo.row[i]), int(m_coo.col[i])], float(m_coo.data[i])] for i, _ in enumerate(m_coo.data)]
+
+
+def coo_to_arrays(data):
+    """
+    Convert a list of [[row, col], value] entries into three numpy arrays
+    :param data: COO data as stored in a disclosure
+    :return: rows (int64), cols (int64), vals (float64)
+    """
+    count = len(data)
+    rows = np.fromiter((x[0][0] for x in data), dtype=np.int64, count=count)
+    cols = np.fromiter((x[0][1] for x in data), dtype=np.int64, count=count)
+    vals = np.fromiter((x[1] for x in data), dtype=np.float64, count=count)
+    return rows, cols, vals
+
+
+def arrays_to_coo(rows, cols, vals):
+    """
+    Inverse of coo_to_arrays: returns a list of [[row, col], value] entries
+    """
+    return [[[r, c], v] for r, c, v in zip(np.asarray(rows).tolist(), np.asarray(cols).tolist(),
+                                           np.asarray(vals, dtype=np.float64).tolist())]
+
+
+class LazyObject(object):
+    """
+    Stands in, in a package namespace, for a class or function that needs brightway2, bw2io or lcopt, and only loads it
+    when it is first called or one of its attributes is used.  isinstance() and issubclass() checks are passed on to
+    the real object, but a stand-in cannot be subclassed: import the real class from its own module for that.
+    :param load: function of no arguments returning the real object
+    :param name: dotted name of the real object, for repr()
+    """
+    def __init__(self, load, name):
+        self._load = load
+        self._name = name
+        self._target = None
+
+    @property
+    def target(self):
+        if self._target is None:
+            self._target = self._load()
+        return self._target
+
+    def __call__(self, *args, **kwargs):
+        return self.target(*args, **kwargs)
+
+    def __getattr__(self, name):
+        if name in ('_load', '_name', '_target'):
+            raise AttributeError(name)
+        return getattr(self.target, name)
+
+    def __instancecheck__(self, instance):
+        return isinstance(instance, self.target)
+
+    def __subclasscheck__(self, subclass):
+        return issubclass(subclass, self.target)
+
+    def __repr__(self):
+        return '<lazily imported {}{}>'.format(self._name, '' if self._target is None else ', loaded')
+
+
+def lazy_import(module, name):
+    """
+    A LazyObject for an attribute of a module, which is imported when the object is first used
+    :param module: absolute module name
+    :param name: name of the attribute
+    """
+    return LazyObject(lambda: getattr(importlib.import_module(module), name), '{}.{}'.format(module, name))
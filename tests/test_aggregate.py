@@ -0,0 +1,39 @@
+import os
+import numpy as np
+from lca_disclosures import from_file
+from lca_disclosures.base import StaticDisclosure
+
+TEST_DISCLOSURE = os.path.join('assets', 'Test_model_ps_0.json')
+
+
+def _looped():
+    # flow 0 consumes flow 1; flows 1 and 2 consume each other
+    foreground = [{'index': i, 'name': 'Flow {}'.format(i), 'unit': 'kg', 'location': 'GLO'} for i in range(4)]
+    background = [{'index': 0, 'ecoinvent_name': 'electricity', 'brightway_id': ['db', 'e'], 'unit': 'kWh',
+                   'location': 'GLO'}]
+    Af = [[[1, 0], 2.0], [[2, 1], 0.5], [[1, 2], 0.2], [[3, 2], 1.0]]
+    Ad = [[[0, 1], 1.0], [[0, 3], 3.0]]
+    return StaticDisclosure((foreground, background, [], Af, Ad, []))
+
+
+def test_foreground_structure():
+
+    structure = _looped().foreground_structure()
+
+    assert structure.n_components == 3
+    assert sorted(structure.sizes.tolist()) == [1, 1, 2]
+    assert structure.labels[1] == structure.labels[2]
+    assert [len(level) for level in structure.levels] == [1, 1, 1]
+
+
+def test_aggregate_methods_agree():
+
+    for my_disclosure in (from_file(TEST_DISCLOSURE), _looped()):
+        scc = my_disclosure.aggregate()
+        lu = my_disclosure.aggregate(method='lu')
+
+        assert np.allclose(scc.activity, lu.activity)
+        assert np.allclose(scc.background, lu.background)
+        assert np.allclose(scc.emissions, lu.emissions)
+
+    assert np.allclose(_looped().aggregate().background, [2 / 0.9 + 3 * 0.5 * 2 / 0.9])
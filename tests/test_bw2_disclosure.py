@@ -1,9 +1,17 @@
 import os
+import json
+import pytest
 import brightway2 as bw2
+from concurrent.futures import ThreadPoolExecutor
 from fixtures import *
 
 from lca_disclosures.brightway2.disclosure import Bw2Disclosure as DisclosureExporter
 from lca_disclosures.brightway2.importer import DisclosureImporter
+from lca_disclosures.brightway2 import batch
+from lca_disclosures.brightway2.batch import import_disclosures
+from lca_disclosures.brightway2.writer import write_disclosure
+from lca_disclosures.server import DisclosureService
+from test_server import _run
 
 def test_attributes():
 
@@ -16,6 +24,126 @@ def test_attributes():
     assert de.Ad
     assert de.Bf
 
+def test_bulk_extraction():
+
+    orm = DisclosureExporter(TEST_BW_PROJECT_NAME, TEST_BW_DB_NAME)
+    bulk = DisclosureExporter(TEST_BW_PROJECT_NAME, TEST_BW_DB_NAME, bulk=True)
+
+    assert bulk.data == orm.data
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        threaded = DisclosureExporter(TEST_BW_PROJECT_NAME, TEST_BW_DB_NAME, bulk=True, executor=executor)
+
+    assert threaded.data == orm.data
+
+
+def test_parallel_classification():
+
+    serial = DisclosureExporter(TEST_BW_PROJECT_NAME, TEST_BW_DB_NAME, keep_uncertainty=True)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        parallel = DisclosureExporter(TEST_BW_PROJECT_NAME, TEST_BW_DB_NAME, keep_uncertainty=True,
+                                      executor=executor, block_size=3, profile=True)
+
+    assert parallel.stats.counts['classify blocks'] > 1
+    assert parallel.data == serial.data
+    for name in ('Af', 'Ad', 'Bf'):
+        assert list(parallel.uncertainty[name]['uncertainty type']) == list(serial.uncertainty[name]['uncertainty type'])
+
+def test_processed_arrays():
+
+    orm = DisclosureExporter(TEST_BW_PROJECT_NAME, TEST_BW_DB_NAME, keep_uncertainty=True)
+    processed = DisclosureExporter(TEST_BW_PROJECT_NAME, TEST_BW_DB_NAME, keep_uncertainty=True, processed=True)
+
+    assert processed.foreground_flows[0] == orm.foreground_flows[0]
+    assert list(processed.diff(orm, rel_tol=1e-6)) == []
+    assert sorted(processed.uncertainty['Bf']['uncertainty type']) == sorted(orm.uncertainty['Bf']['uncertainty type'])
+
+def test_processed_empty_database():
+
+    bw2.projects.set_current(TEST_BW_PROJECT_NAME)
+    bw2.Database('Empty_disclosure').write({})
+    try:
+        with pytest.raises(ValueError):
+            DisclosureExporter(TEST_BW_PROJECT_NAME, 'Empty_disclosure', processed=True)
+    finally:
+        bw2.Database('Empty_disclosure').delete(warn=False)
+        del bw2.databases['Empty_disclosure']
+
+def test_write_disclosure():
+
+    de = DisclosureExporter(TEST_BW_PROJECT_NAME, TEST_BW_DB_NAME)
+
+    db = write_disclosure(de, 'Written_disclosure', overwrite=True)
+
+    try:
+        assert len(db) == len(de.foreground_flows)
+        round_trip = DisclosureExporter(TEST_BW_PROJECT_NAME, 'Written_disclosure')
+        assert list(round_trip.diff(de, rel_tol=1e-6)) == []
+    finally:
+        db.delete(warn=False)
+        del bw2.databases['Written_disclosure']
+
+def test_batch_import(tmpdir):
+
+    de = DisclosureExporter(TEST_BW_PROJECT_NAME, TEST_BW_DB_NAME)
+    first = de.write_json(folder_path=str(tmpdir.join('first')))
+    second = de.write_json(folder_path=str(tmpdir.join('second')))
+    broken = str(tmpdir.join('broken.json'))
+    with open(broken, 'w') as fp:
+        fp.write('{')
+
+    names = ['Batch_first', 'Batch_second', 'Batch_broken']
+    try:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            results = import_disclosures([first, second, broken], db_names=names, executor=executor, overwrite=True)
+
+        assert [r.error is None for r in results] == [True, True, False]
+        assert set(results[0].timings) == {'parse', 'link', 'rows', 'write', 'process'}
+        assert results[2].error.startswith('JSONDecodeError')
+        for name in names[:2]:
+            assert list(DisclosureExporter(TEST_BW_PROJECT_NAME, name).diff(de, rel_tol=1e-6)) == []
+    finally:
+        for name in names:
+            if name in bw2.databases:
+                bw2.Database(name).delete(warn=False)
+                del bw2.databases[name]
+
+def test_batch_import_failure_keeps_databases(tmpdir, monkeypatch):
+
+    de = DisclosureExporter(TEST_BW_PROJECT_NAME, TEST_BW_DB_NAME)
+    path = de.write_json(folder_path=str(tmpdir))
+    write_disclosure(de, 'Batch_kept', overwrite=True)
+
+    def failing_insert(connection, activities, exchanges):
+        raise RuntimeError('disk full')
+
+    monkeypatch.setattr(batch, 'insert_rows', failing_insert)
+    names = ['Batch_kept', 'Batch_new']
+    try:
+        results = import_disclosures([path, path], db_names=names, overwrite=True, process=False)
+
+        assert [r.error for r in results] == ['RuntimeError: disk full'] * 2
+        assert 'Batch_new' not in bw2.databases
+        assert len(bw2.Database('Batch_kept')) == len(de.foreground_flows)
+    finally:
+        for name in names:
+            if name in bw2.databases:
+                bw2.Database(name).delete(warn=False)
+                del bw2.databases[name]
+
+def test_server_bw2():
+
+    expected = DisclosureExporter(TEST_BW_PROJECT_NAME, TEST_BW_DB_NAME)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        service = DisclosureService(executor=executor)
+        (status, body), = _run(service, '/disclosure?source=bw2&project={}&database={}'.format(
+            TEST_BW_PROJECT_NAME, TEST_BW_DB_NAME))
+
+    assert status == 200
+    assert json.loads(body.decode('utf-8')) == json.loads(json.dumps(expected.data))
+
 def test_bw2_disclosure():
     
     de = DisclosureExporter(TEST_BW_PROJECT_NAME, TEST_BW_DB_NAME, folder_path=TEST_FOLDER, filename=TEST_FILENAME)
@@ -0,0 +1,58 @@
+import os
+import json
+import pytest
+from lca_disclosures import from_file
+
+TEST_DISCLOSURE = os.path.join('assets', 'Test_model_ps_0.json')
+
+
+def _reordered(tmpdir):
+    # reverse the background flows and emissions and shuffle the entries, keeping the matrices consistent
+    with open(TEST_DISCLOSURE) as fp:
+        j = json.load(fp)
+    for section, name in (('background flows', 'Ad'), ('foreground emissions', 'Bf')):
+        n = len(j[section])
+        j[section] = [dict(f, index=i) for i, f in enumerate(j[section][::-1])]
+        j[name]['data'] = [[[n - 1 - r, c], v] for (r, c), v in j[name]['data'][::-1]]
+    path = str(tmpdir.join('reordered.json'))
+    with open(path, 'w') as fp:
+        json.dump(j, fp)
+    return path
+
+
+def test_canonical_order(tmpdir):
+
+    original = from_file(TEST_DISCLOSURE)
+    reordered = from_file(_reordered(tmpdir))
+
+    assert original.fingerprint != reordered.fingerprint
+    assert original.canonical().data == reordered.canonical().data
+    assert original.canonical().fingerprint == reordered.canonical().fingerprint
+    assert from_file(TEST_DISCLOSURE, canonical=True).fingerprint == original.canonical().fingerprint
+
+    canonical = original.canonical()
+    assert canonical.foreground_flows[0] == original.foreground_flows[0]
+    assert list(canonical.diff(original)) == []
+    assert abs(canonical.aggregate().emissions.sum() - original.aggregate().emissions.sum()) < 1e-12
+
+
+def test_fingerprint_out_of_core(tmpdir):
+
+    in_memory = from_file(TEST_DISCLOSURE)
+    chunked = from_file(TEST_DISCLOSURE, out_of_core=str(tmpdir), chunk_size=3)
+
+    assert chunked.fingerprint == in_memory.fingerprint
+    assert chunked.canonical().fingerprint == in_memory.canonical().fingerprint
+
+
+def test_canonical_rejects_duplicate_keys(tmpdir):
+
+    with open(TEST_DISCLOSURE) as fp:
+        j = json.load(fp)
+    j['foreground emissions'][1] = dict(j['foreground emissions'][0], index=1)
+    path = str(tmpdir.join('duplicates.json'))
+    with open(path, 'w') as fp:
+        json.dump(j, fp)
+
+    with pytest.raises(ValueError, match='Duplicate flow identity'):
+        from_file(path).canonical()
@@ -0,0 +1,42 @@
+import os
+import numpy as np
+import pytest
+from lca_disclosures import from_file
+
+from test_aggregate import _looped
+
+TEST_DISCLOSURE = os.path.join('assets', 'Test_model_ps_0.json')
+
+
+def test_contributions_sum_to_aggregate():
+
+    d = _looped()
+    result = d.contributions()
+    aggregated = d.aggregate(method='lu')
+
+    assert np.allclose(result.activity, aggregated.activity)
+    assert np.allclose(result.top['Ad'].sum(axis=1).A1, aggregated.background)
+    assert np.allclose(result.other['Ad'], 0)
+
+    x = aggregated.activity
+    assert np.allclose([v for _, v in result.contributors('Ad', 0)], [3.0 * x[3], 1.0 * x[1]])
+
+
+def test_top_k(tmpdir):
+
+    d = from_file(TEST_DISCLOSURE)
+    full = d.contributions(top_k=None)
+    top = d.contributions(top_k=1)
+
+    assert np.allclose(full.totals['Bf'], d.aggregate().emissions)
+    assert np.all(np.diff(top.top['Bf'].indptr) <= 1)
+    assert np.allclose(top.top['Bf'].sum(axis=1).A1 + top.other['Bf'], full.totals['Bf'])
+    for row in range(len(d.emission_flows)):
+        best = full.contributors('Bf', row)[:1]
+        assert top.contributors('Bf', row) == best
+
+    chunked = from_file(TEST_DISCLOSURE, out_of_core=str(tmpdir), chunk_size=2).contributions(top_k=1)
+    assert (chunked.top['Bf'] != top.top['Bf']).nnz == 0
+
+    with pytest.raises(ValueError):
+        d.contributions(top_k=0)
@@ -0,0 +1,67 @@
+import os
+import json
+import pytest
+from lca_disclosures import from_file
+from lca_disclosures.base import StaticDisclosure
+
+TEST_DISCLOSURE = os.path.join('assets', 'Test_model_ps_0.json')
+
+
+def _next_version(tmpdir):
+    # change a coefficient, drop an Ad entry, rename an emission and add a background flow with an entry
+    with open(TEST_DISCLOSURE) as fp:
+        j = json.load(fp)
+    j['Af']['data'][0][1] *= 1.5
+    j['Ad']['data'].pop(0)
+    j['foreground emissions'][0]['unit'] = 'g'
+    n = len(j['background flows'])
+    j['background flows'].append({'index': n, 'ecoinvent_name': 'new supply', 'brightway_id': ['db', 'new'],
+                                  'unit': 'kg', 'location': 'GLO'})
+    j['Ad']['shape'][0] += 1
+    j['Ad']['data'].append([[n, 0], 0.25])
+    path = str(tmpdir.join('version_2.json'))
+    with open(path, 'w') as fp:
+        json.dump(j, fp)
+    return path
+
+
+def test_delta_round_trip(tmpdir):
+
+    base = from_file(TEST_DISCLOSURE)
+    new = from_file(_next_version(tmpdir))
+
+    delta_file = new.write_delta(base, TEST_DISCLOSURE, folder_path=str(tmpdir.join('deltas')))
+    with open(delta_file) as fp:
+        delta = json.load(fp)
+
+    assert delta['Af']['changed'] and len(delta['Ad']['removed']) == 1 and len(delta['Ad']['added']) == 1
+    assert len(delta['foreground emissions']['changed']) == 1
+    assert len(delta['background flows']['added']) == 1
+    assert os.path.getsize(delta_file) < os.path.getsize(TEST_DISCLOSURE)
+
+    restored = from_file(delta_file)
+    assert list(restored.diff(new, rel_tol=0)) == []
+    assert restored.data['foreground emissions'] == new.data['foreground emissions']
+    assert restored.fingerprint == delta['delta']['fingerprint']
+
+    # a delta of a delta
+    third = StaticDisclosure(base.disclosure, filename='version_3')
+    chained = from_file(third.write_delta(restored, delta_file, folder_path=str(tmpdir)))
+    assert list(chained.diff(base, rel_tol=0)) == []
+
+
+def test_delta_base_mismatch(tmpdir):
+
+    base = from_file(TEST_DISCLOSURE)
+    new = from_file(_next_version(tmpdir))
+    delta_file = new.write_delta(base, TEST_DISCLOSURE, folder_path=str(tmpdir.join('deltas')))
+
+    # point the delta at the wrong base
+    with open(delta_file) as fp:
+        delta = json.load(fp)
+    delta['delta']['base'] = os.path.relpath(str(tmpdir.join('version_2.json')), str(tmpdir.join('deltas')))
+    with open(delta_file, 'w') as fp:
+        json.dump(delta, fp)
+
+    with pytest.raises(ValueError):
+        from_file(delta_file)
@@ -0,0 +1,35 @@
+import os
+import json
+from lca_disclosures import from_file
+
+TEST_DISCLOSURE = os.path.join('assets', 'Test_model_ps_0.json')
+
+
+def test_diff_identical():
+
+    my_disclosure = from_file(TEST_DISCLOSURE)
+
+    assert list(my_disclosure.diff(from_file(TEST_DISCLOSURE))) == []
+
+
+def test_diff_reordered(tmpdir):
+
+    with open(TEST_DISCLOSURE) as fp:
+        j = json.load(fp)
+
+    # reverse the background flows, keeping Ad consistent, then change one coefficient and drop an emission entry
+    n = len(j['background flows'])
+    j['background flows'] = [dict(f, index=i) for i, f in enumerate(j['background flows'][::-1])]
+    j['Ad']['data'] = [[[n - 1 - r, c], v] for (r, c), v in j['Ad']['data']]
+    j['Ad']['data'][0][1] *= 2
+    dropped = j['Bf']['data'].pop(0)
+
+    other_file = str(tmpdir.join('other.json'))
+    with open(other_file, 'w') as fp:
+        json.dump(j, fp)
+
+    records = list(from_file(TEST_DISCLOSURE).diff(from_file(other_file)))
+
+    assert [(r.change, r.section) for r in records] == [('changed', 'Ad'), ('removed', 'Bf')]
+    assert records[0].new == 2 * records[0].old
+    assert records[1].old == dropped[1]
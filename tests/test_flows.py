@@ -0,0 +1,37 @@
+import os
+import pickle
+
+from lca_disclosures import from_file
+from lca_disclosures.base.flows import BackgroundFlow, EmissionFlow, ForegroundFlow
+
+TEST_DISCLOSURE = os.path.join('assets', 'Test_model_ps_0.json')
+
+
+def test_flow_records():
+    d = from_file(TEST_DISCLOSURE)
+    assert all(isinstance(f, ForegroundFlow) for f in d.foreground_flows)
+    assert all(isinstance(f, BackgroundFlow) for f in d.background_flows)
+    assert all(isinstance(f, EmissionFlow) for f in d.emission_flows)
+
+    flow = d.background_flows[0]
+    as_dict = flow.to_dict()
+    assert not hasattr(flow, '__dict__')
+    assert flow == as_dict and as_dict == flow
+    assert dict(flow) == as_dict
+    assert flow['unit'] == flow.unit == flow.get('unit')
+    assert flow.get('context', 'missing') == 'missing'
+    assert pickle.loads(pickle.dumps(flow)) == flow
+
+    moved = flow.reindexed(7)
+    assert moved['index'] == 7 and flow['index'] == 0
+
+
+def test_flow_records_keep_unknown_fields():
+    flow = EmissionFlow.from_dict({'index': 0, 'name': 'CO2', 'unit': 'kg', 'comment': 'estimated'})
+    assert flow['comment'] == 'estimated'
+    assert flow.to_dict() == {'index': 0, 'name': 'CO2', 'unit': 'kg', 'comment': 'estimated'}
+
+
+def test_emission_cutoffs():
+    d = from_file(TEST_DISCLOSURE)
+    assert not [f for f in d.cutoffs if isinstance(f, EmissionFlow)]
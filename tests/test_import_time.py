@@ -0,0 +1,81 @@
+import os
+import subprocess
+import sys
+from collections import OrderedDict
+
+import pytest
+
+from lca_disclosures.utils import lazy_import
+
+PACKAGE_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+HEAVY = {'brightway2', 'bw2data', 'bw2io', 'bw2calc', 'pandas', 'lcopt'}
+
+# a coarse ceiling on the cumulative import time of lca_disclosures.base, in seconds: numpy and scipy fit well within
+# it, brightway2 and bw2io (several seconds each) do not
+IMPORT_BUDGET = 3.0
+
+
+def _imported_modules(statement):
+    """
+    Run a statement in a fresh interpreter
+    :return: set of the names of the modules it imported
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [PACKAGE_ROOT, os.environ.get('PYTHONPATH')])))
+    result = subprocess.run([sys.executable, '-c', statement + '\nimport sys\nprint("\\n".join(sys.modules))'],
+                            env=env, stdout=subprocess.PIPE, universal_newlines=True, check=True)
+    return set(result.stdout.split())
+
+
+def _import_times(statement):
+    """
+    Run a statement in a fresh interpreter with -X importtime (python 3.7 and later)
+    :return: dict of module name to cumulative import time in microseconds
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [PACKAGE_ROOT, os.environ.get('PYTHONPATH')])))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement], env=env, stderr=subprocess.PIPE,
+                            universal_newlines=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            _, cumulative, name = line[len('import time:'):].split('|')
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_from_file_imports():
+
+    modules = _imported_modules('from lca_disclosures.base import from_file')
+
+    assert 'lca_disclosures.base.from_file' in modules
+    assert not {name.split('.')[0] for name in modules} & HEAVY
+
+
+def test_builders_import_lazily():
+
+    modules = _imported_modules('import lca_disclosures, lca_disclosures.brightway2, '
+                                'lca_disclosures.brightway2.disclosure, lca_disclosures.brightway2.writer, '
+                                'lca_disclosures.server')
+
+    assert not {name.split('.')[0] for name in modules} & HEAVY
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason='-X importtime needs python 3.7')
+def test_import_time():
+
+    times = _import_times('from lca_disclosures.base import from_file')
+
+    assert 'lca_disclosures.base.from_file' in times
+    assert not {name.split('.')[0] for name in times} & HEAVY
+    assert times['lca_disclosures.base'] < IMPORT_BUDGET * 1e6
+
+
+def test_lazy_objects():
+
+    lazy = lazy_import('collections', 'OrderedDict')
+    assert not repr(lazy).endswith('loaded>')
+    d = lazy([('a', 1)])
+    assert type(d) is OrderedDict and isinstance(d, lazy) and issubclass(OrderedDict, lazy)
+    assert lazy.fromkeys('b') == OrderedDict.fromkeys('b')
+    assert lazy.target is OrderedDict and repr(lazy).endswith('loaded>')
@@ -0,0 +1,58 @@
+import json
+import os
+
+import numpy as np
+
+from lca_disclosures import from_file
+from lca_disclosures.base.lazy import scan_json
+from lca_disclosures.base.ooc import ArrayMatrix
+
+TEST_DISCLOSURE = os.path.join('assets', 'Test_model_ps_0.json')
+
+
+def test_lazy_flows():
+    eager = from_file(TEST_DISCLOSURE)
+    lazy = from_file(TEST_DISCLOSURE, lazy=True)
+
+    result = lazy.aggregate()
+    assert np.allclose(result.emissions, eager.aggregate().emissions)
+    assert lazy.matrix_shape('Bf') == eager.matrix_shape('Bf')
+    assert not any(flows.loaded for flows in lazy.disclosure[:3])
+
+    assert lazy.background_flows.loaded is False
+    assert lazy.background_flows[0] == eager.background_flows[0]
+    assert lazy.background_flows.loaded
+    assert lazy.emission_flows == eager.emission_flows
+    assert lazy.data == eager.data
+
+
+def test_lazy_matrices_are_arrays():
+    lazy = from_file(TEST_DISCLOSURE, lazy=True)
+    eager = from_file(TEST_DISCLOSURE)
+
+    assert isinstance(lazy.Af, ArrayMatrix)
+    for name in ('Af', 'Ad', 'Bf'):
+        assert lazy.matrix_arrays(name)[0] is getattr(lazy, name).rows
+        assert getattr(lazy, name) == getattr(eager, name)
+
+
+def test_lazy_keys_in_strings(tmpdir):
+    # flow names that look like keys, with escaped quotes and backslashes, read in blocks of a few bytes
+    with open(TEST_DISCLOSURE) as fp:
+        j = json.load(fp)
+    j['foreground flows'][0]['name'] = 'odd \\"Af\\": {"shape": [1, 1], "data": []} \\\\'
+    j['background flows'][0]['ecoinvent_name'] = '"Bf": [], \\'
+    path = str(tmpdir.join('odd_names.json'))
+    with open(path, 'w') as fp:
+        json.dump(j, fp, indent=1)
+
+    eager = from_file(path)
+    with open(path, 'rb') as fp:
+        expected = scan_json(fp)
+        for block_size in (1, 2, 3, 7, 64):
+            assert scan_json(fp, block_size=block_size) == expected
+
+    lazy = from_file(path, lazy=True)
+    assert lazy.Bf == eager.Bf
+    assert lazy.foreground_flows[0]['name'] == j['foreground flows'][0]['name']
+    assert lazy.data == eager.data
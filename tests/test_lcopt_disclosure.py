@@ -1,8 +1,10 @@
 import os
 import json
+from concurrent.futures import ThreadPoolExecutor
 from lcopt import LcoptModel
 
 from lca_disclosures.lcopt.disclosure import LcoptDisclosure as DisclosureExporter
+from lca_disclosures.lcopt.links import LinkCache
 
 
 def test_lcopt_disclosure():
@@ -18,6 +20,30 @@ def test_lcopt_disclosure():
     assert os.path.isfile(disclosure_file)
 
 
+def test_parallel_columns():
+
+    model = LcoptModel(load=os.path.join('assets', 'Test_model.lcopt'), autosetup=False)
+    serial = DisclosureExporter(model, parameter_set=0)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        parallel = DisclosureExporter(model, parameter_set=0, executor=executor, block_size=1)
+
+    assert parallel.data == serial.data
+
+
+def test_shared_link_cache():
+
+    model = LcoptModel(load=os.path.join('assets', 'Test_model.lcopt'), autosetup=False)
+    cache = LinkCache()
+    first = DisclosureExporter(model, parameter_set=0, link_cache=cache)
+    misses = cache.stats['misses']
+    second = DisclosureExporter(model, parameter_set=0, link_cache=cache)
+
+    assert cache.stats['misses'] == misses
+    assert cache.stats['hits'] >= misses
+    assert second.data == first.data == DisclosureExporter(model, parameter_set=0, link_cache=None).data
+
+
 def validate_lcopt_disclosure():
     model = LcoptModel(load=os.path.join('assets', 'Test_model.lcopt'))
     lde = DisclosureExporter(model, parameter_set=0)
@@ -0,0 +1,33 @@
+from types import SimpleNamespace
+
+from lca_disclosures.lcopt.links import LinkCache, resolve_links
+
+
+def _model():
+    return SimpleNamespace(external_databases=[
+        {'name': 'Ecoinvent3_3_cutoff', 'items': {('Ecoinvent3_3_cutoff', 'a'): {'name': 'electricity'}}},
+        {'name': 'biosphere3', 'items': {('biosphere3', 'b'): {'name': 'Carbon dioxide'},
+                                         ('biosphere3', 'c'): {'name': 'Methane'}}},
+    ])
+
+
+def test_link_cache():
+
+    cache = LinkCache(maxsize=2)
+    links = [('biosphere3', 'b'), ('Ecoinvent3_3_cutoff', 'a'), ['biosphere3', 'b']]
+
+    resolved = resolve_links(_model(), links, cache)
+
+    assert [x['name'] for x in resolved] == ['Carbon dioxide', 'electricity', 'Carbon dioxide']
+    assert cache.stats == {'hits': 1, 'misses': 2, 'evictions': 0}
+    assert cache.hit_rate == 1 / 3
+
+    # a model without the databases is answered from the cache
+    assert resolve_links(SimpleNamespace(external_databases=[]), [('biosphere3', 'b')], cache) == [resolved[0]]
+
+    resolve_links(_model(), [('biosphere3', 'c')], cache)
+    assert cache.stats['evictions'] == 1
+    assert ('Ecoinvent3_3_cutoff', 'a') not in cache
+
+    cache.invalidate(database='biosphere3')
+    assert len(cache) == 0
@@ -0,0 +1,107 @@
+import os
+import numpy as np
+import pytest
+from lca_disclosures import from_file, merge_disclosures
+from lca_disclosures.base import StaticDisclosure
+from lca_disclosures.base.uncertainty import NORMAL, UNDEFINED, empty_uncertainty
+
+TEST_DISCLOSURE = os.path.join('assets', 'Test_model_ps_0.json')
+
+ELECTRICITY = {'index': 0, 'ecoinvent_name': 'market for electricity, medium voltage', 'ecoinvent_id': 'n/a',
+               'brightway_id': ['Ecoinvent3_3_cutoff', '8a1ef516cc78d560d3a677357b366de2'],
+               'unit': 'kilowatt hour', 'location': 'DE'}
+
+
+def _supplier():
+    return StaticDisclosure((
+        [{'index': 0, 'name': 'Steel', 'unit': 'kg', 'location': 'GLO'}],
+        [ELECTRICITY],
+        [],
+        [], [[[0, 0], 2.0]], []
+    ))
+
+
+def _consumer():
+    # 'Steel' is a cutoff: it is consumed by 'Car' but has no inputs of its own
+    return StaticDisclosure((
+        [{'index': 0, 'name': 'Car', 'unit': 'p', 'location': 'GLO'},
+         {'index': 1, 'name': 'Steel', 'unit': 'kg', 'location': 'GLO'}],
+        [ELECTRICITY],
+        [],
+        [[[1, 0], 1000.0]], [[[0, 0], 50.0]], []
+    ))
+
+
+def test_merge_block_diagonal():
+
+    my_disclosure = from_file(TEST_DISCLOSURE)
+
+    merged = merge_disclosures([my_disclosure, my_disclosure])
+
+    p = len(my_disclosure.foreground_flows)
+    assert len(merged.foreground_flows) == 2 * p
+    assert merged.background_flows == my_disclosure.background_flows
+    assert merged.emission_flows == my_disclosure.emission_flows
+    assert len(merged.Af) == 2 * len(my_disclosure.Af)
+    assert merged.Af[len(my_disclosure.Af)][0] == [my_disclosure.Af[0][0][0] + p, my_disclosure.Af[0][0][1] + p]
+
+
+def test_merge_links_cutoffs():
+
+    merged = merge_disclosures([_consumer(), _supplier()], links={(0, 1): (1, 0)})
+
+    assert [f['name'] for f in merged.foreground_flows] == ['Car', 'Steel']
+    assert [f['index'] for f in merged.foreground_flows] == [0, 1]
+    assert len(merged.background_flows) == 1
+    assert merged.Af == [[[1, 0], 1000.0]]
+    assert sorted(merged.Ad) == [[[0, 0], 50.0], [[0, 1], 2.0]]
+
+
+def test_merge_rejects_missing_links():
+
+    for links in ({(0, 1): (2, 0)}, {(0, 1): (-1, 0)}, {(0, 1): (1, 1)}, {(2, 0): (1, 0)}, {(-1, 0): (1, 0)},
+                  {(0, -1): (1, 0)}):
+        with pytest.raises(ValueError, match='does not exist'):
+            merge_disclosures([_consumer(), _supplier()], links=links)
+
+
+def test_merge_carries_uncertainty():
+
+    my_disclosure = from_file(TEST_DISCLOSURE)
+    Ad = empty_uncertainty(len(my_disclosure.Ad))
+    Ad['uncertainty type'] = NORMAL
+    Ad['scale'] = np.arange(len(Ad))
+    uncertain = StaticDisclosure(my_disclosure.disclosure, uncertainty={'Ad': Ad})
+
+    merged = merge_disclosures([uncertain, my_disclosure])
+
+    u = merged.uncertainty['Ad']
+    assert len(u) == len(merged.Ad)
+    rows, cols, _ = merged.matrix_arrays('Ad')
+    first = cols < len(my_disclosure.foreground_flows)
+    assert np.all(u['uncertainty type'][first] == NORMAL)
+    assert np.all(u['uncertainty type'][~first] == UNDEFINED)
+    assert sorted(u['scale'][first]) == sorted(Ad['scale'])
+    assert np.all(merged.uncertainty['Af']['uncertainty type'] == UNDEFINED)
+
+
+def test_merge_summed_entries_lose_uncertainty():
+
+    # two cutoffs of the consumer linked to the same supplier flow give the same Af entry
+    consumer = StaticDisclosure((
+        [{'index': 0, 'name': 'Car', 'unit': 'p', 'location': 'GLO'},
+         {'index': 1, 'name': 'Steel', 'unit': 'kg', 'location': 'GLO'},
+         {'index': 2, 'name': 'Steel', 'unit': 'kg', 'location': 'RER'}],
+        [ELECTRICITY],
+        [],
+        [[[1, 0], 600.0], [[2, 0], 400.0]], [[[0, 0], 50.0]], []
+    ))
+    Af = empty_uncertainty(2)
+    Af['uncertainty type'] = NORMAL
+    uncertain = StaticDisclosure(consumer.disclosure, uncertainty={'Af': Af})
+
+    with pytest.warns(UserWarning):
+        merged = merge_disclosures([uncertain, _supplier()], links={(0, 1): (1, 0), (0, 2): (1, 0)})
+
+    assert merged.Af == [[[1, 0], 1000.0]]
+    assert merged.uncertainty['Af']['uncertainty type'].tolist() == [UNDEFINED]
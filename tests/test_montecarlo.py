@@ -0,0 +1,59 @@
+import os
+import numpy as np
+import pytest
+from lca_disclosures import from_file
+from lca_disclosures.base import StaticDisclosure
+from lca_disclosures.base.uncertainty import NORMAL, TRIANGULAR, UNIFORM, empty_uncertainty, sample
+
+TEST_DISCLOSURE = os.path.join('assets', 'Test_model_ps_0.json')
+
+
+def _uncertain_disclosure():
+    my_disclosure = from_file(TEST_DISCLOSURE)
+
+    Af = empty_uncertainty(len(my_disclosure.Af))
+    Af['uncertainty type'] = TRIANGULAR
+    Af['minimum'], Af['maximum'] = 0.5, 1.5
+    Ad = empty_uncertainty(len(my_disclosure.Ad))
+    Ad['uncertainty type'] = NORMAL
+    Ad['scale'] = 0.1
+
+    return StaticDisclosure(my_disclosure.disclosure, uncertainty={'Af': Af, 'Ad': Ad})
+
+
+def test_monte_carlo():
+
+    my_disclosure = _uncertain_disclosure()
+
+    result = my_disclosure.monte_carlo(iterations=2000, seed=42, batch_size=300)
+
+    assert result.background.shape == (2000, len(my_disclosure.background_flows))
+    assert result.emissions.shape == (2000, len(my_disclosure.emission_flows))
+    assert np.allclose(result.activity[:, 0], 1)
+    assert np.allclose(result.mean().background, my_disclosure.aggregate().background, rtol=0.05)
+    assert np.all(result.std().background > 0)
+
+
+def test_monte_carlo_deterministic():
+
+    my_disclosure = _uncertain_disclosure()
+
+    serial = my_disclosure.monte_carlo(iterations=50, seed=1, batch_size=10)
+    parallel = my_disclosure.monte_carlo(iterations=50, seed=1, batch_size=10, processes=2)
+
+    assert np.array_equal(serial.background, parallel.background)
+
+
+def test_incomplete_parameters_are_rejected():
+
+    u = empty_uncertainty(3)
+    u['uncertainty type'] = [NORMAL, UNIFORM, UNIFORM]
+    u['scale'][0] = 0.1
+    u['minimum'][1:], u['maximum'][1] = 0.5, 1.5
+    with pytest.raises(ValueError, match='entry 2 .* has no maximum'):
+        sample(u, np.ones(3), 10, np.random.default_rng(0))
+
+    my_disclosure = _uncertain_disclosure()
+    my_disclosure.uncertainty['Ad']['scale'][1] = np.nan
+    with pytest.raises(ValueError, match='entry 1'):
+        my_disclosure.monte_carlo(iterations=10, seed=42)
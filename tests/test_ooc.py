@@ -0,0 +1,93 @@
+import io
+import json
+import os
+
+import numpy as np
+import pytest
+
+from lca_disclosures import from_file
+from lca_disclosures.base import StaticDisclosure
+from lca_disclosures.base.lazy import iter_coo
+from lca_disclosures.base.ooc import ChunkedMatrix
+from lca_disclosures.base.validation import _chunked_duplicates
+
+TEST_DISCLOSURE = os.path.join('assets', 'Test_model_ps_0.json')
+
+
+def test_out_of_core(tmpdir):
+    eager = from_file(TEST_DISCLOSURE)
+    chunked = from_file(TEST_DISCLOSURE, out_of_core=str(tmpdir.join('store')), chunk_size=2)
+
+    assert isinstance(chunked.Ad, ChunkedMatrix)
+    assert chunked.Ad == eager.Ad
+    assert chunked.validate() == eager.validate() == []
+    assert list(chunked.cutoffs) == list(eager.cutoffs)
+    assert np.allclose(chunked.aggregate().emissions, eager.aggregate().emissions)
+
+    sparse, report = chunked.sparsify(atol=0.5)
+    expected, expected_report = eager.sparsify(atol=0.5)
+    assert isinstance(sparse.Bf, ChunkedMatrix)
+    assert sparse.Bf == expected.Bf
+    assert report == expected_report
+
+    # the streamed file is identical to one written with json.dump
+    streamed = chunked.write_json(str(tmpdir.join('streamed')))
+    dumped = eager.write_json(str(tmpdir.join('dumped')))
+    with open(streamed) as a, open(dumped) as b:
+        assert a.read() == b.read()
+
+
+def test_out_of_core_keys_in_strings(tmpdir):
+    with open(TEST_DISCLOSURE) as fp:
+        j = json.load(fp)
+    j['foreground flows'][0]['name'] = 'odd \\"Af\\": {"shape": [1, 1], "data": []}'
+    j['Af'] = {'data': j['Af']['data'], 'shape': j['Af']['shape']}
+    path = str(tmpdir.join('odd_names.json'))
+    with open(path, 'w') as fp:
+        json.dump(j, fp)
+
+    eager = from_file(path)
+    chunked = from_file(path, out_of_core=str(tmpdir.join('store')), chunk_size=2)
+    assert chunked.Af == eager.Af
+    assert chunked.foreground_flows[0]['name'] == j['foreground flows'][0]['name']
+
+    # a matrix without a shape is an error, not the next matrix's shape
+    del j['Ad']['shape']
+    with open(path, 'w') as fp:
+        json.dump(j, fp)
+    with pytest.raises(ValueError, match='Malformed Ad'):
+        from_file(path, out_of_core=str(tmpdir.join('other')))
+
+
+def test_iter_coo_blocks():
+    raw = b'[[[0, 1], 1.5], [[12, 3], -2e-05],\n [[4, 56], 7]]'
+    for block_size in (1, 2, 5, 100):
+        for chunk_size in (1, 2, 3):
+            chunks = list(iter_coo(io.BytesIO(raw), (0, len(raw)), chunk_size, block_size=block_size))
+            assert [len(vals) for _, _, vals in chunks][0] == chunk_size
+            rows, cols, vals = (np.concatenate(parts) for parts in zip(*chunks))
+            assert rows.tolist() == [0, 12, 4] and cols.tolist() == [1, 3, 56]
+            assert vals.tolist() == [1.5, -2e-05, 7.0]
+    assert list(iter_coo(io.BytesIO(b'[ ]'), (0, 3), 2)) == []
+
+
+def test_out_of_core_duplicates(tmpdir):
+    d = from_file(TEST_DISCLOSURE, out_of_core=True, chunk_size=3)
+    entries = list(d.Bf) + [d.Bf[4], d.Bf[0]]
+    dup = StaticDisclosure(d.disclosure[:5] + (entries,), out_of_core=str(tmpdir), chunk_size=3)
+    issues = dup.validate()
+    assert [(i.code, i.indices.tolist()) for i in issues] == [('duplicate-entry', [len(entries) - 2, len(entries) - 1])]
+
+
+def test_duplicate_check_reads_twice():
+    # many column blocks, but the entries are read only twice: once to count columns, once to partition them
+    rows = np.array([0, 1, 0, 2, 1, 0, 3, 1], dtype=np.int64)
+    cols = np.array([0, 1, 2, 3, 1, 4, 5, 1], dtype=np.int64)
+    passes = []
+
+    def chunks():
+        passes.append(1)
+        return [(rows[i:i + 2], cols[i:i + 2], np.ones(2)) for i in range(0, len(rows), 2)]
+
+    assert sorted(_chunked_duplicates(chunks, (4, 6), 1).tolist()) == [4, 7]
+    assert len(passes) == 2
@@ -0,0 +1,30 @@
+import os
+from lca_disclosures import from_file
+from lca_disclosures.base.profiling import DisclosureStats
+
+TEST_DISCLOSURE = os.path.join('assets', 'Test_model_ps_0.json')
+
+
+def test_profiling_disabled_by_default():
+
+    my_disclosure = from_file(TEST_DISCLOSURE)
+
+    assert my_disclosure.stats is None
+
+
+def test_profiling_stats():
+
+    seen = []
+    my_disclosure = from_file(TEST_DISCLOSURE, profile_hook=lambda stats, record: seen.append(record.name))
+
+    stats = my_disclosure.stats
+    assert isinstance(stats, DisclosureStats)
+    assert seen == ['parse', 'validate', 'prepare_disclosure']
+
+    assert stats.stages['prepare_disclosure'].calls == 1
+    assert stats.stages['prepare_disclosure'].wall_time >= stats.stages['parse'].wall_time
+    assert stats.stages['parse'].peak_memory > 0
+
+    assert stats.counts['p'] == 3
+    assert stats.counts['nnz_Af'] == len(my_disclosure.Af)
+    assert 'prepare_disclosure' in stats.report()
@@ -0,0 +1,105 @@
+import json
+import os
+import shutil
+import tempfile
+
+import pytest
+
+from lca_disclosures import from_file
+from lca_disclosures.base import FlowRegistry
+
+TEST_DISCLOSURE = os.path.join('assets', 'Test_model_ps_0.json')
+
+
+def test_registry_round_trip():
+    original = from_file(TEST_DISCLOSURE)
+    folder = tempfile.mkdtemp()
+    try:
+        registry = FlowRegistry(os.path.join(folder, 'flows.json'))
+        first = original.write_json(os.path.join(folder, 'a'), registry=registry)
+        second = original.write_json(os.path.join(folder, 'b'), registry=registry)
+
+        # each flow is stored once, however many disclosures refer to it
+        assert len(registry) == len(original.background_flows) + len(original.emission_flows)
+        with open(first) as fp:
+            assert json.load(fp)['background flows'] == {'registry': list(range(len(original.background_flows)))}
+
+        a = from_file(first)
+        b = from_file(second)
+        assert a.background_flows == original.background_flows
+        assert a.emission_flows == original.emission_flows
+        assert a.background_flows.registry is b.background_flows.registry
+        assert not list(a.diff(original))
+
+        # writing without a registry expands the references
+        plain = a.write_json(os.path.join(folder, 'c'))
+        with open(plain) as fp:
+            assert json.load(fp)['background flows'] == original.background_flows
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_registry_two_writers():
+    original = from_file(TEST_DISCLOSURE)
+    folder = tempfile.mkdtemp()
+    try:
+        path = os.path.join(folder, 'flows.json')
+        first = original.write_json(os.path.join(folder, 'a'), registry=FlowRegistry(path))
+        a = from_file(first)
+
+        # a second writer adds a background flow to the same registry file
+        with open(TEST_DISCLOSURE) as fp:
+            j = json.load(fp)
+        n = len(j['background flows'])
+        j['background flows'].append({'index': n, 'ecoinvent_name': 'new supply', 'brightway_id': ['db', 'new'],
+                                      'unit': 'kg', 'location': 'GLO'})
+        j['Ad']['shape'][0] += 1
+        j['Ad']['data'].append([[n, 0], 0.25])
+        extended = os.path.join(folder, 'extended.json')
+        with open(extended, 'w') as fp:
+            json.dump(j, fp)
+        second = from_file(extended).write_json(os.path.join(folder, 'b'), registry=FlowRegistry(path))
+
+        b = from_file(second)
+        assert len(list(b.background_flows)) == n + 1
+        assert b.background_flows[n]['ecoinvent_name'] == 'new supply'
+        assert a.background_flows.registry is b.background_flows.registry
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_registry_rejects_conflicting_metadata():
+    original = from_file(TEST_DISCLOSURE)
+    registry = FlowRegistry()
+    flow = dict(original.background_flows[0])
+    registry.intern(flow, 'background flows')
+    registry.intern(dict(flow, index=5), 'background flows')
+
+    with pytest.raises(ValueError):
+        registry.intern(dict(flow, location='somewhere else'), 'background flows')
+    with pytest.raises(ValueError):
+        registry.flow('background flows', 1)
+
+
+def test_registry_interleaved_writers(tmpdir):
+    original = from_file(TEST_DISCLOSURE)
+    path = str(tmpdir.join('flows.json'))
+    x, y = (dict(original.background_flows[0], ecoinvent_name=name, brightway_id=['db', name]) for name in 'XY')
+
+    a, b = FlowRegistry(path), FlowRegistry(path)
+    assert a.intern(x, 'background flows') == 0
+    assert b.intern(y, 'background flows') == 1
+    assert a.intern(y, 'background flows') == 1
+    a.save()
+    b.save()
+
+    with open(path) as fp:
+        assert [f['ecoinvent_name'] for f in json.load(fp)['background flows']] == ['X', 'Y']
+    assert FlowRegistry(path).flow('background flows', 0)['ecoinvent_name'] == 'X'
+    assert not os.path.exists(path + '.lock')
+
+    # an unsaved registry may not be saved over flows it does not hold
+    other = FlowRegistry()
+    other.intern(y, 'background flows')
+    with pytest.raises(ValueError):
+        other.save(path)
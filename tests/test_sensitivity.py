@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+from lca_disclosures.base import StaticDisclosure
+
+from test_aggregate import _looped
+
+
+def _score(disclosure, weights):
+    return weights.dot(disclosure.aggregate(method='lu').background)
+
+
+def test_sensitivity_matches_finite_differences():
+    d = _looped()
+    weights = np.array([2.0])
+    result = d.sensitivity(background=weights)
+    assert np.isclose(result.score, _score(d, weights))
+
+    h = 1e-7
+    for name, index in (('Af', 1), ('Af', 2), ('Ad', 1)):
+        entries = [list(e) for e in getattr(d, name)]
+        entries[index] = [entries[index][0], entries[index][1] + h]
+        matrices = {'Af': d.Af, 'Ad': d.Ad, 'Bf': d.Bf, name: entries}
+        perturbed = StaticDisclosure(d.disclosure[:3] + (matrices['Af'], matrices['Ad'], matrices['Bf']))
+        numeric = (_score(perturbed, weights) - result.score) / h
+        assert np.isclose(result.sensitivities[name][index], numeric, rtol=1e-5)
+
+    ranked = result.ranked(top=2)
+    assert len(ranked) == 2
+    assert abs(ranked['elasticity'][0]) >= abs(ranked['elasticity'][1])
+
+
+def test_sensitivity_needs_foreground():
+    d = _looped()
+    empty = StaticDisclosure(([], d.background_flows, [], [], [], []))
+    with pytest.raises(ValueError, match='no foreground flows'):
+        empty.sensitivity(background=np.array([1.0]))
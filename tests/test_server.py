@@ -0,0 +1,186 @@
+import asyncio
+import io
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from lca_disclosures import from_file
+from lca_disclosures.server import DisclosureService, build_disclosure
+
+ASSETS = 'assets'
+TEST_DISCLOSURE = 'Test_model_ps_0.json'
+
+
+async def _raw(port, target):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write('GET {} HTTP/1.1\r\nHost: localhost\r\n\r\n'.format(target).encode('latin-1'))
+    response = await reader.read()
+    writer.close()
+    return response
+
+
+async def _get(port, target):
+    response = await _raw(port, target)
+    head, body = response.split(b'\r\n\r\n', 1)
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split()[1])
+    headers = dict(line.split(': ', 1) for line in lines[1:])
+    if headers.get('Transfer-Encoding') == 'chunked':
+        chunks = []
+        while True:
+            size, body = body.split(b'\r\n', 1)
+            size = int(size, 16)
+            if not size:
+                break
+            chunks.append(body[:size])
+            body = body[size + 2:]
+        body = b''.join(chunks)
+    return status, body
+
+
+def _run(service, *targets, fetch=_get):
+    async def main():
+        server = await service.start(port=0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            return await asyncio.gather(*(fetch(port, t) for t in targets))
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(main())
+    finally:
+        loop.close()
+
+
+def test_serve_json_and_npz():
+    expected = from_file(os.path.join(ASSETS, TEST_DISCLOSURE))
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        service = DisclosureService(root=ASSETS, executor=executor)
+        (status, body), (npz_status, npz) = _run(service, '/disclosure?path=' + TEST_DISCLOSURE,
+                                                 '/disclosure?path={}&format=npz'.format(TEST_DISCLOSURE))
+
+    assert status == 200 and json.loads(body.decode('utf-8')) == expected.data
+    assert npz_status == 200
+    arrays = np.load(io.BytesIO(npz))
+    assert np.array_equal(arrays['Bf_vals'], expected.matrix_arrays('Bf')[2])
+    assert json.loads(arrays['flows'].tobytes().decode('utf-8'))['foreground flows'] == expected.data['foreground flows']
+
+
+def test_cache_and_coalescing():
+    calls = []
+    lock = threading.Lock()
+
+    def slow_build(key):
+        with lock:
+            calls.append(key)
+        time.sleep(0.2)
+        return build_disclosure(key)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        service = DisclosureService(root=ASSETS, executor=executor, build=slow_build, cache_size=1)
+        target = '/disclosure?path=' + TEST_DISCLOSURE
+        results = _run(service, target, target, target)
+        assert [status for status, _ in results] == [200, 200, 200]
+        assert len(calls) == 1
+        assert service.cache.stats['misses'] == 1 and service.cache.stats['coalesced'] == 2
+
+        (status, _), = _run(service, target)
+        assert status == 200 and service.cache.stats['hits'] == 1
+
+
+def test_bad_requests():
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        service = DisclosureService(root=ASSETS, executor=executor)
+        results = _run(service, '/disclosure?path=../setup.py', '/disclosure?path=missing.json', '/nothing',
+                       '/disclosure?source=other')
+    assert [status for status, _ in results] == [400, 404, 404, 400]
+
+
+def test_changed_file_is_rebuilt(tmpdir):
+    path = str(tmpdir.join(TEST_DISCLOSURE))
+    with open(os.path.join(ASSETS, TEST_DISCLOSURE)) as fp:
+        j = json.load(fp)
+    with open(path, 'w') as fp:
+        json.dump(j, fp)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        service = DisclosureService(root=str(tmpdir), executor=executor)
+        target = '/disclosure?path=' + TEST_DISCLOSURE
+        (status, body), = _run(service, target)
+
+        j['Af']['data'][0][1] *= 2
+        with open(path, 'w') as fp:
+            json.dump(j, fp)
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+        (status, changed), = _run(service, target)
+
+    assert json.loads(changed.decode('utf-8'))['Af']['data'][0][1] == j['Af']['data'][0][1]
+    assert json.loads(body.decode('utf-8'))['Af']['data'][0][1] != j['Af']['data'][0][1]
+    assert service.cache.stats['misses'] == 2
+
+
+class _Unencodable(object):
+    data = {'foreground flows': [], 'Af': object()}
+
+
+def test_stream_failure_aborts_response():
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        service = DisclosureService(root=ASSETS, executor=executor, build=lambda key: _Unencodable())
+        response, = _run(service, '/disclosure?path=' + TEST_DISCLOSURE, fetch=_raw)
+
+    assert response.startswith(b'HTTP/1.1 200')
+    assert b'HTTP/1.1 500' not in response
+    assert not response.endswith(b'0\r\n\r\n')
+
+
+class _Recorded(object):
+    """
+    A disclosure that records the threads its data is read from
+    """
+    def __init__(self, disclosure):
+        self.disclosure = disclosure
+        self.threads = []
+
+    @property
+    def data(self):
+        self.threads.append(threading.current_thread().name)
+        return self.disclosure.data
+
+    def __getattr__(self, name):
+        return getattr(self.disclosure, name)
+
+
+def test_responses_are_encoded_off_the_loop():
+    expected = from_file(os.path.join(ASSETS, TEST_DISCLOSURE))
+    recorded = _Recorded(expected)
+    with ThreadPoolExecutor(max_workers=1) as executor, \
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix='encoder') as encoder:
+        service = DisclosureService(root=ASSETS, executor=executor, encoder=encoder, build=lambda key: recorded)
+        (status, body), (npz_status, _) = _run(service, '/disclosure?path=' + TEST_DISCLOSURE,
+                                               '/disclosure?path={}&format=npz'.format(TEST_DISCLOSURE))
+
+    assert status == npz_status == 200
+    assert json.loads(body.decode('utf-8')) == expected.data
+    assert recorded.threads and all(name.startswith('encoder') for name in recorded.threads)
+
+
+def test_bw2_keys_follow_database_version():
+    expected = from_file(os.path.join(ASSETS, TEST_DISCLOSURE))
+    versions = ['2020-01-01', '2020-01-01', '2020-02-01']
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        service = DisclosureService(executor=executor, build=lambda key: expected,
+                                    version=lambda project, database: versions.pop(0))
+        target = '/disclosure?source=bw2&project=p&database=d'
+        for _ in range(3):
+            (status, _), = _run(service, target)
+            assert status == 200
+
+    assert service.cache.stats['misses'] == 2 and service.cache.stats['hits'] == 1
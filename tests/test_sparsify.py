@@ -0,0 +1,60 @@
+import os
+import json
+from lca_disclosures import from_file
+from lca_disclosures.base import StaticDisclosure
+from lca_disclosures.base.ooc import ChunkedMatrix
+from lca_disclosures.base.uncertainty import empty_uncertainty
+
+TEST_DISCLOSURE = os.path.join('assets', 'Test_model_ps_0.json')
+
+
+def _noisy_disclosure(tmpdir, **kwargs):
+    with open(TEST_DISCLOSURE) as fp:
+        j = json.load(fp)
+    j['Ad']['data'].append([[0, 0], 1e-15])
+    j['Bf']['data'].append([[3, 1], 2e-9])
+    j['Bf']['data'][0][1] = 1.0000001
+    noisy_file = str(tmpdir.join('noisy.json'))
+    with open(noisy_file, 'w') as fp:
+        json.dump(j, fp)
+    return from_file(noisy_file, **kwargs)
+
+
+def test_sparsify_thresholds(tmpdir):
+
+    my_disclosure = _noisy_disclosure(tmpdir)
+
+    sparse, report = my_disclosure.sparsify(atol=1e-12, tolerances={'Bf': {'rtol': 1e-6}})
+
+    assert report.removed == {'Af': 0, 'Ad': 1, 'Bf': 1}
+    assert len(sparse.Ad) == len(my_disclosure.Ad) - 1
+    assert report.size_after < report.size_before
+    assert 0 < report.emissions_error < 1e-8
+    assert report.background_error < 1e-14
+
+
+def test_sparsify_precision(tmpdir):
+
+    my_disclosure = _noisy_disclosure(tmpdir, sparsification={'precision': 3})
+
+    assert my_disclosure.Bf[0][1] == 1.0
+    assert my_disclosure.sparsify_report.removed == {'Af': 0, 'Ad': 0, 'Bf': 0}
+
+    sparse, report = my_disclosure.sparsify(precision='float32')
+    assert sparse.Bf[-1][1] == 2e-9
+
+
+def test_sparsify_empty_chunked_matrix(tmpdir):
+
+    my_disclosure = from_file(TEST_DISCLOSURE)
+    matrices = tuple(ChunkedMatrix.write(str(tmpdir.join(name)),
+                                         [my_disclosure.matrix_arrays(name)] if name != 'Bf' else [])
+                     for name in ('Af', 'Ad', 'Bf'))
+    uncertainty = {name: empty_uncertainty(len(getattr(my_disclosure, name)) if name != 'Bf' else 0)
+                   for name in ('Af', 'Ad', 'Bf')}
+    chunked = StaticDisclosure(my_disclosure.disclosure[:3] + matrices, uncertainty=uncertainty)
+
+    sparse, report = chunked.sparsify(atol=1e-12)
+
+    assert sparse.uncertainty['Bf'].shape == (0,)
+    assert len(sparse.uncertainty['Ad']) == len(sparse.Ad)
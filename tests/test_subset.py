@@ -0,0 +1,37 @@
+import os
+from lca_disclosures import from_file
+
+TEST_DISCLOSURE = os.path.join('assets', 'Test_model_ps_0.json')
+
+
+def test_subset_full():
+
+    my_disclosure = from_file(TEST_DISCLOSURE)
+
+    subset = my_disclosure.subset()
+
+    assert subset.data == my_disclosure.data
+
+
+def test_subset_depth():
+
+    my_disclosure = from_file(TEST_DISCLOSURE)
+
+    subset = my_disclosure.subset(depth=1)
+
+    # the functional unit's direct input is kept as a cutoff
+    assert [f['name'] for f in subset.foreground_flows] == ['Output 3', 'Output 2']
+    assert subset.Af == [[[1, 0], 1.0]]
+    assert next(subset.cutoffs)['name'] == 'Output 2'
+    assert len(subset.background_flows) == 1
+    assert all(c == 0 for (r, c), v in subset.Bf)
+
+
+def test_subset_root():
+
+    my_disclosure = from_file(TEST_DISCLOSURE)
+
+    subset = my_disclosure.subset(root=2)
+
+    assert [f['name'] for f in subset.foreground_flows] == ['Output 2', 'Output 1']
+    assert [f['index'] for f in subset.foreground_flows] == [0, 1]
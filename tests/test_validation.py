@@ -0,0 +1,61 @@
+import os
+
+import pytest
+
+from lca_disclosures import from_file
+from lca_disclosures.base import StaticDisclosure
+from lca_disclosures.base.validation import DisclosureValidationError
+
+TEST_DISCLOSURE = os.path.join('assets', 'Test_model_ps_0.json')
+
+FOREGROUND = [{'index': 0, 'name': 'Car', 'unit': 'p', 'location': 'GLO'},
+              {'index': 1, 'name': 'Steel', 'unit': 'kg', 'location': 'GLO'}]
+
+
+def _codes(issues):
+    return {(i.section, i.code): i.indices.tolist() for i in issues}
+
+
+def test_valid_disclosure():
+    assert from_file(TEST_DISCLOSURE).validate() == []
+
+
+def test_invalid_disclosure():
+    d = StaticDisclosure((
+        FOREGROUND[::-1],
+        [],
+        [],
+        [[[1, 0], 2.0], [[0, 1], 0.5], [[1, 0], 1.0], [[2, 0], 1.0]], [[[0, 0], 1.0]], []
+    ))
+    codes = _codes(d.validate())
+    assert codes[('Af', 'duplicate-entry')] == [2]
+    assert codes[('Af', 'index-out-of-range')] == [3]
+    assert codes[('Ad', 'index-out-of-range')] == [0]
+    assert codes[('foreground flows', 'flow-index-mismatch')] == [0, 1]
+
+
+def test_functional_unit_consumed_is_a_warning():
+    d = StaticDisclosure((FOREGROUND, [], [], [[[0, 1], 0.5], [[1, 0], 1.0]], [], []))
+    issues = d.validate()
+    assert [(i.code, i.severity) for i in issues] == [('functional-unit-consumed', 'warning')]
+
+
+def test_validation_on_load(tmpdir):
+    d = StaticDisclosure((FOREGROUND, [], [], [[[0, 5], 1.0]], [], []), folder_path=str(tmpdir), filename='bad')
+    path = d.write_json()
+    with pytest.raises(DisclosureValidationError) as e:
+        from_file(path)
+    assert e.value.issues[0].code == 'index-out-of-range'
+    assert from_file(path, validate=False).Af == [[[0, 5], 1.0]]
+
+
+class _ShortFlowList(tuple):
+    # a flow list whose len() overstates what iteration gives, as a stale registry list could
+    def __len__(self):
+        return super(_ShortFlowList, self).__len__() + 1
+
+
+def test_flow_count_mismatch():
+    d = StaticDisclosure((FOREGROUND, _ShortFlowList(), [], [], [], []))
+    codes = _codes(d.validate())
+    assert ('background flows', 'flow-count-mismatch') in codes